@@ -13,7 +13,7 @@ import sys
 from warnings import warn
 
 from .utils.config import load_config
-from .utils.database import PanMongo
+from .utils.database import get_shared_db
 from .utils.logger import get_root_logger
 
 try:
@@ -100,19 +100,35 @@ class PanBase(object):
             else:
                 self.config['simulator'] = kwargs['simulator']
 
-        # Set up connection to database
-        self.db = PanMongo()
+    @property
+    def db(self):
+        """ Database connection, shared by every object unless one is set """
+        db = self.__dict__.get('_db')
+        if db is None:
+            db = get_shared_db(**self.config.get('db', dict()))
 
-    def __getstate__(self):  # pragma: no cover
+        return db
+
+    @db.setter
+    def db(self, db):
+        self._db = db
+
+    def __getstate__(self):
         d = dict(self.__dict__)
 
         if 'logger' in d:
             del d['logger']
 
-        if 'db' in d:
-            del d['db']
+        if '_db' in d:
+            del d['_db']
 
         return d
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        # Restore what `__getstate__` removed, e.g. in a worker process
+        self.logger = _logger
+
 
 from .core import POCS
@@ -1,5 +1,6 @@
 from .. import PanBase
 from ..focuser.focuser import AbstractFocuser
+from ..images import get_image_pipeline
 from ..utils import error
 from ..utils import listify
 from ..utils import load_module
@@ -7,8 +8,11 @@ from ..utils import load_module
 import re
 import shutil
 import subprocess
+import time
 import yaml
 
+from threading import Event
+
 
 class AbstractCamera(PanBase):
 
@@ -87,6 +91,11 @@ class AbstractCamera(PanBase):
         """ File extension for images saved by camera """
         return self._file_extension
 
+    @property
+    def pipeline(self):
+        """ The `~pocs.images.ImagePipeline` shared by the cameras """
+        return get_image_pipeline(**self.config.get('image_pipeline', dict()))
+
     @property
     def CCD_temp(self):
         """
@@ -153,6 +162,52 @@ class AbstractCamera(PanBase):
     def process_exposure(self, *args, **kwargs):
         raise NotImplementedError
 
+##################################################################################################
+# Private Methods
+##################################################################################################
+
+    def _process_in_pipeline(self, info, signal_event, stages, readout=None):
+        """ Queue an exposure with the `pipeline`, which sets `signal_event`
+
+        The job is queued when the exposure starts and begins with a `readout`
+        stage that waits for the image, so a worker of the pipeline (rather than
+        a thread per exposure) waits for each one. Queueing waits while the
+        pipeline is full, which holds up the observing state until the pipeline
+        catches up.
+
+        The states after observing use the primary camera's image, so its
+        `signal_event` is only set once all its stages have run. Other cameras
+        set it once the image is read out, leaving the pipeline to finish it in
+        the background.
+
+        Args:
+            info (dict): Header metadata saved for the image
+            signal_event (threading.Event): An event that is set signifying that the
+                camera is done with this exposure
+            stages (list): (name, callable) pairs, see `~pocs.images.ImagePipeline.submit`
+            readout (threading.Event or float, optional): An event set when the
+                image has been read out, or the number of seconds from now until
+                it is, defaults to no wait
+        """
+        if isinstance(readout, Event):
+            wait = readout.wait
+        else:
+            ready_at = time.monotonic() + (readout or 0.)
+
+            def wait():
+                time.sleep(max(ready_at - time.monotonic(), 0.))
+
+        def readout_stage(info):
+            wait()
+            if not info['is_primary']:
+                signal_event.set()
+
+        try:
+            self.pipeline.submit(info, [('readout', readout_stage)] + list(stages), done=signal_event)
+        except Exception:
+            signal_event.set()
+            raise
+
     def __str__(self):
         try:
             return "{} ({}) on {} with {} focuser".format(self.name, self.uid, self.port, self.focuser.name)
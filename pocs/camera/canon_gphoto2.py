@@ -3,7 +3,6 @@ import subprocess
 
 from astropy import units as u
 from threading import Event
-from threading import Timer
 
 from ..utils import current_time
 from ..utils import error
@@ -58,8 +57,8 @@ class Camera(AbstractGPhotoCamera):
         """Take an observation
 
         Gathers various header information, sets the file path, and calls `take_exposure`. Also creates a
-        `threading.Event` object and a `threading.Timer` object. The timer calls `process_exposure` after the
-        set amount of time is expired (`observation.exp_time + self.readout_time`).
+        `threading.Event` object and calls `process_exposure`, which queues the image with the shared pipeline
+        to be processed once it is read out (after `observation.exp_time + self.readout_time`).
 
         Note:
             If a `filename` is passed in it can either be a full path that includes the extension,
@@ -134,11 +133,8 @@ class Camera(AbstractGPhotoCamera):
         exp_time = kwargs.get('exp_time', observation.exp_time.value)
         self.take_exposure(seconds=exp_time, filename=file_path)
 
-        # Process the image after a set amount of time
-        wait_time = exp_time + self.readout_time
-        t = Timer(wait_time, self.process_exposure, (metadata, camera_event,))
-        t.name = '{}Thread'.format(self.name)
-        t.start()
+        # Queue the processing now, the pipeline waits for the readout
+        self.process_exposure(metadata, camera_event, readout=exp_time + self.readout_time)
 
         return camera_event
 
@@ -183,49 +179,60 @@ class Camera(AbstractGPhotoCamera):
         else:
             return proc
 
-    def process_exposure(self, info, signal_event):
+    def process_exposure(self, info, signal_event, readout=None):
         """Processes the exposure
 
-        Converts the CR2 to a FITS file. If the camera is a primary camera, extract the
+        Converts the CR2 to a FITS file, tile compressed unless the camera is a primary
+        camera. If the camera is a primary camera, extract the
         jpeg image and save metadata to mongo `current` collection. Saves metadata
-        to mongo `observations` collection for all images
+        to mongo `observations` collection for all images. The processing is done by the
+        shared image `pipeline`, see `_process_in_pipeline`.
 
         Args:
             info (dict): Header metadata saved for the image
             signal_event (threading.Event): An event that is set signifying that the
                 camera is done with this exposure
+            readout (float, optional): Seconds until the image is read out
         """
         image_id = info['image_id']
         file_path = info['file_path']
         self.logger.debug("Processing {}".format(image_id))
 
-        if info['is_primary']:
+        def thumbnail(info):
             try:
                 self.logger.debug("Extracting pretty image")
                 images.make_pretty_image(file_path, title=image_id, primary=True)
             except Exception as e:
                 self.logger.warning('Problem with extracting pretty image: {}'.format(e))
 
-        self.logger.debug("Converting CR2 -> FITS: {}".format(file_path))
-        fits_path = images.cr2_to_fits(file_path, headers=info, remove_cr2=True)
-
-        # Replace the path name with the FITS file
-        info['file_path'] = fits_path
-
+        def convert(info):
+            # Only the primary camera's images are kept uncompressed, others are compressed as they are written
+            fits_path = file_path.replace('.cr2', '.fits')
+            if not info['is_primary']:
+                fits_path = '{}.fz'.format(fits_path)
+
+            self.logger.debug("Converting CR2 -> FITS: {}".format(file_path))
+            fits_path = images.cr2_to_fits(file_path, fits_fname=fits_path, headers=info, remove_cr2=True)
+
+            # Replace the path name with the FITS file
+            info['file_path'] = fits_path
+
+        def index(info):
+            if info['is_primary']:
+                self.logger.debug("Adding current observation to db: {}".format(image_id))
+                self.db.insert_current('observations', info, include_collection=False)
+
+            self.logger.debug("Adding image metadata to db: {}".format(image_id))
+            self.db.insert('observations', {
+                'data': info,
+                'date': current_time(datetime=True),
+                'type': 'observations',
+                'image_id': image_id,
+            })
+
+        # The pretty image comes from the CR2, which is removed once converted
+        stages = [('convert', convert), ('index', index)]
         if info['is_primary']:
-            self.logger.debug("Adding current observation to db: {}".format(image_id))
-            self.db.insert_current('observations', info, include_collection=False)
-        else:
-            self.logger.debug('Compressing {}'.format(file_path))
-            images.fpack(fits_path)
-
-        self.logger.debug("Adding image metadata to db: {}".format(image_id))
-        self.db.observations.insert_one({
-            'data': info,
-            'date': current_time(datetime=True),
-            'type': 'observations',
-            'image_id': image_id,
-        })
+            stages.insert(0, ('thumbnail', thumbnail))
 
-        # Mark the event as done
-        signal_event.set()
+        self._process_in_pipeline(info, signal_event, stages, readout=readout)
@@ -1,4 +1,4 @@
-from threading import Thread, Event
+from threading import Event
 
 from astropy import units as u
 from astropy.io import fits
@@ -102,8 +102,8 @@ class Camera(AbstractCamera):
         """Take an observation
 
         Gathers various header information, sets the file path, and calls `take_exposure`. Also creates a
-        `threading.Event` object and a `threading.Thread` object. The Thread calls `process_exposure` after the
-        exposure had completed and the Event is set once `process_exposure` finishes.
+        `threading.Event` object and calls `process_exposure`, which queues the image with the shared pipeline
+        to be processed once the exposure has completed. The Event is set once the processing finishes.
 
         Args:
             observation (~pocs.scheduler.observation.Observation): Object describing the observation
@@ -127,6 +127,9 @@ class Camera(AbstractCamera):
             self.file_extension)
 
         file_path = "{}/fields/{}".format(image_dir, filename)
+        if not self.is_primary:
+            # Compress as the image is read out, rather than writing it and compressing later
+            file_path = '{}.fz'.format(file_path)
 
         image_id = '{}_{}_{}'.format(
             self.config['name'],
@@ -158,10 +161,8 @@ class Camera(AbstractCamera):
 
         exposure_event = self.take_exposure(seconds=exp_time, filename=file_path)
 
-        # Process the exposure once readout is complete
-        t = Thread(target=self.process_exposure, args=(metadata, camera_event, exposure_event))
-        t.name = '{}Thread'.format(self.name)
-        t.start()
+        # Queue the processing now, the pipeline waits for the readout
+        self.process_exposure(metadata, camera_event, exposure_event)
 
         return camera_event
 
@@ -195,62 +196,66 @@ class Camera(AbstractCamera):
         """
         Processes the exposure
 
+        The processing is done by the shared image `pipeline`, see `_process_in_pipeline`.
+
         Args:
             info (dict): Header metadata saved for the image
             signal_event (threading.Event): An event that is set signifying that the
                 camera is done with this exposure
             exposure_event (threading.Event, optional): An event that should be set
-                when the exposure is complete, triggering the processing.
+                when the exposure is complete, the pipeline waits for it before processing.
         """
-        # If passed an Event that signals the end of the exposure wait for it to be set
-        if exposure_event:
-            exposure_event.wait()
-
         image_id = info['image_id']
         file_path = info['file_path']
         self.logger.debug("Processing {}".format(image_id))
 
-        # Add FITS headers from info the same as images.cr2_to_fits()
-        self.logger.debug("Updating FITS headers: {}".format(file_path))
-        with fits.open(file_path, 'update') as f:
-            hdu = f[0]
-            hdu.header.set('IMAGEID', info.get('image_id', ''))
-            hdu.header.set('SEQID', info.get('sequence_id', ''))
-            hdu.header.set('FIELD', info.get('field_name', ''))
-            hdu.header.set('RA-MNT', info.get('ra_mnt', ''), 'Degrees')
-            hdu.header.set('HA-MNT', info.get('ha_mnt', ''), 'Degrees')
-            hdu.header.set('DEC-MNT', info.get('dec_mnt', ''), 'Degrees')
-            hdu.header.set('EQUINOX', info.get('equinox', ''))
-            hdu.header.set('AIRMASS', info.get('airmass', ''), 'Sec(z)')
-            hdu.header.set('FILTER', info.get('filter', ''))
-            hdu.header.set('LAT-OBS', info.get('latitude', ''), 'Degrees')
-            hdu.header.set('LONG-OBS', info.get('longitude', ''), 'Degrees')
-            hdu.header.set('ELEV-OBS', info.get('elevation', ''), 'Meters')
-            hdu.header.set('MOONSEP', info.get('moon_separation', ''), 'Degrees')
-            hdu.header.set('MOONFRAC', info.get('moon_fraction', ''))
-            hdu.header.set('CREATOR', info.get('creator', ''), 'POCS Software version')
-            hdu.header.set('INSTRUME', info.get('camera_uid', ''), 'Camera ID')
-            hdu.header.set('OBSERVER', info.get('observer', ''), 'PANOPTES Unit ID')
-            hdu.header.set('ORIGIN', info.get('origin', ''))
-            hdu.header.set('RA-RATE', info.get('tracking_rate_ra', ''), 'RA Tracking Rate')
-
+        def header(info):
+            # Add FITS headers from info the same as images.cr2_to_fits()
+            self.logger.debug("Updating FITS headers: {}".format(file_path))
+            with fits.open(file_path, 'update') as f:
+                hdu = images.get_image_hdu(f)
+                hdu.header.set('IMAGEID', info.get('image_id', ''))
+                hdu.header.set('SEQID', info.get('sequence_id', ''))
+                hdu.header.set('FIELD', info.get('field_name', ''))
+                hdu.header.set('RA-MNT', info.get('ra_mnt', ''), 'Degrees')
+                hdu.header.set('HA-MNT', info.get('ha_mnt', ''), 'Degrees')
+                hdu.header.set('DEC-MNT', info.get('dec_mnt', ''), 'Degrees')
+                hdu.header.set('EQUINOX', info.get('equinox', ''))
+                hdu.header.set('AIRMASS', info.get('airmass', ''), 'Sec(z)')
+                hdu.header.set('FILTER', info.get('filter', ''))
+                hdu.header.set('LAT-OBS', info.get('latitude', ''), 'Degrees')
+                hdu.header.set('LONG-OBS', info.get('longitude', ''), 'Degrees')
+                hdu.header.set('ELEV-OBS', info.get('elevation', ''), 'Meters')
+                hdu.header.set('MOONSEP', info.get('moon_separation', ''), 'Degrees')
+                hdu.header.set('MOONFRAC', info.get('moon_fraction', ''))
+                hdu.header.set('CREATOR', info.get('creator', ''), 'POCS Software version')
+                hdu.header.set('INSTRUME', info.get('camera_uid', ''), 'Camera ID')
+                hdu.header.set('OBSERVER', info.get('observer', ''), 'PANOPTES Unit ID')
+                hdu.header.set('ORIGIN', info.get('origin', ''))
+                hdu.header.set('RA-RATE', info.get('tracking_rate_ra', ''), 'RA Tracking Rate')
+
+        def thumbnail(info):
+            try:
+                self.logger.debug("Extracting pretty image")
+                images.make_pretty_image(file_path, title=info['field_name'], primary=True)
+            except Exception as e:
+                self.logger.warning('Problem with extracting pretty image: {}'.format(e))
+
+        def index(info):
+            if info['is_primary']:
+                self.logger.debug("Adding current observation to db: {}".format(image_id))
+                self.db.insert_current('observations', info, include_collection=False)
+
+            self.logger.debug("Adding image metadata to db: {}".format(image_id))
+            self.db.insert('observations', {
+                'data': info,
+                'date': current_time(datetime=True),
+                'type': 'observations',
+                'image_id': image_id,
+            })
+
+        stages = [('header', header), ('index', index)]
         if info['is_primary']:
-            self.logger.debug("Extracting pretty image")
-            images.make_pretty_image(file_path, title=info['field_name'], primary=True)
-
-            self.logger.debug("Adding current observation to db: {}".format(image_id))
-            self.db.insert_current('observations', info, include_collection=False)
-        else:
-            self.logger.debug('Compressing {}'.format(file_path))
-            images.fpack(file_path)
-
-        self.logger.debug("Adding image metadata to db: {}".format(image_id))
-        self.db.observations.insert_one({
-            'data': info,
-            'date': current_time(datetime=True),
-            'type': 'observations',
-            'image_id': image_id,
-        })
+            stages.insert(1, ('thumbnail', thumbnail))
 
-        # Mark the event as done
-        signal_event.set()
+        self._process_in_pipeline(info, signal_event, stages, readout=exposure_event)
@@ -23,6 +23,7 @@ from astropy.io import fits
 from astropy.time import Time
 
 from .. import PanBase
+from ..utils import images
 
 
 ################################################################################
@@ -371,11 +372,11 @@ class SBIGDriver(PanBase):
         self.logger.debug('Readout on {} complete'.format(handle))
 
         # Write to FITS file. Includes basic headers directly related to the camera only.
-        hdu = fits.PrimaryHDU(image_data, header=header)
         # Create the images directory if it doesn't already exist
         if os.path.dirname(filename):
             os.makedirs(os.path.dirname(filename), mode=0o766, exist_ok=True)
-        hdu.writeto(filename)
+        # Compressed straight from the readout buffer if the filename ends with .fz
+        images.write_fits(image_data, header, filename)
         self.logger.debug('Image written to {}'.format(filename))
 
         # Use Event to notify that exposure has completed.
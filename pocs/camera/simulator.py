@@ -2,7 +2,6 @@ import os
 import subprocess
 
 from threading import Event
-from threading import Timer
 
 from astropy import units as u
 
@@ -75,11 +74,8 @@ class Camera(AbstractCamera):
 
         self.take_exposure(seconds=exp_time, filename=file_path)
 
-        # Process the image after a set amount of time
-        wait_time = exp_time + self.readout_time
-        t = Timer(wait_time, self.process_exposure, (metadata, camera_event,))
-        t.name = '{}Thread'.format(self.name)
-        t.start()
+        # Queue the processing now, the pipeline waits for the readout
+        self.process_exposure(metadata, camera_event, readout=exp_time + self.readout_time)
 
         return camera_event
 
@@ -104,27 +100,30 @@ class Camera(AbstractCamera):
 
         return proc
 
-    def process_exposure(self, info, signal_event):
+    def process_exposure(self, info, signal_event, readout=None):
         """Processes the exposure
 
+        The processing is done by the shared image `pipeline`, see `_process_in_pipeline`.
+
         Args:
             info (dict): Header metadata saved for the image
             signal_event (threading.Event): An event that is set signifying that the
                 camera is done with this exposure
+            readout (float, optional): Seconds until the image is read out
         """
         image_id = info['image_id']
         file_path = info['file_path']
         self.logger.debug("Processing {} {}".format(image_id, file_path))
 
-        self.db.insert_current('observations', info, include_collection=False)
+        def index(info):
+            self.db.insert_current('observations', info, include_collection=False)
 
-        self.logger.debug("Adding image metadata to db: {}".format(image_id))
-        self.db.observations.insert_one({
-            'data': info,
-            'date': current_time(datetime=True),
-            'type': 'observations',
-            'image_id': image_id,
-        })
+            self.logger.debug("Adding image metadata to db: {}".format(image_id))
+            self.db.insert('observations', {
+                'data': info,
+                'date': current_time(datetime=True),
+                'type': 'observations',
+                'image_id': image_id,
+            })
 
-        # Mark the event as done
-        signal_event.set()
+        self._process_in_pipeline(info, signal_event, [('index', index)], readout=readout)
@@ -59,9 +59,14 @@ class POCS(PanStateMachine, PanBase):
         # Create our observatory, which does the bulk of the work
         self.observatory = Observatory(**kwargs)
 
+        # Make sure the db lookups made while running are indexed
+        self.db.ensure_indexes()
+
         self._connected = True
         self._initialized = False
         self._interrupted = False
+        # Commands that interrupted POCS, so a wait can tell if one arrived during it
+        self._num_interrupts = 0
 
         self.status()
 
@@ -217,6 +222,13 @@ class POCS(PanStateMachine, PanBase):
                     self.logger.debug('Terminating {} - PID {}'.format(name, proc.pid))
                     proc.terminate()
 
+            if self.has_messaging:
+                # Otherwise the unsent messages hold up the exit
+                self._msg_publisher.close()
+
+            # Write anything still queued for the db
+            self.db.flush()
+
             self._keep_running = False
             self._do_states = False
             self._connected = False
@@ -296,8 +308,6 @@ class POCS(PanStateMachine, PanBase):
             bool: Conditions are safe (True) or unsafe (False)
 
         """
-        assert self.db.current, self.logger.warning("No connection to sensors, can't check weather safety")
-
         # Always assume False
         is_safe = False
         record = {'safe': False}
@@ -307,7 +317,8 @@ class POCS(PanStateMachine, PanBase):
             is_safe = True
         else:
             try:
-                record = self.db.current.find_one({'type': 'weather'})
+                # May be cached for a few seconds, see the `db` config
+                record = self.db.get_current('weather')
 
                 is_safe = record['data'].get('safe', False)
                 timestamp = record['date']
@@ -349,9 +360,11 @@ class POCS(PanStateMachine, PanBase):
     def sleep(self, delay=2.5, with_status=True):
         """ Send POCS to sleep
 
-        Loops for `delay` number of seconds. If `delay` is more than 10.0 seconds,
-        `check_messages` will be called every 10.0 seconds in order to allow for
-        interrupt.
+        Waits for `delay` number of seconds. If `self.has_messaging` is True the
+        wait ends as soon as a command is received: the command is handled with
+        `check_messages` and, if it interrupted POCS (e.g. `park` or `shutdown`),
+        this returns straight away. Other commands, and interrupts from before
+        this sleep, don't shorten the wait.
 
         Keyword Arguments:
             delay {float} -- Number of seconds to sleep (default: 2.5)
@@ -363,23 +376,36 @@ class POCS(PanStateMachine, PanBase):
         if with_status and delay > 2.0:
             self.status()
 
-        # If delay is greater than 10 seconds check for messages during wait
-        if delay >= 10.0:
-            while delay >= 10.0:
-                time.sleep(10.0)
-                delay -= 10.0
-                self.check_messages()
+        if not self.has_messaging:
+            if delay > 0.0:
+                time.sleep(delay)
+            return
 
-        if delay > 0.0:
-            time.sleep(delay)
+        num_interrupts = self._num_interrupts
+
+        end_time = time.monotonic() + delay
+        while self._num_interrupts == num_interrupts:
+            remaining = end_time - time.monotonic()
+            if remaining <= 0.0:
+                break
+
+            # Blocks until a command arrives or the time is up
+            self._check_messages('command', self._cmd_queue, timeout=remaining)
+            self._check_messages('schedule', self._sched_queue)
 
     def wait_until_safe(self):
         """ Waits until weather is safe
 
         This will wait until a True value is returned from the safety check,
-        blocking until then.
+        blocking until then. The wait ends early if POCS is interrupted by a
+        command while waiting, see `sleep`.
         """
+        num_interrupts = self._num_interrupts
+
         while not self.is_safe():
+            if self._num_interrupts != num_interrupts:
+                break
+
             self.sleep(delay=self._safe_delay)
 
 
@@ -387,7 +413,15 @@ class POCS(PanStateMachine, PanBase):
 # Private Methods
 ##################################################################################################
 
-    def _check_messages(self, queue_type, q):
+    def _check_messages(self, queue_type, q, timeout=None):
+        """ Dispatch the messages waiting in `q`
+
+        Args:
+            queue_type (str): `command` or `schedule`
+            q (multiprocessing.Queue): Queue filled by the message loop
+            timeout (float, optional): Seconds to wait for a first message,
+                defaults to handling only what is already waiting
+        """
         cmd_dispatch = {
             'command': {
                 'park': self._interrupt_and_park,
@@ -398,7 +432,11 @@ class POCS(PanStateMachine, PanBase):
 
         while True:
             try:
-                msg_obj = q.get_nowait()
+                if timeout is None:
+                    msg_obj = q.get_nowait()
+                else:
+                    msg_obj = q.get(timeout=timeout)
+                    timeout = None
                 call_method = msg_obj.get('message', '')
                 # Lookup and call the method
                 self.logger.info('Message received: {} {}'.format(queue_type, call_method))
@@ -415,11 +453,13 @@ class POCS(PanStateMachine, PanBase):
     def _interrupt_and_park(self):
         self.logger.info('Park interrupt received')
         self._interrupted = True
+        self._num_interrupts += 1
         self.park()
 
     def _interrupt_and_shutdown(self):
         self.logger.info('Shutdown command received')
         self._interrupted = True
+        self._num_interrupts += 1
         self.power_down()
 
     def _setup_messaging(self):
@@ -440,7 +480,8 @@ class POCS(PanStateMachine, PanBase):
         self._cmd_queue = Queue()
         self._sched_queue = Queue()
 
-        self._msg_publisher = PanMessaging('publisher', msg_port)
+        self._msg_publisher = PanMessaging('publisher', msg_port,
+                                           codec=self.config['messaging'].get('codec', 'json'))
 
         def check_message_loop(cmd_queue):
             cmd_subscriber = PanMessaging('subscriber', cmd_port + 1)
@@ -450,18 +491,21 @@ class POCS(PanStateMachine, PanBase):
 
             try:
                 while self._do_cmd_check:
-                    # Poll for messages
+                    # Block until there is a message (timeout so the loop can end)
                     sockets = dict(poller.poll(500))  # 500 ms timeout
 
-                    if cmd_subscriber.subscriber in sockets and sockets[cmd_subscriber.subscriber] == zmq.POLLIN:
+                    if sockets.get(cmd_subscriber.subscriber) != zmq.POLLIN:
+                        continue
 
+                    # Take everything that has arrived
+                    while True:
                         msg_type, msg_obj = cmd_subscriber.receive_message(flags=zmq.NOBLOCK)
+                        if msg_type is None:
+                            break
 
-                        # Put the message in a queue to be processed
+                        # Put the message in a queue to be processed, which wakes `sleep`
                         if msg_type == 'POCS-CMD':
                             cmd_queue.put(msg_obj)
-
-                    time.sleep(1)
             except KeyboardInterrupt:
                 pass
 
@@ -1,4 +1,6 @@
 import os
+import threading
+import time
 
 import numpy as np
 
@@ -10,15 +12,24 @@ from astropy.coordinates import SkyCoord
 from astropy.io import fits
 from astropy.time import Time
 from ccdproc import CCDData
+from collections import defaultdict
+from collections import deque
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from skimage.feature import register_translation
 from skimage.util import view_as_blocks
 
 from pocs import PanBase
+from pocs.utils import error
 from pocs.utils import images as img_utils
 
 PointingError = namedtuple('PointingError', ['delta_ra', 'delta_dec', 'magnitude'])
 
+# `ImagePipeline` shared by the cameras, see `get_image_pipeline`
+_pipeline = None
+_pipeline_pid = None
+_pipeline_lock = threading.Lock()
+
 
 class Image(PanBase):
 
@@ -34,10 +45,8 @@ class Image(PanBase):
         super().__init__()
         assert os.path.exists(fits_file), self.logger.warning('File does not exist: {}'.format(fits_file))
 
-        if fits_file.endswith('.fz'):
-            fits_file = img_utils.fpack(fits_file, unpack=True)
-
-        assert fits_file.lower().endswith(('.fits')), self.logger.warning('File must end with .fits')
+        assert fits_file.lower().endswith(('.fits', '.fits.fz')), \
+            self.logger.warning('File must end with .fits or .fits.fz')
 
         self.wcs = None
         self._wcs_file = None
@@ -48,9 +57,11 @@ class Image(PanBase):
         else:
             self.wcs_file = fits_file
 
-        with fits.open(self.fits_file, 'readonly') as hdu:
-            self.header = hdu[0].header
-            self.data = hdu[0].data
+        # A compressed file is read directly, uncompressing in memory
+        with fits.open(self.fits_file, 'readonly') as hdu_list:
+            hdu = img_utils.get_image_hdu(hdu_list)
+            self.header = hdu.header
+            self.data = hdu.data
 
         assert 'DATE-OBS' in self.header, self.logger.warning('FITS file must contain the DATE-OBS keyword')
         assert 'EXPTIME' in self.header, self.logger.warning('FITS file must contain the EXPTIME keyword')
@@ -104,7 +115,8 @@ class Image(PanBase):
     def wcs_file(self, filename):
         if filename is not None:
             try:
-                w = wcs.WCS(filename)
+                with fits.open(filename, 'readonly') as hdu_list:
+                    w = wcs.WCS(img_utils.get_image_hdu(hdu_list).header)
                 assert w.is_celestial
 
                 self.wcs = w
@@ -198,6 +210,10 @@ class Image(PanBase):
         Args:
             **kwargs (dict): Options to be passed to `get_solve_field`
         """
+        if self.fits_file.endswith('.fz'):
+            # The solver needs an uncompressed file
+            self.fits_file = img_utils.fpack(self.fits_file, unpack=True)
+
         solve_info = img_utils.get_solve_field(self.fits_file,
                                                ra=self.header_pointing.ra.value,
                                                dec=self.header_pointing.dec.value,
@@ -212,8 +228,9 @@ class Image(PanBase):
         """Offset information between this image and a reference
 
         Args:
-            ref (str): Refernce image, either another `Image` instance or a
-                filename that will be read
+            ref (str): Refernce image, either another `Image` instance, a
+                filename that will be read or an `OffsetEngine` for the
+                reference (to compare several images against it)
             units (str, optional): Can be either `arcsec` or `pixel`
             rotation (bool, optional): If rotation information should be included,
                 defaults to True
@@ -225,12 +242,12 @@ class Image(PanBase):
             units = units.name
         assert units in ['pix', 'pixel', 'arcsec']
 
-        if isinstance(ref, str):
-            assert os.path.exists(ref)
-            ref = Image(ref)
-        assert isinstance(ref, Image)
+        if not isinstance(ref, OffsetEngine):
+            ref = OffsetEngine(ref)
+
+        offset_pix = ref.compute_offset_rotation(self.luminance)
+        ref = ref.image
 
-        offset_pix = compute_offset_rotation(ref.luminance, self.luminance)
         offset_pix['X'] *= 2
         offset_pix['Y'] *= 2
 
@@ -294,6 +311,9 @@ def compute_offset_rotation(im, imref, upsample_factor=20, subframe_size=200, co
     Detremine the rotation information for the center and, if `corner`, the
     four corner boxes, each of `subframe_size` pixels.
 
+    To compare several images against the same reference see `OffsetEngine`,
+    which only transforms the reference subframes once.
+
     Args:
         im (numpy.array): Image data
         imref (numpy.array): Comparison image data
@@ -306,13 +326,108 @@ def compute_offset_rotation(im, imref, upsample_factor=20, subframe_size=200, co
         dict: Rotation offset in `X`, `Y`, and `angle`
     """
     assert im.shape == imref.shape
-    ny, nx = im.shape
+
+    regions = _offset_regions(im.shape, subframe_size=subframe_size, corners=corners)
+
+    # Get im/imref offsets for each region
+    offsets = dict()
+    for region, midpoint in regions.items():
+        imarr = img_utils.crop_data(im, center=midpoint, box_width=subframe_size)
+        imrefarr = img_utils.crop_data(imref, center=midpoint, box_width=subframe_size)
+
+        shifts, err, h = register_translation(imrefarr, imarr, upsample_factor=upsample_factor)
+        offsets[region] = shifts
+
+    return _offset_rotation(regions, offsets)
+
+
+class OffsetEngine(PanBase):
+
+    def __init__(self, ref, upsample_factor=20, subframe_size=200, corners=True, *args, **kwargs):
+        """Compute offsets of images against a single reference image
+
+        `compute_offset_rotation` transforms the subframes of both images every
+        time it is called. Over an observation the reference image stays the
+        same, so the engine reads it (and computes its `luminance`) once and
+        keeps the Fourier transform of each of its subframes. Each new image
+        then only costs the transforms of its own subframes and the
+        cross-correlation.
+
+        Results are the same as `compute_offset_rotation(ref.luminance, im)`.
+
+        Args:
+            ref (str or Image): Reference image, either an `Image` instance or a
+                filename that will be read
+            upsample_factor (int, optional): Subpixel fraction to compute
+            subframe_size (int, optional): Box size
+            corners (bool, optional): If corner boxes should be included,
+                defaults to True
+            *args: Arguments to be passed to `PanBase`
+            **kwargs: Keyword args to be passed to `PanBase`
+        """
+        super().__init__(*args, **kwargs)
+
+        if isinstance(ref, str):
+            assert os.path.exists(ref)
+            ref = Image(ref)
+        assert isinstance(ref, Image)
+
+        self.image = ref
+        self.upsample_factor = upsample_factor
+        self.subframe_size = subframe_size
+
+        luminance = ref.luminance
+        self.regions = _offset_regions(luminance.shape, subframe_size=subframe_size, corners=corners)
+
+        self._ref_freqs = dict()
+        for region, midpoint in self.regions.items():
+            refarr = img_utils.crop_data(luminance, center=midpoint, box_width=subframe_size)
+            self._ref_freqs[region] = np.fft.fftn(refarr)
+
+        self.logger.debug("Offset engine created for {}".format(ref.fits_file))
+
+    @property
+    def fits_file(self):
+        """ File name of the reference image """
+        return self.image.fits_file
+
+    @property
+    def shape(self):
+        """ Shape of the reference `luminance` """
+        return self.image.luminance.shape
+
+    def compute_offset_rotation(self, im):
+        """Determine rotation information between `im` and the reference
+
+        Args:
+            im (numpy.array): Image data, the same shape as the reference
+                `luminance`
+
+        Returns:
+            dict: Rotation offset in `X`, `Y`, and `angle`, see
+                `compute_offset_rotation`
+        """
+        assert im.shape == self.shape
+
+        offsets = dict()
+        for region, midpoint in self.regions.items():
+            imarr = img_utils.crop_data(im, center=midpoint, box_width=self.subframe_size)
+
+            shifts, err, h = register_translation(np.fft.fftn(imarr), self._ref_freqs[region],
+                                                  upsample_factor=self.upsample_factor, space='fourier')
+            offsets[region] = shifts
+
+        return _offset_rotation(self.regions, offsets)
+
+
+def _offset_regions(shape, subframe_size=200, corners=True):
+    """ Center points of the subframes used by `compute_offset_rotation` """
+    ny, nx = shape
 
     subframe_half = int(subframe_size / 2)
 
     # Create the center point for each of our regions
     regions = {'center': (int(nx / 2), int(ny / 2)), }
-    offsets = {'center': None, }
 
     if corners:
         regions.update({
@@ -322,21 +437,11 @@ def compute_offset_rotation(im, imref, upsample_factor=20, subframe_size=200, co
             'lower_left': (int(subframe_half), int(subframe_half)),
         })
 
-        offsets.update({
-            'upper_right': None,
-            'upper_left': None,
-            'lower_right': None,
-            'lower_left': None,
-        })
-
-    # Get im/imref offsets for each region
-    for region, midpoint in regions.items():
-        imarr = img_utils.crop_data(im, center=midpoint, box_width=subframe_size)
-        imrefarr = img_utils.crop_data(imref, center=midpoint, box_width=subframe_size)
+    return regions
 
-        shifts, err, h = register_translation(imrefarr, imarr, upsample_factor=upsample_factor)
-        offsets[region] = shifts
 
+def _offset_rotation(regions, offsets):
+    """ Combine the per-region `offsets` in to the `compute_offset_rotation` result """
     # Rotate the offsets according to region
     angles = []
     for region in regions.keys():
@@ -357,3 +462,214 @@ def compute_offset_rotation(im, imref, upsample_factor=20, subframe_size=200, co
               'angle': (angle * u.radian).to(u.degree)}
 
     return result
+
+
+def get_image_pipeline(create=True, **kwargs):
+    """Get the `ImagePipeline` shared by this process, e.g. by every camera
+
+    A new pipeline is created if there isn't one yet or it has been shut down.
+
+    Args:
+        create (bool, optional): Create the pipeline if needed, otherwise None
+            is returned if there isn't one, default True
+        **kwargs: Keyword args for the `ImagePipeline`, only used when it is
+            first created (e.g. the `image_pipeline` section of the config)
+
+    Returns:
+        ImagePipeline: The shared pipeline
+    """
+    global _pipeline, _pipeline_pid
+
+    with _pipeline_lock:
+        # Worker threads don't survive a fork, so a forked process gets its own
+        if _pipeline is None or _pipeline_pid != os.getpid() or _pipeline.is_shutdown:
+            if not create:
+                return None
+
+            _pipeline = ImagePipeline(**kwargs)
+            _pipeline_pid = os.getpid()
+
+        return _pipeline
+
+
+class ImagePipeline(PanBase):
+
+    def __init__(self, num_workers=2, max_queue_size=4, max_samples=100, *args, **kwargs):
+        """Processes images in the background with a fixed number of workers
+
+        Each image is a job of named stages (e.g. `readout`, `convert`,
+        `header`, `thumbnail`, `index`), run in order by one of `num_workers`
+        threads. The stages mostly wait on other processes (the camera, dcraw,
+        exiftool, the db), so threads are enough to overlap them.
+
+        At most `max_queue_size` jobs can be waiting for a worker. After that
+        `submit` blocks until one is taken, so when images are processed more
+        slowly than they are taken the cameras, and the observing state waiting
+        on them, are held up instead of jobs piling up without limit.
+
+        The time taken by each stage (over the last `max_samples` runs) and the
+        number of jobs waiting are reported by `status`.
+
+        Args:
+            num_workers (int, optional): Number of worker threads, default 2
+            max_queue_size (int, optional): Number of jobs that can wait for a
+                worker, default 4
+            max_samples (int, optional): Number of stage times kept, default 100
+            *args: Arguments to be passed to `PanBase`
+            **kwargs: Keyword args to be passed to `PanBase`
+        """
+        super().__init__(*args, **kwargs)
+
+        assert num_workers > 0, self.logger.error("Image pipeline needs at least one worker")
+
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+
+        self._executor = ThreadPoolExecutor(max_workers=num_workers)
+        self._is_shutdown = False
+
+        self._condition = threading.Condition()
+        self._num_queued = 0
+        self._num_running = 0
+
+        self._latency = defaultdict(lambda: deque(maxlen=max_samples))
+        self._errors = defaultdict(int)
+        self._num_done = 0
+
+##################################################################################################
+# Properties
+##################################################################################################
+
+    @property
+    def queue_depth(self):
+        """ Number of jobs waiting for a worker """
+        return self._num_queued
+
+    @property
+    def is_idle(self):
+        """ If no jobs are waiting or running """
+        return self._num_queued + self._num_running == 0
+
+    @property
+    def is_shutdown(self):
+        """ If the workers have been stopped, see `shutdown` """
+        return self._is_shutdown
+
+##################################################################################################
+# Methods
+##################################################################################################
+
+    def submit(self, info, stages, timeout=None, done=None):
+        """Queue the processing of an image
+
+        Blocks while `max_queue_size` jobs are already waiting.
+
+        Args:
+            info (dict): Metadata of the image, passed to each stage, which
+                may update it (e.g. `file_path` when converting)
+            stages (list): (name, callable) pairs, each callable taking `info`.
+                If a stage raises, the stages after it are skipped
+            timeout (float, optional): Seconds to wait for room in the queue,
+                defaults to waiting as long as needed
+            done (threading.Event, optional): Event to set once the job is
+                finished, defaults to a new one
+
+        Returns:
+            threading.Event: `done`, set once all of the stages have run (or one has failed)
+
+        Raises:
+            error.Timeout: If there is still no room after `timeout`
+        """
+        with self._condition:
+            if self._num_queued >= self.max_queue_size:
+                self.logger.debug("Image pipeline full, waiting: {}".format(info.get('image_id')))
+
+            if not self._condition.wait_for(lambda: self._num_queued < self.max_queue_size, timeout=timeout):
+                raise error.Timeout("Image pipeline full for {}".format(info.get('image_id')))
+
+            self._num_queued += 1
+
+        if done is None:
+            done = threading.Event()
+
+        try:
+            self._executor.submit(self._run, info, list(stages), done)
+        except Exception:
+            with self._condition:
+                self._num_queued -= 1
+                self._condition.notify_all()
+            raise
+
+        return done
+
+    def join(self, timeout=None):
+        """Wait until every job has been processed
+
+        Returns:
+            bool: True if all done, False if timed out
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.is_idle, timeout=timeout)
+
+    def status(self):
+        """ Queue depth and stage times (seconds)
+
+        Returns:
+            dict: The `queue_depth`, number of jobs `running` and `done` and,
+                for each stage that has run, the number of `errors` and the
+                `mean`, `median` and `max` of its recent times
+        """
+        with self._condition:
+            status = {
+                'queue_depth': self._num_queued,
+                'running': self._num_running,
+                'done': self._num_done,
+                'stages': dict(),
+            }
+
+            for name, times in self._latency.items():
+                status['stages'][name] = {
+                    'count': len(times),
+                    'errors': self._errors[name],
+                    'mean': float(np.mean(times)) if times else None,
+                    'median': float(np.median(times)) if times else None,
+                    'max': float(np.max(times)) if times else None,
+                }
+
+        return status
+
+    def shutdown(self, wait=True):
+        """ Stop the workers, by default after the queued jobs are processed """
+        self._is_shutdown = True
+        self._executor.shutdown(wait=wait)
+
+##################################################################################################
+# Private Methods
+##################################################################################################
+
+    def _run(self, info, stages, done):
+        with self._condition:
+            self._num_queued -= 1
+            self._num_running += 1
+            self._condition.notify_all()
+
+        try:
+            for name, stage in stages:
+                t0 = time.monotonic()
+                try:
+                    stage(info)
+                except Exception as e:
+                    self.logger.warning("Problem in {} stage for {}: {}".format(name, info.get('image_id'), e))
+                    with self._condition:
+                        self._errors[name] += 1
+                    break
+                finally:
+                    with self._condition:
+                        self._latency[name].append(time.monotonic() - t0)
+        finally:
+            with self._condition:
+                self._num_running -= 1
+                self._num_done += 1
+                self._condition.notify_all()
+
+            done.set()
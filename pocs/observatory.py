@@ -13,6 +13,8 @@ from astropy.coordinates import get_sun
 
 from . import PanBase
 from .images import Image
+from .images import OffsetEngine
+from .images import get_image_pipeline
 from .scheduler.constraint import Duration
 from .scheduler.constraint import MoonAvoidance
 from .utils import current_time
@@ -54,6 +56,7 @@ class Observatory(PanBase):
         self._create_scheduler()
 
         self.offset_info = None
+        self._offset_engine = None
 
         self._image_dir = self.config['directories']['images']
         self.logger.info('\t Observatory initialized')
@@ -95,6 +98,7 @@ class Observatory(PanBase):
     @current_observation.setter
     def current_observation(self, new_observation):
         self.scheduler.current_observation = new_observation
+        self._offset_engine = None
 
 
 ##################################################################################################
@@ -102,10 +106,26 @@ class Observatory(PanBase):
 ##################################################################################################
 
     def power_down(self):
-        """Power down the observatory. Currently does nothing
+        """Power down the observatory
+
+        Waits (up to a minute) for the image pipeline to finish any images
+        still being processed before shutting it down, and shuts down the
+        scheduler's worker processes.
         """
         self.logger.debug("Shutting down observatory")
 
+        if self.scheduler is not None:
+            self.scheduler.close_pool()
+
+        pipeline = get_image_pipeline(create=False)
+        if pipeline is not None:
+            if not pipeline.join(timeout=60):
+                self.logger.warning("Image pipeline still processing images")
+
+            pipeline.shutdown(wait=False)
+
+        self._offset_engine = None
+
     def status(self):
         """Get status information for various parts of the observatory
         """
@@ -127,6 +147,10 @@ class Observatory(PanBase):
                 status['observation']['field_ha'] = self.observer.target_hour_angle(
                     t, self.current_observation.field)
 
+            pipeline = get_image_pipeline(create=False)
+            if pipeline is not None:
+                status['image_pipeline'] = pipeline.status()
+
             status['observer'] = {
                 'siderealtime': str(self.sidereal_time),
                 'utctime': t,
@@ -157,8 +181,13 @@ class Observatory(PanBase):
         """
 
         self.logger.debug("Getting observation for observatory")
+        previous_observation = self.scheduler.current_observation
         self.scheduler.get_observation(*args, **kwargs)
 
+        # The offset reference belongs to the previous observation
+        if self.scheduler.current_observation is not previous_observation:
+            self._offset_engine = None
+
         if self.scheduler.current_observation is None:
             raise error.NoObservation("No valid observations found")
 
@@ -306,8 +335,12 @@ class Observatory(PanBase):
 
                 self.logger.debug("Solve Info: {}".format(solve_info))
 
+                # Reuse the reference (and its transforms) for the rest of the observation
+                if self._offset_engine is None or self._offset_engine.fits_file != ref_image_path:
+                    self._offset_engine = OffsetEngine(ref_image_path)
+
                 # Get the offset between the two
-                self.offset_info = current_image.compute_offset(ref_image_path)
+                self.offset_info = current_image.compute_offset(self._offset_engine)
                 self.logger.debug('Offset Info: {}'.format(self.offset_info))
 
                 # Update the observation info with the offsets
@@ -617,7 +650,11 @@ class Observatory(PanBase):
                 constraints = [MoonAvoidance(), Duration(30 * u.deg)]
 
                 # Create the Scheduler instance
-                self.scheduler = module.Scheduler(self.observer, fields_file=fields_path, constraints=constraints)
+                self.scheduler = module.Scheduler(self.observer, fields_file=fields_path, constraints=constraints,
+                                                  use_plan=scheduler_config.get('use_plan', False),
+                                                  catalog_cache=scheduler_config.get('catalog_cache', True),
+                                                  num_workers=scheduler_config.get('num_workers', 0),
+                                                  rescore_tolerance=scheduler_config.get('rescore_tolerance', 0.01))
                 self.logger.debug("Scheduler created")
             except ImportError as e:
                 raise error.NotFound(msg=e)
@@ -0,0 +1,133 @@
+import hashlib
+import numpy as np
+import os
+
+from .. import PanBase
+
+# Bump when the layout of the cached arrays changes
+CACHE_VERSION = 1
+
+
+class FieldCatalogCache(PanBase):
+
+    def __init__(self, cache_dir=None, *args, **kwargs):
+        """ Compiled cache of parsed field files
+
+        Parsing a fields file means loading the YAML and parsing the position
+        of every field. The parsed columns of an
+        `~pocs.scheduler.observation_table.ObservationTable` are saved as a
+        NumPy `.npz` file so later loads of the same file skip both steps.
+
+        Each fields file has one cache file, named from a hash of its real
+        path. A cache file is used if it records the same modification time as
+        the fields file or, failing that, the same hash of its contents.
+
+        Args:
+            cache_dir (str, optional): Directory for the cache files, defaults
+                to the `cache` entry of the `directories` config (or `$PANDIR/cache`)
+            *args: Arguments to be passed to `PanBase`
+            **kwargs: Keyword args to be passed to `PanBase`
+        """
+        super().__init__(*args, **kwargs)
+
+        if cache_dir is None:
+            cache_dir = self.config['directories'].get('cache', '{}/cache'.format(os.getenv('PANDIR')))
+            cache_dir = os.path.join(cache_dir, 'fields')
+
+        self.cache_dir = cache_dir
+
+##################################################################################################
+# Methods
+##################################################################################################
+
+    def cache_path(self, fields_file):
+        """ Path of the cache file for `fields_file` """
+        path_hash = hashlib.sha1(os.path.realpath(fields_file).encode()).hexdigest()
+        return os.path.join(self.cache_dir, '{}.npz'.format(path_hash))
+
+    def load(self, fields_file):
+        """ Load the cached columns for `fields_file`
+
+        Args:
+            fields_file (str): The fields file
+
+        Returns:
+            dict: The arrays saved by `save`, or None if there is no valid cache
+        """
+        cache_path = self.cache_path(fields_file)
+        if not os.path.exists(cache_path):
+            return None
+
+        try:
+            with np.load(cache_path) as cache:
+                arrays = {key: cache[key] for key in cache.files}
+        except Exception as e:
+            self.logger.warning("Cannot read field cache {}: {}".format(cache_path, e))
+            return None
+
+        meta = {key: arrays.pop(key).item() for key in ['_version', '_path', '_mtime', '_hash']}
+
+        if meta['_version'] != CACHE_VERSION or meta['_path'] != os.path.realpath(fields_file):
+            return None
+
+        if meta['_mtime'] != os.stat(fields_file).st_mtime_ns:
+            if meta['_hash'] != self._file_hash(fields_file):
+                self.logger.debug("Field cache out of date for {}".format(fields_file))
+                return None
+
+            # Only touched, so keep the cache and record the new time
+            self.save(fields_file, arrays)
+
+        self.logger.debug("Using field cache {} for {}".format(cache_path, fields_file))
+        return arrays
+
+    def save(self, fields_file, arrays):
+        """ Save parsed columns for `fields_file`
+
+        Failing to write the cache is not an error, the file will just be
+        parsed again next time.
+
+        Args:
+            fields_file (str): The fields file the arrays were parsed from
+            arrays (dict): Arrays to save, see
+                `~pocs.scheduler.observation_table.ObservationTable.to_arrays`
+        """
+        cache_path = self.cache_path(fields_file)
+
+        meta = {
+            '_version': CACHE_VERSION,
+            '_path': os.path.realpath(fields_file),
+            '_mtime': os.stat(fields_file).st_mtime_ns,
+            '_hash': self._file_hash(fields_file),
+        }
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            # Write then rename so a reader never sees a partial file
+            tmp_path = '{}.{}.tmp.npz'.format(cache_path[:-4], os.getpid())
+            np.savez(tmp_path, **arrays, **meta)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            self.logger.warning("Cannot write field cache {}: {}".format(cache_path, e))
+        else:
+            self.logger.debug("Field cache saved to {}".format(cache_path))
+
+    def clear(self, fields_file):
+        """ Remove the cache file for `fields_file` """
+        try:
+            os.remove(self.cache_path(fields_file))
+        except FileNotFoundError:
+            pass
+
+##################################################################################################
+# Private Methods
+##################################################################################################
+
+    def _file_hash(self, fields_file):
+        sha1 = hashlib.sha1()
+        with open(fields_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+
+        return sha1.hexdigest()
@@ -1,6 +1,19 @@
+import numpy as np
+
 from astropy import units as u
+from astropy.coordinates import SkyCoord
 
 from .. import PanBase
+from .ephemeris import NightlyEphemeris
+
+# Fastest possible change in the altitude of a fixed target (Earth rotation), degrees per day
+ALTITUDE_RATE = 360.9856
+
+# Upper bound on the motion of the moon against the fixed targets, degrees per day
+MOON_RATE = 24.
+
+# Upper bound on the error of `_approx_altitude` (mostly precession), degrees
+ALTITUDE_ERROR = 1.
 
 
 class BaseConstraint(PanBase):
@@ -12,6 +25,13 @@ class BaseConstraint(PanBase):
         for determining a score for a particular target and observer at a given
         time. The `score` is then multiplied by the `weight` of the constraint.
 
+        Constraints may also implement `get_scores`, which scores a whole list
+        of observations at once and returns arrays of vetoes and scores. The
+        default implementation simply loops over `get_score` so that custom
+        constraints work without modification. Constraints that know how fast
+        their results can change may implement `stable_until` so a scheduler
+        can reuse results between passes.
+
         Args:
             weight (float, optional): The weight of the observation, which will
                 be multipled by the score
@@ -32,6 +52,50 @@ class BaseConstraint(PanBase):
     def get_score(self, time, observer, target):
         raise NotImplementedError
 
+    def get_scores(self, time, observer, observations, **kwargs):
+        """ Score a list of observations at once
+
+        Args:
+            time (astropy.time.Time): Time at which to score the observations
+            observer (astroplan.Observer): The observer
+            observations (list): List of `~pocs.scheduler.observation.Observation`
+            **kwargs: Common properties passed along to `get_score`. If `coords`
+                is present it should be a `SkyCoord` array matching `observations`
+
+        Returns:
+            tuple(numpy.array, numpy.array): Boolean veto array and weighted
+                score array, one entry per observation
+        """
+        veto = np.zeros(len(observations), dtype=bool)
+        score = np.zeros(len(observations))
+
+        for i, observation in enumerate(observations):
+            veto[i], score[i] = self.get_score(time, observer, observation, **kwargs)
+
+        return veto, score
+
+    def stable_until(self, time, observer, observations, veto, score, **kwargs):
+        """ How long the results of `get_scores` can be reused
+
+        A result can be reused until its veto could flip or its score could
+        have changed by more than `tolerance` times the `weight`. The default
+        is not to reuse results at all.
+
+        Args:
+            time (astropy.time.Time): Time the observations were scored at
+            observer (astroplan.Observer): The observer
+            observations (list): The observations that were scored
+            veto (numpy.array): Vetoes from `get_scores`
+            score (numpy.array): Scores from `get_scores`
+            **kwargs: As for `get_scores`, plus the `tolerance` (float) for
+                changes in the (unweighted) score, defaults to 0
+
+        Returns:
+            numpy.array: For each observation, the time (JD) up to which its
+                results can be reused
+        """
+        return np.full(len(observations), time.jd)
+
 
 class Altitude(BaseConstraint):
 
@@ -69,6 +133,26 @@ class Altitude(BaseConstraint):
 
         return veto, score * self.weight
 
+    def get_scores(self, time, observer, observations, **kwargs):
+        coords = _get_coords(observations, kwargs.get('coords'))
+
+        alt = observer.altaz(time, target=coords).alt
+
+        veto = np.asarray(alt < self.minimum)
+        score = np.where(veto, self._score, 1.0)
+
+        return veto, score * self.weight
+
+    def stable_until(self, time, observer, observations, veto, score, **kwargs):
+        # Score only changes with the veto, which can't flip before the target
+        # could have moved to the minimum altitude
+        coords = _get_coords(observations, kwargs.get('coords'))
+
+        alt = _approx_altitude(time, observer, coords)
+        margin = np.maximum(np.abs(alt - self.minimum.to(u.degree).value) - ALTITUDE_ERROR, 0.)
+
+        return time.jd + margin / ALTITUDE_RATE
+
     def __str__(self):
         return "Altitude {}".format(self.minimum)
 
@@ -80,54 +164,122 @@ class Duration(BaseConstraint):
         super().__init__(*args, **kwargs)
         self.horizon = horizon
 
+        self._ephemeris = None
+
     def get_score(self, time, observer, observation, **kwargs):
-        veto = False
-        score = self._score
+        kwargs.pop('coords', None)
 
-        target = observation.field
+        veto, score = self.get_scores(time, observer, [observation], **kwargs)
+
+        return bool(veto[0]), float(score[0])
+
+    def get_scores(self, time, observer, observations, **kwargs):
+        coords = _get_coords(observations, kwargs.get('coords'))
+
+        ephemeris = self._get_ephemeris(observer, kwargs.get('ephemeris'))
+
+        end_of_night = kwargs.get('end_of_night')
+        if end_of_night is None:
+            end_of_night = ephemeris.end_of_night(time)
 
-        veto = not observer.target_is_up(time, target, horizon=self.horizon)
+        score = np.full(len(observations), self._score, dtype=float)
+        veto = ~np.atleast_1d(observer.target_is_up(time, coords, horizon=self.horizon))
 
-        end_of_night = kwargs.get('end_of_night',
-                                  observer.tonight(time=time, horizon=-18 * u.degree)[1])
+        # Only look up the meridian and set times of targets that are up
+        is_up = np.flatnonzero(~veto)
+        if len(is_up) > 0:
+            names = _get_names(observations)
+            _, target_end_time, target_meridian = ephemeris.get_field_times(
+                time, [names[i] for i in is_up], coords[is_up], horizon=self.horizon)
 
-        if not veto:
-            # Get the next meridian flip
-            target_meridian = observer.target_meridian_transit_time(
-                time, target,
-                which='next')
+            min_duration = _get_minimum_duration(observations)[is_up]
 
             # If it flips before end_of_night it hasn't flipped yet so
-            # use the meridian time as the end time
-            if target_meridian < end_of_night:
-
-                # If target can't meet minimum duration before flip, veto
-                if time + observation.minimum_duration > target_meridian:
-                    self.logger.debug("Observation minimum can't be met before meridian flip")
-                    veto = True
-
-            # else:
-            # Get the next set time
-            target_end_time = observer.target_set_time(
-                time, target,
-                which='next',
-                horizon=self.horizon)
-
-            # If end_of_night happens before target sets, use end_of_night
-            if target_end_time > end_of_night:
-                self.logger.debug("Target sets past end_of_night, using end_of_night")
-                target_end_time = end_of_night
+            # use the meridian time as the end time. If target can't meet
+            # minimum duration before flip, veto
+            flips_first = target_meridian < end_of_night.jd
+            too_short = (time.jd + min_duration / 86400.) > target_meridian
+
+            # If end_of_night happens before target sets (or it never sets), use end_of_night
+            target_end_time = np.where(np.isnan(target_end_time) | (target_end_time > end_of_night.jd),
+                                       end_of_night.jd, target_end_time)
 
             # Total seconds is score
-            score = (target_end_time - time).sec
-            if score < observation.minimum_duration.value:
-                veto = True
+            seconds = (target_end_time - time.jd) * 86400.
+
+            veto[is_up] = (flips_first & too_short) | (seconds < min_duration)
 
             # Normalize the score based on total possible number of seconds
-            score = score / (end_of_night - time).sec
+            score[is_up] = seconds / (end_of_night - time).sec
 
         return veto, score * self.weight
 
+    def stable_until(self, time, observer, observations, veto, score, **kwargs):
+        coords = _get_coords(observations, kwargs.get('coords'))
+
+        ephemeris = self._get_ephemeris(observer, kwargs.get('ephemeris'))
+
+        end_of_night = kwargs.get('end_of_night')
+        if end_of_night is None:
+            end_of_night = ephemeris.end_of_night(time)
+
+        # Targets that are down (or up) stay that way until they could have
+        # moved to the horizon
+        alt = _approx_altitude(time, observer, coords)
+        margin = np.maximum(np.abs(alt - self.horizon.to(u.degree).value) - ALTITUDE_ERROR, 0.)
+
+        until = time.jd + margin / ALTITUDE_RATE
+
+        # Targets near the horizon have no margin and are rescored anyway, so
+        # only look further ahead for those certain to be up
+        is_up = np.flatnonzero(alt > self.horizon.to(u.degree).value + ALTITUDE_ERROR)
+        if len(is_up) > 0:
+            names = _get_names(observations)
+            _, target_set, target_meridian = ephemeris.get_field_times(
+                time, [names[i] for i in is_up], coords[is_up], horizon=self.horizon)
+
+            min_duration = _get_minimum_duration(observations)[is_up] / 86400.
+
+            target_end_time = np.where(np.isnan(target_set) | (target_set > end_of_night.jd),
+                                       end_of_night.jd, target_set)
+
+            # The veto can only flip at one of these events
+            events = np.vstack([
+                target_set,
+                target_meridian,
+                target_meridian - min_duration,
+                target_end_time - min_duration,
+            ])
+            events = np.where(events > time.jd, events, np.inf).min(axis=0)
+
+            # The score is 1 - b / a, where a = end_of_night - time and
+            # b = end_of_night - end, so after dt it has grown by b dt / (a (a - dt))
+            tolerance = kwargs.get('tolerance', 0.)
+            a = end_of_night.jd - time.jd
+            b = end_of_night.jd - target_end_time
+            score_stable = time.jd + tolerance * a ** 2 / (b + tolerance * a)
+
+            until[is_up] = np.minimum(until[is_up], np.minimum(events, score_stable))
+
+        return until
+
+    def _get_ephemeris(self, observer, ephemeris=None):
+        """ Use the shared ephemeris if given, otherwise keep one for the observer """
+        if ephemeris is not None and ephemeris.observer is observer:
+            return ephemeris
+
+        if self._ephemeris is None or self._ephemeris.observer is not observer:
+            self._ephemeris = NightlyEphemeris(observer)
+
+        return self._ephemeris
+
+    def __getstate__(self):
+        # Leave the nightly cache behind, it is rebuilt where it is used
+        state = super().__getstate__()
+        state['_ephemeris'] = None
+
+        return state
+
     def __str__(self):
         return "Duration above {}".format(self.horizon)
 
@@ -144,7 +296,10 @@ class MoonAvoidance(BaseConstraint):
         try:
             moon = kwargs['moon']
         except KeyError:
-            self.logger.error("Moon must be set")
+            if 'ephemeris' in kwargs:
+                moon = kwargs['ephemeris'].moon(time)
+            else:
+                self.logger.error("Moon must be set")
 
         moon_sep = observation.field.coord.separation(moon).value
 
@@ -157,5 +312,98 @@ class MoonAvoidance(BaseConstraint):
 
         return veto, score * self.weight
 
+    def get_scores(self, time, observer, observations, **kwargs):
+        try:
+            moon = kwargs['moon']
+        except KeyError:
+            if 'ephemeris' in kwargs:
+                moon = kwargs['ephemeris'].moon(time)
+            else:
+                self.logger.error("Moon must be set")
+
+        field_index = kwargs.get('field_index')
+
+        if field_index is not None:
+            # Only the fields in the cone around the moon need checking for a veto
+            idx = field_index.index_of(_get_names(observations))
+            veto = np.isin(idx, field_index.query_cone(moon, 15 * u.degree))
+
+            score = np.full(len(observations), self._score, dtype=float)
+            score[~veto] = field_index.separation(moon, idx[~veto]) / 180
+        else:
+            moon_sep = self._moon_separation(observations, moon, kwargs.get('coords'))
+
+            # This would potentially be within image
+            veto = moon_sep < 15
+            score = np.where(veto, self._score, moon_sep / 180)
+
+        return veto, score * self.weight
+
+    def stable_until(self, time, observer, observations, veto, score, **kwargs):
+        moon = kwargs.get('moon')
+        if moon is None:
+            moon = kwargs['ephemeris'].moon(time)
+
+        moon_sep = self._moon_separation(observations, moon, kwargs.get('coords'))
+
+        # The veto can't flip before the moon could have moved to the limit
+        until = time.jd + np.abs(moon_sep - 15) / MOON_RATE
+
+        # The score is moon_sep / 180
+        tolerance = kwargs.get('tolerance', 0.)
+        until[~veto] = np.minimum(until[~veto], time.jd + tolerance * 180 / MOON_RATE)
+
+        return until
+
+    def _moon_separation(self, observations, moon, coords=None):
+        """ Separation of each observation from the moon in degrees """
+        coords = _get_coords(observations, coords)
+
+        return np.atleast_1d(coords.separation(moon).to(u.degree).value)
+
     def __str__(self):
         return "Moon Avoidance"
+
+
+def _approx_altitude(time, observer, coords):
+    """ Altitude in degrees from the hour angle, good to `ALTITUDE_ERROR`
+
+    Much faster than `astroplan.Observer.altaz` as the coordinates are not
+    transformed, only used to bound how long results can be reused.
+    """
+    lst = time.sidereal_time('mean', longitude=observer.location.lon).to(u.radian).value
+    lat = observer.location.lat.to(u.radian).value
+
+    ha = lst - coords.ra.to(u.radian).value
+    dec = coords.dec.to(u.radian).value
+
+    sin_alt = np.sin(dec) * np.sin(lat) + np.cos(dec) * np.cos(lat) * np.cos(ha)
+
+    return np.atleast_1d(np.degrees(np.arcsin(np.clip(sin_alt, -1, 1))))
+
+
+def _get_coords(observations, coords=None):
+    """ Get a `SkyCoord` array for the observations, building it if not given """
+    if coords is None:
+        try:
+            coords = observations.coords
+        except AttributeError:
+            coords = SkyCoord([observation.field.coord for observation in observations])
+
+    return coords
+
+
+def _get_names(observations):
+    """ Field names of the observations, from the table columns if possible """
+    try:
+        return observations.names
+    except AttributeError:
+        return [observation.name for observation in observations]
+
+
+def _get_minimum_duration(observations):
+    """ Minimum duration of the observations in seconds, from the table columns if possible """
+    try:
+        return observations.minimum_duration
+    except AttributeError:
+        return np.array([observation.minimum_duration.to(u.second).value for observation in observations])
@@ -1,18 +1,52 @@
-from astropy import units as u
+import numpy as np
 
-from astropy.coordinates import get_moon
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from uuid import uuid4
 
 from ..utils import current_time
-from ..utils import listify
+from .constraint import BaseConstraint
+from .ephemeris import NightlyEphemeris
+from .observation_table import ObservationTable
 from .scheduler import BaseScheduler
 
+# State of a worker process, see `_init_worker`
+_worker = dict()
+
 
 class Scheduler(BaseScheduler):
 
-    def __init__(self, *args, **kwargs):
-        """ Inherit from the `BaseScheduler` """
+    def __init__(self, *args, num_workers=0, rescore_tolerance=0.01, **kwargs):
+        """ Inherit from the `BaseScheduler`
+
+        Args:
+            num_workers (int, optional): Number of worker processes used to
+                score the observations for constraints that only implement
+                `get_score`, defaults to 0 to score everything in this process.
+                The workers only see the `current_exp` of each observation, any
+                other changes to an `Observation` are not passed on to them
+            rescore_tolerance (float, optional): Largest change in a constraint
+                score (before weighting) allowed when reusing the score from an
+                earlier pass, see `rank_observations`. Defaults to 0.01, None
+                to score every observation on every pass
+            *args: Arguments to be passed to `BaseScheduler`
+            **kwargs: Keyword args to be passed to `BaseScheduler`
+        """
         BaseScheduler.__init__(self, *args, **kwargs)
 
+        self.num_workers = num_workers
+
+        # Fewer observations than this are scored in this process
+        self.parallel_threshold = 100
+
+        self._pool = None
+        self._pool_index = None
+        self._pool_setup = None
+        self._pool_started = False
+
+        self.rescore_tolerance = rescore_tolerance
+        self._score_cache = None
+
 
 ##########################################################################
 # Properties
@@ -25,6 +59,12 @@ class Scheduler(BaseScheduler):
     def get_observation(self, time=None, show_all=False):
         """Get a valid observation
 
+        If `use_plan` is set, the observation is taken from the plan for the
+        night (see `~pocs.scheduler.scheduler.BaseScheduler.create_plan`). The
+        plan is not created here, as that would delay the slew. The regular
+        ranking is done if there is no plan for the night of `time` or no
+        planned observation available.
+
         Args:
             time (astropy.time.Time, optional): Time at which scheduler applies,
                 defaults to time called
@@ -37,39 +77,23 @@ class Scheduler(BaseScheduler):
         if time is None:
             time = current_time()
 
-        valid_obs = {obs: 1.0 for obs in self.observations}
-        best_obs = []
+        if self.use_plan and not self.needs_plan(time):
+            block = self.get_planned_observation(time)
+            if block is not None:
+                self.logger.debug("Using planned observation: {}".format(block.name))
+                self.current_observation = self.observations[block.name]
+                self.current_observation.merit = block.merit
 
-        common_properties = {
-            'end_of_night': self.observer.tonight(time=time, horizon=-18 * u.degree)[-1],
-            'moon': get_moon(time, self.observer.location)
-        }
+                if not show_all:
+                    return (block.name, block.merit)
 
-        for constraint in listify(self.constraints):
-            self.logger.debug("Checking Constraint: {}".format(constraint))
-            for obs_name, observation in self.observations.items():
-                if obs_name in valid_obs:
-                    self.logger.debug("\tObservation: {}".format(obs_name))
+                # The planned observation first, then the rest by merit
+                return [(block.name, block.merit)] + \
+                    [obs for obs in self.rank_observations(time) if obs[0] != block.name]
 
-                    veto, score = constraint.get_score(
-                        time, self.observer, observation, **common_properties)
-
-                    self.logger.debug("\t\tScore: {}\tVeto: {}".format(score, veto))
-
-                    if veto:
-                        self.logger.debug("\t\t{} vetoed by {}".format(obs_name, constraint))
-                        del valid_obs[obs_name]
-                        continue
-
-                    valid_obs[obs_name] += score
-
-        for obs_name, score in valid_obs.items():
-            valid_obs[obs_name] += self.observations[obs_name].priority
-
-        if len(valid_obs) > 0:
-            # Sort the list by highest score (reverse puts in correct order)
-            best_obs = sorted(valid_obs.items(), key=lambda x: x[1])[::-1]
+        best_obs = self.rank_observations(time)
 
+        if len(best_obs) > 0:
             top_obs = best_obs[0]
 
             # Check new best against current_observation
@@ -91,7 +115,7 @@ class Scheduler(BaseScheduler):
             if self.current_observation is not None:
                 # Favor the current observation if still available
                 end_of_next_set = time + self.current_observation.set_duration
-                if end_of_next_set < common_properties['end_of_night'] and \
+                if end_of_next_set < self.ephemeris.end_of_night(time) and \
                         self.observation_available(self.current_observation, end_of_next_set):
 
                     self.logger.debug("Reusing {}".format(self.current_observation))
@@ -105,6 +129,124 @@ class Scheduler(BaseScheduler):
 
         return best_obs
 
+    def rank_observations(self, time, planning=False):
+        """Rank the observations that are valid at the given time
+
+        Each constraint scores all of the observations that have not yet been
+        vetoed. The merit of an observation is the sum of its constraint scores
+        and its priority. Constraints are evaluated in `constraint_order`, so
+        cheap constraints that veto many observations run first, and the cost
+        and veto rate of each are recorded for the next pass.
+
+        Unless `rescore_tolerance` is None, the vetoes and scores from earlier
+        passes are reused for as long as each constraint guarantees (see
+        `~pocs.scheduler.constraint.BaseConstraint.stable_until`), i.e. until a
+        veto could flip or a score could have moved by more than the tolerance.
+        Only the other observations, and any that have taken exposures since
+        the last pass, are scored again.
+
+        Passes for a plan are at times other than now, so they neither use
+        the score cache nor update the constraint stats.
+
+        Args:
+            time (astropy.time.Time): Time at which to rank the observations
+            planning (bool, optional): If the pass is for a plan, defaults to False
+
+        Returns:
+            list: A list of tuples with name and merit of each valid observation,
+                best first
+        """
+        common_properties = {
+            'end_of_night': self.ephemeris.end_of_night(time),
+            'moon': self.ephemeris.moon(time),
+            'ephemeris': self.ephemeris,
+            'field_index': self.field_index,
+        }
+
+        # Columns of the table are used so no `Observation`s need to be created
+        observations = self.observations
+        obs_names = observations.names
+
+        is_valid = np.ones(len(observations), dtype=bool)
+        merits = np.ones(len(observations))
+
+        # The index is in the same order as the observations
+        coords = self.field_index.coords
+
+        if planning:
+            cache = None
+        else:
+            cache = self._get_score_cache(time, common_properties['end_of_night'])
+
+        for constraint in self.constraint_order:
+            self.logger.debug("Checking Constraint: {}".format(constraint))
+
+            # Only score the observations that haven't been vetoed yet
+            valid_idx = np.flatnonzero(is_valid)
+            if len(valid_idx) == 0:
+                break
+
+            if cache is None:
+                score_idx = valid_idx
+            else:
+                entry = cache['constraints'].setdefault(constraint, {
+                    'veto': np.zeros(len(observations), dtype=bool),
+                    'score': np.zeros(len(observations)),
+                    'until': np.full(len(observations), -np.inf),
+                })
+
+                score_idx = valid_idx[(entry['until'][valid_idx] < time.jd) | cache['changed'][valid_idx]]
+
+            if len(score_idx) > 0:
+                start = perf_counter()
+                if self._use_pool(constraint, score_idx):
+                    veto, score = self._pool_scores(constraint, time, score_idx, common_properties)
+                else:
+                    veto, score = constraint.get_scores(
+                        time, self.observer, observations.rows(score_idx),
+                        coords=coords[score_idx], **common_properties)
+                if not planning:
+                    self.update_constraint_stats(constraint, perf_counter() - start, len(score_idx), veto.sum())
+
+            if cache is not None:
+                if len(score_idx) > 0:
+                    entry['veto'][score_idx] = veto
+                    entry['score'][score_idx] = score
+                    entry['until'][score_idx] = constraint.stable_until(
+                        time, self.observer, observations.rows(score_idx), veto, score,
+                        coords=coords[score_idx], tolerance=self.rescore_tolerance, **common_properties)
+
+                self.logger.debug("\tScored {} of {} observations".format(len(score_idx), len(valid_idx)))
+
+                veto = entry['veto'][valid_idx]
+                score = entry['score'][valid_idx]
+
+            if veto.any():
+                self.logger.debug("\t{} vetoed by {}".format(
+                    [obs_names[i] for i in valid_idx[veto]], constraint))
+
+            is_valid[valid_idx[veto]] = False
+            merits[valid_idx[~veto]] += score[~veto]
+
+        priority = observations.column('priority')
+
+        valid_obs = {obs_names[i]: float(merits[i]) + float(priority[i])
+                     for i in np.flatnonzero(is_valid)}
+
+        # Sort the list by highest score (reverse puts in correct order)
+        return sorted(valid_obs.items(), key=lambda x: x[1])[::-1]
+
+    def close_pool(self):
+        """Shut down the worker processes, if any"""
+        if self._pool is not None:
+            self.logger.debug("Shutting down scheduler worker pool")
+            self._pool.shutdown()
+
+        self._pool = None
+        self._pool_index = None
+        self._pool_setup = None
+        self._pool_started = False
+
 
 ##########################################################################
 # Utility Methods
@@ -113,3 +255,145 @@ class Scheduler(BaseScheduler):
 ##########################################################################
 # Private Methods
 ##########################################################################
+
+    def _get_score_cache(self, time, end_of_night):
+        """Get the scores of earlier passes that may be reused at `time`
+
+        Nothing is reused if the observations have changed, if `time` is in a
+        different night or if `time` is before the last pass.
+
+        Returns:
+            dict: The cache, with the rows that must be scored again marked in
+                `changed`, or None if scores are never reused
+        """
+        if self.rescore_tolerance is None:
+            self._score_cache = None
+            return None
+
+        cache = self._score_cache
+        if cache is None or \
+                cache['index'] is not self.field_index or \
+                cache['end_of_night'] != end_of_night or \
+                time < cache['time']:
+            self.logger.debug("Starting new score cache")
+            cache = {
+                'index': self.field_index,
+                'end_of_night': end_of_night,
+                'constraints': dict(),
+                'exposures': dict(),
+            }
+            self._score_cache = cache
+
+        cache['time'] = time
+
+        # Observations that have taken exposures since the last pass
+        cache['changed'] = np.zeros(len(self.field_index), dtype=bool)
+
+        positions = self.field_index.index_of(list(self.observations.created.keys()))
+        for row, observation in zip(positions, self.observations.created.values()):
+            if cache['exposures'].get(observation.name) != observation.current_exp:
+                cache['changed'][row] = True
+                cache['exposures'][observation.name] = observation.current_exp
+
+        return cache
+
+    def _use_pool(self, constraint, valid_idx):
+        """Only constraints that loop over `get_score` are worth spreading out"""
+        return self.num_workers > 1 and \
+            len(valid_idx) >= self.parallel_threshold and \
+            type(constraint).get_scores is BaseConstraint.get_scores
+
+    def _get_pool(self):
+        """Get the worker pool, starting it if the observations have changed
+
+        The workers are sent the observer and a copy of the observation table
+        with their first task (see `_score_rows`), which they keep under a new
+        token, so later tasks only need the rows to score.
+        """
+        if self._pool is None or self._pool_index is not self.field_index:
+            self.close_pool()
+
+            self.logger.debug("Starting scheduler worker pool with {} workers".format(self.num_workers))
+            self._pool = ProcessPoolExecutor(max_workers=self.num_workers)
+            self._pool_index = self.field_index
+            self._pool_setup = (uuid4().hex, self.observer, self.observations.to_arrays())
+
+        return self._pool
+
+    def _pool_scores(self, constraint, time, valid_idx, common_properties):
+        """Score the rows in `valid_idx` across the worker pool
+
+        Only the `end_of_night` and `moon` are passed on to the workers, which
+        have their own ephemeris. Each observation is seen as it was loaded,
+        except for its `current_exp`, which is sent along with the rows.
+        """
+        kwargs = {key: common_properties[key] for key in ['end_of_night', 'moon']}
+
+        pool = self._get_pool()
+        token = self._pool_setup[0]
+
+        # Exposures taken so far by the observations that have been created
+        created = self.observations.created
+        exposures = dict(zip(self.field_index.index_of(list(created.keys())),
+                             [observation.current_exp for observation in created.values()]))
+
+        # The setup goes with the first tasks, after that only to a worker that hasn't had it
+        setup = None if self._pool_started else self._pool_setup
+
+        chunks = [chunk for chunk in np.array_split(valid_idx, self.num_workers) if len(chunk) > 0]
+        tasks = [(constraint, time, chunk, kwargs, {int(row): exposures[row] for row in chunk if row in exposures})
+                 for chunk in chunks]
+        futures = [pool.submit(_score_rows, token, setup, *task) for task in tasks]
+
+        results = list()
+        for task, future in zip(tasks, futures):
+            result = future.result()
+            if result is None:
+                result = pool.submit(_score_rows, token, self._pool_setup, *task).result()
+
+            results.append(result)
+
+        self._pool_started = True
+
+        veto = np.concatenate([result[0] for result in results])
+        score = np.concatenate([result[1] for result in results])
+
+        return veto, score
+
+
+def _init_worker(token, observer, arrays):
+    """Set up a worker process with the observer and the observations"""
+    table = ObservationTable()
+    table.extend_arrays(arrays)
+
+    _worker['token'] = token
+    _worker['observer'] = observer
+    _worker['table'] = table
+    _worker['ephemeris'] = NightlyEphemeris(observer)
+
+
+def _score_rows(token, setup, constraint, time, idx, kwargs, exposures):
+    """Score rows of the worker's observation table with `constraint`
+
+    `setup` is the token, observer and observation arrays to set the worker
+    up with, or None if it should already have them. `exposures` has the
+    `current_exp` of each row whose observation has been created by the
+    scheduler.
+
+    Returns:
+        tuple: The vetoes and scores, or None if the worker hasn't been set
+            up for `token` and needs to be sent the `setup`
+    """
+    if setup is not None and _worker.get('token') != token:
+        _init_worker(*setup)
+
+    if _worker.get('token') != token:
+        return None
+
+    table = _worker['table']
+
+    for row, current_exp in exposures.items():
+        table[table.names[row]].current_exp = current_exp
+
+    return constraint.get_scores(time, _worker['observer'], table.rows(idx), coords=table.coords[idx],
+                                 ephemeris=_worker['ephemeris'], **kwargs)
@@ -0,0 +1,248 @@
+import numpy as np
+
+from astropy import units as u
+from astropy.coordinates import get_moon
+from astropy.coordinates import get_sun
+from astropy.time import Time
+
+from .. import PanBase
+
+# Length of a sidereal day in (solar) days
+SIDEREAL_DAY = 0.9972695663
+
+# astroplan's rise and set search grows with the square of the number of
+# targets, so fields are solved this many at a time
+SOLVE_CHUNK_SIZE = 250
+
+
+class NightlyEphemeris(PanBase):
+
+    @u.quantity_input(twilight_horizon=u.degree, resolution=u.minute)
+    def __init__(self, observer, twilight_horizon=-18 * u.degree, resolution=10 * u.minute, *args, **kwargs):
+        """ Ephemeris information for an observer, computed once per night
+
+        The start and end of each night, along with the sun and moon positions
+        sampled every `resolution` across the night, are computed the first
+        time a night is requested. The rise, set and meridian transit times of
+        each field are likewise solved once per night and then rolled forward
+        by whole sidereal days, so repeated scheduling passes only cost lookups.
+
+        Nights are identified by the Julian day number of the preceding local
+        (mean) noon at the observer's site.
+
+        Args:
+            observer (`astroplan.Observer`): The site the ephemeris is for
+            twilight_horizon (u.degree, optional): Sun altitude marking the start
+                and end of the night, defaults to -18 degrees
+            resolution (u.minute, optional): Spacing of the sun and moon samples,
+                defaults to 10 minutes
+            *args: Arguments to be passed to `PanBase`
+            **kwargs: Keyword args to be passed to `PanBase`
+        """
+        super().__init__(*args, **kwargs)
+
+        self.observer = observer
+        self.twilight_horizon = twilight_horizon
+        self.resolution = resolution
+
+        self._nights = dict()
+        self._field_times = dict()
+
+        # Only keep tonight and the next night around
+        self._max_nights = 2
+
+##################################################################################################
+# Properties
+##################################################################################################
+
+    @property
+    def site(self):
+        """ Name of the site the ephemeris was computed for """
+        return self.observer.name
+
+##################################################################################################
+# Methods
+##################################################################################################
+
+    def night_key(self, time):
+        """ Key for the night containing `time`
+
+        Args:
+            time (astropy.time.Time): Any time during the day or night
+
+        Returns:
+            int: The Julian day number of the preceding local noon
+        """
+        return int(np.floor(time.jd + self._longitude_days))
+
+    def get_night(self, time):
+        """ Get the ephemeris for the night containing (or following) `time`
+
+        This mimics `astroplan.Observer.tonight`, so a time after the end of a
+        night returns the next night.
+
+        Args:
+            time (astropy.time.Time): Time of interest
+
+        Returns:
+            dict: Contains the `start` and `end` of the night, the sample `times`
+                and the `moon` and `sun_alt` at each sample
+        """
+        key = self.night_key(time)
+
+        night = self._get_night(key)
+        if time > night['end']:
+            night = self._get_night(key + 1)
+
+        return night
+
+    def end_of_night(self, time):
+        """ End of the night containing (or following) `time` """
+        return self.get_night(time)['end']
+
+    def moon(self, time):
+        """ Position of the moon at `time`
+
+        Uses the nearest sample of the night if `time` falls within the night,
+        otherwise computes the position directly.
+
+        Args:
+            time (astropy.time.Time): Time of interest
+
+        Returns:
+            astropy.coordinates.SkyCoord: The moon
+        """
+        night = self.get_night(time)
+
+        idx = self._sample_index(night, time)
+        if idx is None:
+            return get_moon(time, self.observer.location)
+
+        return night['moon'][idx]
+
+    def sun_altitude(self, time):
+        """ Altitude of the sun at `time`
+
+        Args:
+            time (astropy.time.Time): Time of interest
+
+        Returns:
+            u.degree: Altitude of the sun
+        """
+        night = self.get_night(time)
+
+        idx = self._sample_index(night, time)
+        if idx is None:
+            return self.observer.altaz(time, target=get_sun(time)).alt
+
+        return night['sun_alt'][idx]
+
+    @u.quantity_input(horizon=u.degree)
+    def get_field_times(self, time, names, coords, horizon=0 * u.degree):
+        """ Next rise, set and meridian transit times for a list of fields
+
+        Times are solved once per field per night and cached by field name
+        and position.
+
+        Args:
+            time (astropy.time.Time): Times returned are the next after this time
+            names (list): Names of the fields
+            coords (astropy.coordinates.SkyCoord): Positions of the fields, in
+                the same order as `names`
+            horizon (u.degree, optional): Horizon for rise and set times
+
+        Returns:
+            tuple(numpy.array): Arrays of the next `rise`, `set` and `transit`
+                times as JD. Fields that never rise or set have a NaN entry.
+        """
+        night = self.get_night(time)
+
+        cache_key = (night['key'], horizon.to(u.degree).value)
+        field_times = self._field_times.setdefault(cache_key, dict())
+
+        keys = list(zip(names, np.round(coords.ra.degree, 6), np.round(coords.dec.degree, 6)))
+
+        missing = [i for i, key in enumerate(keys) if key not in field_times]
+        if len(missing) > 0:
+            self.logger.debug("Solving ephemeris for {} fields".format(len(missing)))
+            self._solve_fields(night['noon'], [keys[i] for i in missing], coords[missing], horizon, field_times)
+
+        times = np.array([field_times[key] for key in keys], dtype=float).reshape(-1, 3)
+
+        # Roll each event forward (or back) to the first one after `time`
+        times = times - SIDEREAL_DAY * np.floor((times - time.jd) / SIDEREAL_DAY)
+
+        return times[:, 0], times[:, 1], times[:, 2]
+
+    def clear(self):
+        """ Clear all cached information """
+        self._nights = dict()
+        self._field_times = dict()
+
+##################################################################################################
+# Private Methods
+##################################################################################################
+
+    @property
+    def _longitude_days(self):
+        return self.observer.location.lon.to(u.degree).value / 360.
+
+    def _get_night(self, key):
+        if key not in self._nights:
+            self.logger.debug("Computing ephemeris for night {}".format(key))
+
+            noon = Time(key - self._longitude_days, format='jd')
+
+            start, end = self.observer.tonight(time=noon, horizon=self.twilight_horizon)
+
+            num_samples = int(np.ceil(((end - start) / self.resolution).decompose().value)) + 1
+            times = start + np.arange(num_samples) * self.resolution
+
+            self._nights[key] = {
+                'key': key,
+                'noon': noon,
+                'start': start,
+                'end': end,
+                'times': times,
+                'moon': get_moon(times, self.observer.location),
+                'sun_alt': self.observer.altaz(times, target=get_sun(times)).alt,
+            }
+
+            # Prune old nights
+            for old_key in sorted(self._nights.keys())[:-self._max_nights]:
+                del self._nights[old_key]
+
+            for cache_key in list(self._field_times.keys()):
+                if cache_key[0] not in self._nights:
+                    del self._field_times[cache_key]
+
+        return self._nights[key]
+
+    def _sample_index(self, night, time):
+        """ Index of the sample nearest `time`, None if outside the night """
+        resolution = self.resolution.to(u.day).value
+        idx = int(np.round((time.jd - night['start'].jd) / resolution))
+
+        if idx < 0 or idx >= len(night['times']):
+            return None
+
+        return idx
+
+    def _solve_fields(self, time, keys, coords, horizon, field_times):
+        for start in range(0, len(keys), SOLVE_CHUNK_SIZE):
+            chunk = slice(start, start + SOLVE_CHUNK_SIZE)
+            self._solve_chunk(time, keys[chunk], coords[chunk], horizon, field_times)
+
+    def _solve_chunk(self, time, keys, coords, horizon, field_times):
+        rise = _to_jd(self.observer.target_rise_time(time, coords, which='next', horizon=horizon), len(keys))
+        set_ = _to_jd(self.observer.target_set_time(time, coords, which='next', horizon=horizon), len(keys))
+        transit = _to_jd(self.observer.target_meridian_transit_time(time, coords, which='next'), len(keys))
+
+        for key, times in zip(keys, zip(rise, set_, transit)):
+            field_times[key] = times
+
+
+def _to_jd(t, size):
+    """ Flatten a (possibly masked) `Time` into a float array of JD, NaN where masked """
+    jd = np.ma.filled(np.ma.masked_invalid(np.ma.atleast_1d(t.jd)).astype(float), np.nan)
+    return np.broadcast_to(jd, (size,))
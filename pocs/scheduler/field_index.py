@@ -0,0 +1,133 @@
+import numpy as np
+
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from astropy.coordinates import UnitSphericalRepresentation
+from scipy.spatial import cKDTree
+
+from .. import PanBase
+
+
+class FieldIndex(PanBase):
+
+    def __init__(self, names, coords, *args, **kwargs):
+        """ Spatial index over the positions of a list of fields
+
+        Each position is stored as a 3D unit vector in a k-d tree so that cone
+        searches (e.g. all fields near the moon, the zenith or the current
+        pointing) only touch the fields inside the cone rather than the whole
+        list. An angular radius is turned into the equivalent chord length
+        between unit vectors for the tree query.
+
+        Args:
+            names (list): Names of the fields
+            coords (astropy.coordinates.SkyCoord): Positions of the fields, in the
+                same order as `names`
+            *args: Arguments to be passed to `PanBase`
+            **kwargs: Keyword args to be passed to `PanBase`
+        """
+        super().__init__(*args, **kwargs)
+
+        assert len(names) == len(coords), \
+            self.logger.error("Must have a position for each field name")
+
+        self._names = list(names)
+        self._positions = {name: i for i, name in enumerate(self._names)}
+
+        self._coords = coords
+        self._xyz = self._unit_vectors(coords)
+        self._tree = cKDTree(self._xyz)
+
+        self.logger.debug("Field index built for {} fields".format(len(self._names)))
+
+##################################################################################################
+# Properties
+##################################################################################################
+
+    @property
+    def names(self):
+        """ Names of the fields, in index order """
+        return self._names
+
+    @property
+    def coords(self):
+        """ `SkyCoord` array of the field positions, in index order """
+        return self._coords
+
+##################################################################################################
+# Methods
+##################################################################################################
+
+    def index_of(self, names):
+        """ Positions in the index of the given field names
+
+        Args:
+            names (list): Field names, which must be in the index
+
+        Returns:
+            numpy.array: Integer positions of the fields
+        """
+        return np.array([self._positions[name] for name in names], dtype=int)
+
+    @u.quantity_input(radius=u.degree)
+    def query_cone(self, center, radius):
+        """ Fields within `radius` of `center`
+
+        Args:
+            center (astropy.coordinates.SkyCoord): Center of the cone, in any frame
+            radius (u.degree): Radius of the cone
+
+        Returns:
+            numpy.array: Sorted positions in the index of the fields in the cone
+        """
+        chord = 2 * np.sin(min(radius.to(u.radian).value, np.pi) / 2)
+
+        idx = self._tree.query_ball_point(self._center_vector(center), chord)
+
+        return np.array(sorted(idx), dtype=int)
+
+    @u.quantity_input(radius=u.degree)
+    def query_cone_names(self, center, radius):
+        """ Names of the fields within `radius` of `center`
+
+        See `query_cone`.
+        """
+        return [self._names[i] for i in self.query_cone(center, radius)]
+
+    def separation(self, center, idx=None):
+        """ Angular separation between `center` and the fields
+
+        Args:
+            center (astropy.coordinates.SkyCoord): Position to measure from
+            idx (numpy.array, optional): Positions in the index of the fields,
+                defaults to all fields
+
+        Returns:
+            numpy.array: Separations in degrees
+        """
+        xyz = self._xyz if idx is None else self._xyz[idx]
+        center_xyz = self._center_vector(center)
+
+        cross = np.linalg.norm(np.cross(xyz, center_xyz), axis=1)
+        dot = xyz.dot(center_xyz)
+
+        return np.degrees(np.arctan2(cross, dot))
+
+##################################################################################################
+# Private Methods
+##################################################################################################
+
+    def _center_vector(self, center):
+        """ Unit vector of `center`, transformed the same way `SkyCoord.separation` would """
+        if isinstance(center, SkyCoord):
+            center = center.transform_to(self._coords)
+
+        return self._unit_vectors(center)[0]
+
+    def _unit_vectors(self, coords):
+        xyz = coords.represent_as(UnitSphericalRepresentation).to_cartesian().xyz.value
+
+        return np.atleast_2d(xyz.T).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self._names)
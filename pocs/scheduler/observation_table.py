@@ -0,0 +1,369 @@
+import numpy as np
+
+from collections.abc import Mapping
+from collections.abc import Sequence
+
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+from .. import PanBase
+from .field import Field
+from .observation import Observation
+
+# Same defaults as `~pocs.scheduler.observation.Observation`
+DEFAULT_EXP_TIME = 120.  # seconds
+DEFAULT_MIN_NEXP = 60
+DEFAULT_EXP_SET_SIZE = 10
+DEFAULT_PRIORITY = 100.
+
+
+class ObservationTable(Mapping, PanBase):
+
+    def __init__(self, *args, **kwargs):
+        """ Columnar store of the observations known to a scheduler
+
+        The position, priority and exposure settings of each observation are
+        kept in NumPy arrays so a large field list can be loaded and scored
+        without creating an `~pocs.scheduler.observation.Observation` (and its
+        `~pocs.scheduler.field.Field`) per row. The table behaves like a dict
+        of `Observation`s keyed by field name: looking an observation up
+        creates it on first access and keeps it, so the same object is always
+        returned for a given name.
+
+        Columns of observations that have been created reflect any changes made
+        to those objects (e.g. a new `priority`).
+
+        Args:
+            *args: Arguments to be passed to `PanBase`
+            **kwargs: Keyword args to be passed to `PanBase`
+        """
+        PanBase.__init__(self, *args, **kwargs)
+
+        self._names = list()
+        self._rows = dict()
+
+        self._columns = {
+            'ra': np.zeros(0),
+            'dec': np.zeros(0),
+            'priority': np.zeros(0),
+            'exp_time': np.zeros(0),
+            'min_nexp': np.zeros(0, dtype=int),
+            'exp_set_size': np.zeros(0, dtype=int),
+        }
+
+        self._coords = None
+        self._observations = dict()
+
+##################################################################################################
+# Properties
+##################################################################################################
+
+    @property
+    def names(self):
+        """ Field names, in row order """
+        return self._names
+
+    @property
+    def created(self):
+        """ Dict of the `Observation`s that have been created so far """
+        return dict(self._observations)
+
+    @property
+    def coords(self):
+        """ `SkyCoord` array of the field positions, in row order """
+        if self._coords is None:
+            self._coords = SkyCoord(ra=self._columns['ra'] * u.degree,
+                                    dec=self._columns['dec'] * u.degree, frame='icrs')
+
+        return self._coords
+
+##################################################################################################
+# Methods
+##################################################################################################
+
+    def column(self, name, idx=None):
+        """ Values of a column
+
+        Args:
+            name (str): One of `ra`, `dec`, `priority`, `exp_time` (seconds),
+                `min_nexp` or `exp_set_size`
+            idx (numpy.array, optional): Rows to return, defaults to all
+
+        Returns:
+            numpy.array: Column values
+        """
+        values = self._columns[name].copy()
+
+        # Created observations may have been changed
+        if name in ('priority', 'exp_time', 'min_nexp', 'exp_set_size'):
+            for obs_name, obs in self._observations.items():
+                value = getattr(obs, name)
+                if name == 'exp_time':
+                    value = value.to(u.second).value
+
+                values[self._rows[obs_name]] = value
+
+        if idx is not None:
+            values = values[idx]
+
+        return values
+
+    def minimum_duration(self, idx=None):
+        """ Minimum duration in seconds of the observations in rows `idx` """
+        return self.column('exp_time', idx) * self.column('min_nexp', idx)
+
+    def extend(self, field_configs):
+        """ Add observations from a list of field configurations
+
+        Configurations that would not make a valid `Observation` are skipped
+        with a warning. Positions are parsed all at once where possible.
+
+        Args:
+            field_configs (list): Field configuration dicts with at least a
+                `name` and `position`
+
+        Returns:
+            int: Number of observations added
+        """
+        names = list()
+        values = {name: list() for name in self._columns.keys() if name not in ('ra', 'dec')}
+
+        valid_configs = list()
+        for field_config in field_configs:
+            assert field_config['name'] not in self._rows and field_config['name'] not in names, \
+                self.logger.error("Cannot add duplicate field name")
+
+            try:
+                row = self._parse_config(field_config)
+            except Exception as e:
+                self.logger.warning("Skipping invalid field config: {}".format(field_config))
+                self.logger.warning(e)
+            else:
+                names.append(field_config['name'])
+                valid_configs.append(field_config)
+                for key, value in row.items():
+                    values[key].append(value)
+
+        coords = self._parse_positions(valid_configs)
+        keep = [i for i, coord in enumerate(coords) if coord is not None]
+
+        if len(keep) < len(valid_configs):
+            names = [names[i] for i in keep]
+            values = {key: [column[i] for i in keep] for key, column in values.items()}
+            coords = [coords[i] for i in keep]
+
+        if len(keep) == 0:
+            return 0
+
+        values['ra'] = [coord[0] for coord in coords]
+        values['dec'] = [coord[1] for coord in coords]
+
+        for row, name in enumerate(names, start=len(self._names)):
+            self._rows[name] = row
+        self._names.extend(names)
+
+        for key, column in self._columns.items():
+            self._columns[key] = np.concatenate([column, np.array(values[key], dtype=column.dtype)])
+
+        self._coords = None
+
+        return len(names)
+
+    def to_arrays(self):
+        """ The table as a dict of arrays, as used by `extend_arrays`
+
+        Only the columns as loaded are included, changes to any created
+        observations are not.
+        """
+        arrays = {key: column.copy() for key, column in self._columns.items()}
+        arrays['name'] = np.array(self._names, dtype=str)
+
+        return arrays
+
+    def extend_arrays(self, arrays):
+        """ Add observations from arrays that have already been checked
+
+        Args:
+            arrays (dict): A `name` array and an array for each column, e.g.
+                from `to_arrays`
+
+        Returns:
+            int: Number of observations added
+        """
+        names = [str(name) for name in arrays['name']]
+
+        for name in names:
+            assert name not in self._rows, self.logger.error("Cannot add duplicate field name")
+
+        for row, name in enumerate(names, start=len(self._names)):
+            self._rows[name] = row
+        self._names.extend(names)
+
+        for key, column in self._columns.items():
+            self._columns[key] = np.concatenate([column, np.asarray(arrays[key], dtype=column.dtype)])
+
+        self._coords = None
+
+        return len(names)
+
+    def remove(self, name):
+        """ Remove the observation of the field `name`
+
+        Raises:
+            KeyError: If there is no such observation
+        """
+        row = self._rows[name]
+
+        del self._names[row]
+        for key, column in self._columns.items():
+            self._columns[key] = np.delete(column, row)
+
+        self._rows = {obs_name: i for i, obs_name in enumerate(self._names)}
+        self._observations.pop(name, None)
+        self._coords = None
+
+    def rows(self, idx=None):
+        """ View of a subset of rows
+
+        Args:
+            idx (numpy.array, optional): Rows in the view, defaults to all
+
+        Returns:
+            ObservationRows: Sequence of the observations in the rows
+        """
+        if idx is None:
+            idx = np.arange(len(self._names))
+
+        return ObservationRows(self, idx)
+
+##################################################################################################
+# Private Methods
+##################################################################################################
+
+    def _parse_config(self, field_config):
+        """ Check a configuration the same way `Observation` does """
+        exp_time = field_config.get('exp_time', DEFAULT_EXP_TIME)
+        if isinstance(exp_time, u.Quantity):
+            exp_time = exp_time.to(u.second).value
+
+        row = {
+            'exp_time': float(exp_time),
+            'min_nexp': int(field_config.get('min_nexp', DEFAULT_MIN_NEXP)),
+            'exp_set_size': int(field_config.get('exp_set_size', DEFAULT_EXP_SET_SIZE)),
+            'priority': float(field_config.get('priority', DEFAULT_PRIORITY)),
+        }
+
+        assert row['exp_time'] > 0.0, "Exposure time (exp_time) must be greater than 0"
+        assert row['min_nexp'] % row['exp_set_size'] == 0, \
+            "Minimum number of exposures (min_nexp) must be multiple of set size (exp_set_size)"
+        assert row['priority'] > 0.0, "Priority must be 1.0 or larger"
+
+        return row
+
+    def _parse_positions(self, field_configs):
+        """ RA and Dec (degrees) of each position, None for any that can't be parsed """
+        if len(field_configs) == 0:
+            return list()
+
+        positions = [field_config['position'] for field_config in field_configs]
+
+        try:
+            coords = SkyCoord(positions, frame='icrs')
+        except Exception:
+            # Find the bad ones
+            coords = list()
+            for field_config in field_configs:
+                try:
+                    coord = SkyCoord(field_config['position'], frame='icrs')
+                except Exception as e:
+                    self.logger.warning("Skipping invalid field config: {}".format(field_config))
+                    self.logger.warning(e)
+                    coords.append(None)
+                else:
+                    coords.append((coord.ra.degree, coord.dec.degree))
+
+            return coords
+
+        return list(zip(coords.ra.degree, coords.dec.degree))
+
+    def _create_observation(self, name):
+        row = self._rows[name]
+
+        field = Field(name, SkyCoord(self._columns['ra'][row] * u.degree,
+                                     self._columns['dec'][row] * u.degree, frame='icrs'))
+
+        return Observation(field,
+                           exp_time=self._columns['exp_time'][row] * u.second,
+                           min_nexp=int(self._columns['min_nexp'][row]),
+                           exp_set_size=int(self._columns['exp_set_size'][row]),
+                           priority=self._columns['priority'][row])
+
+    def __getitem__(self, name):
+        if name not in self._observations:
+            if name not in self._rows:
+                raise KeyError(name)
+
+            self._observations[name] = self._create_observation(name)
+
+        return self._observations[name]
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def __iter__(self):
+        return iter(list(self._names))
+
+    def __len__(self):
+        return len(self._names)
+
+
+class ObservationRows(Sequence):
+
+    def __init__(self, table, idx):
+        """ A subset of the rows of an `ObservationTable`
+
+        Indexing gives the `~pocs.scheduler.observation.Observation` of a row
+        (created if needed) while `names`, `coords`, `priority` and
+        `minimum_duration` give column values without creating any objects, so
+        constraints can score the rows in bulk.
+
+        Args:
+            table (ObservationTable): The table
+            idx (numpy.array): Rows of the table
+        """
+        self._table = table
+        self._idx = np.asarray(idx, dtype=int)
+
+    @property
+    def idx(self):
+        """ Rows of the table in the view """
+        return self._idx
+
+    @property
+    def names(self):
+        """ Field names of the rows """
+        return [self._table.names[i] for i in self._idx]
+
+    @property
+    def coords(self):
+        """ `SkyCoord` array of the field positions of the rows """
+        return self._table.coords[self._idx]
+
+    @property
+    def priority(self):
+        """ Priorities of the rows """
+        return self._table.column('priority', self._idx)
+
+    @property
+    def minimum_duration(self):
+        """ Minimum duration of the rows, in seconds """
+        return self._table.minimum_duration(self._idx)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return ObservationRows(self._table, self._idx[i])
+
+        return self._table[self._table.names[self._idx[i]]]
+
+    def __len__(self):
+        return len(self._idx)
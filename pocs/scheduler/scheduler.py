@@ -2,19 +2,26 @@ import os
 import yaml
 
 from collections import OrderedDict
+from collections import namedtuple
 
 from astroplan import Observer
 from astropy import units as u
 
 from .. import PanBase
 from ..utils import current_time
-from .field import Field
-from .observation import Observation
+from ..utils import listify
+from .catalog import FieldCatalogCache
+from .ephemeris import NightlyEphemeris
+from .field_index import FieldIndex
+from .observation_table import ObservationTable
+
+PlanBlock = namedtuple('PlanBlock', ['name', 'start', 'end', 'merit'])
 
 
 class BaseScheduler(PanBase):
 
-    def __init__(self, observer, fields_list=None, fields_file=None, constraints=list(), *args, **kwargs):
+    def __init__(self, observer, fields_list=None, fields_file=None, constraints=list(), use_plan=False,
+                 catalog_cache=True, *args, **kwargs):
         """Loads `~pocs.scheduler.field.Field`s from a field
 
         Note:
@@ -29,6 +36,11 @@ class BaseScheduler(PanBase):
             fields_file (str): YAML file containing field parameters
             constraints (list, optional): List of `Constraints` to apply to each
                 observation
+            use_plan (bool, optional): If observations should be taken from a
+                plan built for the whole night, defaults to False
+            catalog_cache (bool, optional): If a parsed `fields_file` should be
+                cached (see `~pocs.scheduler.catalog.FieldCatalogCache`), defaults
+                to True
             *args: Arguments to be passed to `PanBase`
             **kwargs: Keyword args to be passed to `PanBase`
         """
@@ -38,12 +50,26 @@ class BaseScheduler(PanBase):
 
         self._fields_file = fields_file
         self._fields_list = fields_list
-        self._observations = dict()
+        self._observations = ObservationTable()
+        self._field_index = None
+
+        self._catalog_cache = FieldCatalogCache() if catalog_cache else None
 
         self.observer = observer
 
+        # Nightly ephemeris shared by all the constraints
+        self.ephemeris = NightlyEphemeris(observer)
+
         self.constraints = constraints
 
+        # Running cost and veto rate of each constraint, used to order them
+        self._constraint_stats = dict()
+        self._constraint_stats_decay = 0.8
+
+        self.use_plan = use_plan
+        self._plan = None
+        self._plan_end_of_night = None
+
         self._current_observation = None
         self.observed_list = OrderedDict()
 
@@ -56,17 +82,34 @@ class BaseScheduler(PanBase):
 
     @property
     def observations(self):
-        """Returns a dict of `~pocs.scheduler.observation.Observation` objects
-        with `~pocs.scheduler.observation.Observation.field.field_name` as the key
+        """Returns a dict-like `~pocs.scheduler.observation_table.ObservationTable`
+        of `~pocs.scheduler.observation.Observation` objects with
+        `~pocs.scheduler.observation.Observation.field.name` as the key
 
         Note:
-            `read_field_list` is called if list is None
+            `read_field_list` is called if list is None. The `Observation`
+            objects are only created when they are looked up.
         """
-        if len(self._observations.keys()) == 0:
+        if len(self._observations) == 0:
+            self._observations = ObservationTable()
             self.read_field_list()
 
         return self._observations
 
+    @property
+    def field_index(self):
+        """A `~pocs.scheduler.field_index.FieldIndex` over the fields of the
+        `observations`, in the same order as `observations`
+
+        Note:
+            The index is built when the field list is read and rebuilt on
+            first use after an observation is added or removed
+        """
+        if self._field_index is None:
+            self._build_field_index()
+
+        return self._field_index
+
     @property
     def current_observation(self):
         """The observation that is currently selected by the scheduler
@@ -129,7 +172,9 @@ class BaseScheduler(PanBase):
     def fields_file(self, new_file):
         # Clear out existing list and observations
         self._fields_list = None
-        self._observations = dict()
+        self._observations = ObservationTable()
+        self._field_index = None
+        self.clear_plan()
 
         self._fields_file = new_file
         if new_file is not None:
@@ -148,21 +193,64 @@ class BaseScheduler(PanBase):
         A file will be read by `~pocs.scheduler.priority.read_field_list` upon
         being set.
 
+        If the `fields_file` was loaded from the catalog cache the file is
+        only read when the list is first needed.
+
         Note:
             Setting a new `fields_list` will clear all existing fields
 
         """
+        if self._fields_list is None and self._fields_file is not None:
+            with open(self._fields_file, 'r') as f:
+                self._fields_list = yaml.load(f.read())
+
         return self._fields_list
 
     @fields_list.setter
     def fields_list(self, new_list):
         # Clear out existing list and observations
         self._fields_file = None
-        self._observations = dict()
+        self._observations = ObservationTable()
+        self._field_index = None
+        self.clear_plan()
 
         self._fields_list = new_list
         self.read_field_list()
 
+    @property
+    def constraint_order(self):
+        """The `constraints` in the order they should be evaluated
+
+        Constraints that have not been measured yet come first (in the order
+        given) so that they get measured. The rest are ordered by their cost
+        per observation divided by their veto rate, so that cheap constraints
+        that veto many observations run first and the expensive constraints
+        only see the observations that survive them. As the merit of an
+        observation is a sum of scores the order does not change the result.
+        """
+        constraints = listify(self.constraints)
+
+        def rank(item):
+            i, constraint = item
+            stats = self._constraint_stats.get(constraint)
+            if stats is None:
+                return (0, 0., i)
+
+            return (1, stats['cost'] / max(stats['veto_rate'], 1e-3), i)
+
+        return [constraint for i, constraint in sorted(enumerate(constraints), key=rank)]
+
+    @property
+    def plan(self):
+        """The plan for the rest of the night
+
+        A list of `PlanBlock`s, each with the `name` of the observation, the
+        `start` and `end` time of the block and the `merit` of the observation
+        when it was planned. None if no plan has been created (or the plan was
+        cleared).
+        """
+        return self._plan
+
 
 ##########################################################################
 # Methods
@@ -182,9 +270,190 @@ class BaseScheduler(PanBase):
         """
         raise NotImplementedError
 
+    def rank_observations(self, time, planning=False):
+        """Rank the observations that are valid at the given time
+
+        Args:
+            time (astropy.time.Time): Time at which to rank the observations
+            planning (bool, optional): If the pass is for a plan (see
+                `create_plan`) rather than for the observation to take now,
+                defaults to False
+
+        Returns:
+            list: A list of tuples with name and merit of each valid observation,
+                best first
+        """
+        raise NotImplementedError
+
+    def create_plan(self, time=None, resolution=10 * u.minute):
+        """Plan observations from `time` until the end of the night
+
+        Steps through the night, ranking the observations at the start of each
+        block. A newly selected observation gets a block long enough for its
+        minimum duration, after which it is extended one set at a time while it
+        remains the top ranked observation. If nothing is valid, the plan skips
+        ahead by `resolution`.
+
+        This ranks the observations many times, so it should be called before
+        the night starts or while nothing is waiting on the scheduler (e.g. in
+        the `ready` state), not before a slew.
+
+        Args:
+            time (astropy.time.Time, optional): Start of the plan, defaults to now
+            resolution (u.minute, optional): Step to use when there is no valid
+                observation, defaults to 10 minutes
+
+        Returns:
+            list: The `plan`
+        """
+        if time is None:
+            time = current_time()
+
+        end_of_night = self.ephemeris.end_of_night(time)
+        self.logger.debug("Planning observations from {} to {}".format(time, end_of_night))
+
+        plan = list()
+
+        block_start = time
+        while block_start < end_of_night:
+            ranked = self.rank_observations(block_start, planning=True)
+
+            if len(ranked) == 0:
+                block_start = block_start + resolution
+                continue
+
+            name, merit = ranked[0]
+            observation = self.observations[name]
+
+            if len(plan) > 0 and plan[-1].name == name and plan[-1].end == block_start:
+                block_end = block_start + observation.set_duration
+                plan[-1] = plan[-1]._replace(end=block_end)
+            else:
+                block_end = block_start + observation.minimum_duration
+                plan.append(PlanBlock(name, block_start, block_end, merit))
+
+            block_start = block_end
+
+        self.logger.debug("Plan created with {} blocks".format(len(plan)))
+        self._plan = plan
+        self._plan_end_of_night = end_of_night
+
+        return self._plan
+
+    def needs_plan(self, time=None):
+        """Check if a plan should be created for the night of `time`
+
+        Args:
+            time (astropy.time.Time, optional): Time to check, defaults to now
+
+        Returns:
+            bool: True if `use_plan` is set and the `plan` is missing, used up
+                or for a different night
+        """
+        if not self.use_plan:
+            return False
+
+        if time is None:
+            time = current_time()
+
+        return self._plan is None or len(self._plan) == 0 or \
+            self._plan_end_of_night != self.ephemeris.end_of_night(time)
+
+    def get_planned_observation(self, time):
+        """Get the planned block for the given time
+
+        Blocks that have already finished are removed from the `plan`. If the
+        observation of the current block is no longer available the plan is
+        cleared so that it will be recreated.
+
+        Args:
+            time (astropy.time.Time): Time of the observation
+
+        Returns:
+            PlanBlock: The block for `time`, or None if nothing is planned
+        """
+        if self._plan is None:
+            return None
+
+        while len(self._plan) > 0 and self._plan[0].end <= time:
+            self._plan.pop(0)
+
+        if len(self._plan) == 0 or self._plan[0].start > time:
+            return None
+
+        block = self._plan[0]
+
+        if block.name not in self.observations or \
+                not self.observation_available(self.observations[block.name], time):
+            self.logger.debug("Planned observation {} no longer available".format(block.name))
+            self.clear_plan()
+            return None
+
+        return block
+
+    def close_pool(self):
+        """Shut down any worker processes, the `BaseScheduler` has none"""
+        pass
+
+    def clear_plan(self):
+        """Clear the plan, e.g. when weather or an interrupt invalidates it"""
+        if self._plan is not None:
+            self.logger.debug('Clearing plan')
+
+        self._plan = None
+        self._plan_end_of_night = None
+
+    @u.quantity_input(radius=u.degree)
+    def observations_near(self, position, radius):
+        """Names of the observations with a field within `radius` of `position`
+
+        Uses the `field_index`, so only the fields near `position` are checked.
+
+        Args:
+            position (astropy.coordinates.SkyCoord): Center of the search, e.g.
+                the current pointing or the zenith (as an `AltAz` coordinate)
+            radius (u.degree): Radius of the search
+
+        Returns:
+            list: Names of the observations, in `observations` order
+        """
+        return self.field_index.query_cone_names(position, radius)
+
+    def update_constraint_stats(self, constraint, elapsed, num_checked, num_vetoed):
+        """Record the cost and veto rate of a constraint evaluation
+
+        Args:
+            constraint (`~pocs.scheduler.constraint.BaseConstraint`): The constraint
+            elapsed (float): Seconds taken to evaluate the constraint
+            num_checked (int): Number of observations checked
+            num_vetoed (int): Number of those observations vetoed
+        """
+        if num_checked == 0:
+            return
+
+        cost = elapsed / num_checked
+        veto_rate = num_vetoed / num_checked
+
+        stats = self._constraint_stats.get(constraint)
+        if stats is None:
+            stats = {'cost': cost, 'veto_rate': veto_rate, 'count': 0}
+        else:
+            # Weight recent passes more so the order follows the sky over the night
+            decay = self._constraint_stats_decay
+            stats['cost'] = decay * stats['cost'] + (1 - decay) * cost
+            stats['veto_rate'] = decay * stats['veto_rate'] + (1 - decay) * veto_rate
+
+        stats['count'] += 1
+        self._constraint_stats[constraint] = stats
+
     def status(self):
         return {
             'constraints': self.constraints,
+            'constraint_order': [{
+                'constraint': str(constraint),
+                'cost': self._constraint_stats.get(constraint, {}).get('cost'),
+                'veto_rate': self._constraint_stats.get(constraint, {}).get('veto_rate'),
+            } for constraint in self.constraint_order],
             'current_observation': self.current_observation,
         }
 
@@ -209,21 +478,13 @@ class BaseScheduler(PanBase):
         Args:
             field_config (dict): Configuration items for `Observation`
         """
-        assert field_config['name'] not in self._observations.keys(), \
+        assert field_config['name'] not in self._observations, \
             self.logger.error("Cannot add duplicate field name")
 
-        if 'exp_time' in field_config:
-            field_config['exp_time'] = float(field_config['exp_time']) * u.second
-
-        field = Field(field_config['name'], field_config['position'])
-
-        try:
-            obs = Observation(field, **field_config)
-        except Exception as e:
-            self.logger.warning("Skipping invalid field config: {}".format(field_config))
-            self.logger.warning(e)
-        else:
-            self._observations[field.name] = obs
+        # Invalid configs are skipped with a warning
+        if self._observations.extend([field_config]) > 0:
+            self._field_index = None
+            self.clear_plan()
 
     def remove_observation(self, field_name):
         """Removes an `Observation` from the scheduler
@@ -234,25 +495,51 @@ class BaseScheduler(PanBase):
         """
         try:
             obs = self._observations[field_name]
-            del self._observations[field_name]
+            self._observations.remove(field_name)
+            self._field_index = None
+            self.clear_plan()
             self.logger.debug("Observation removed: {}".format(obs))
         except Exception:
             pass
 
     def read_field_list(self):
-        """Reads the field file and creates valid `Observations` """
+        """Reads the field file and creates valid `Observations`
+
+        A `fields_file` that has been read before is loaded from the catalog
+        cache, if enabled, without parsing it again. In that case the file is
+        only read if `fields_list` is used.
+        """
+        from_file = False
+
         if self._fields_file is not None:
             self.logger.debug('Reading fields from file: {}'.format(self.fields_file))
 
             if not os.path.exists(self.fields_file):
                 raise FileNotFoundError
 
+            if self._catalog_cache is not None:
+                arrays = self._catalog_cache.load(self.fields_file)
+                if arrays is not None:
+                    self._observations.extend_arrays(arrays)
+                    self.clear_plan()
+
+                    self._build_field_index()
+                    return
+
             with open(self.fields_file, 'r') as f:
                 self._fields_list = yaml.load(f.read())
 
+            from_file = True
+
         if self._fields_list is not None:
-            for field_config in self._fields_list:
-                self.add_observation(field_config)
+            # Add the whole list at once so positions are parsed together
+            self._observations.extend(self._fields_list)
+            self.clear_plan()
+
+            self._build_field_index()
+
+            if from_file and self._catalog_cache is not None:
+                self._catalog_cache.save(self.fields_file, self._observations.to_arrays())
 
 ##########################################################################
 # Utility Methods
@@ -261,3 +548,7 @@ class BaseScheduler(PanBase):
 ##########################################################################
 # Private Methods
 ##########################################################################
+
+    def _build_field_index(self):
+        """Build the `field_index` from the current `observations`"""
+        self._field_index = FieldIndex(self._observations.names, self._observations.coords)
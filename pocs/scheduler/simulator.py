@@ -0,0 +1,192 @@
+import os
+
+from collections import OrderedDict
+from collections import namedtuple
+
+from astropy import units as u
+
+from .. import PanBase
+from ..utils import current_time
+
+TimelineBlock = namedtuple('TimelineBlock', ['name', 'start', 'end', 'num_exposures', 'merit'])
+
+
+class SchedulerSimulator(PanBase):
+
+    @u.quantity_input(slew_time=u.second, readout_time=u.second, idle_time=u.minute)
+    def __init__(self, scheduler, slew_time=120 * u.second, readout_time=10 * u.second,
+                 idle_time=10 * u.minute, *args, **kwargs):
+        """ Runs a scheduler over a whole night without waiting for it
+
+        The simulator follows the same steps as the state machine: it asks the
+        scheduler for an observation, slews if the observation changed and
+        takes exposures one at a time until at least `min_nexp` have been taken
+        and a set of `exp_set_size` is complete, then asks again. If there is
+        nothing to observe it waits `idle_time` and tries again.
+
+        Rather than sleeping, a virtual clock is moved forward by the length of
+        each step. The clock is also set as `POCSTIME` so that anything using
+        `~pocs.utils.current_time` (e.g. the `seq_time` of an observation)
+        sees the simulated time.
+
+        Args:
+            scheduler (`~pocs.scheduler.scheduler.BaseScheduler`): The scheduler,
+                with its observations and constraints
+            slew_time (u.second, optional): Time to slew to a new observation,
+                defaults to 120 seconds
+            readout_time (u.second, optional): Time between exposures, defaults
+                to 10 seconds
+            idle_time (u.minute, optional): Wait when nothing can be observed,
+                defaults to 10 minutes
+            *args: Arguments to be passed to `PanBase`
+            **kwargs: Keyword args to be passed to `PanBase`
+        """
+        super().__init__(*args, **kwargs)
+
+        self.scheduler = scheduler
+
+        self.slew_time = slew_time
+        self.readout_time = readout_time
+        self.idle_time = idle_time
+
+        self.timeline = list()
+
+##################################################################################################
+# Methods
+##################################################################################################
+
+    def run(self, start_time=None, end_time=None):
+        """ Simulate a night
+
+        Args:
+            start_time (astropy.time.Time, optional): Start of the simulation,
+                defaults to now (or the start of the night, if later)
+            end_time (astropy.time.Time, optional): End of the simulation,
+                defaults to the end of the night
+
+        Returns:
+            list: The `timeline`, a `TimelineBlock` for each visit to an
+                observation (or idle period, with a `name` of None). The
+                `merit` is from when the visit started
+        """
+        if start_time is None:
+            start_time = current_time()
+
+        night = self.scheduler.ephemeris.get_night(start_time)
+
+        time = start_time
+        if time < night['start']:
+            time = night['start']
+
+        if end_time is None:
+            end_time = night['end']
+
+        self.logger.debug("Simulating night from {} to {}".format(time, end_time))
+
+        self.timeline = list()
+
+        # As in the `ready` state, before the first observation
+        if self.scheduler.needs_plan(time):
+            self.scheduler.create_plan(time=time)
+
+        pocs_time = os.getenv('POCSTIME')
+        try:
+            while time < end_time:
+                time = self._visit(time, end_time)
+        finally:
+            if pocs_time is None:
+                os.environ.pop('POCSTIME', None)
+            else:
+                os.environ['POCSTIME'] = pocs_time
+
+        self.logger.debug("Simulation done with {} blocks".format(len(self.timeline)))
+
+        return self.timeline
+
+    def summary(self):
+        """ Per-field summary of the `timeline`
+
+        Returns:
+            dict: For each observed field (best first by total exposure time),
+                the number of `visits`, the number of `exposures` and the total
+                `exposure_time` in seconds, plus an `idle` entry with the
+                `time` in seconds when nothing was observed
+        """
+        fields = dict()
+        idle = 0.
+
+        for block in self.timeline:
+            if block.name is None:
+                idle += (block.end - block.start).sec
+                continue
+
+            exp_time = self.scheduler.observations[block.name].exp_time.to(u.second).value
+
+            field = fields.setdefault(block.name, {'visits': 0, 'exposures': 0, 'exposure_time': 0.})
+            field['visits'] += 1
+            field['exposures'] += block.num_exposures
+            field['exposure_time'] += block.num_exposures * exp_time
+
+        summary = OrderedDict(sorted(fields.items(), key=lambda item: item[1]['exposure_time'], reverse=True))
+        summary['idle'] = {'time': idle}
+
+        return summary
+
+##################################################################################################
+# Private Methods
+##################################################################################################
+
+    def _set_clock(self, time):
+        os.environ['POCSTIME'] = time.isot
+
+    def _visit(self, time, end_time):
+        """ Schedule at `time` and observe, returning the time afterwards """
+        previous_observation = self.scheduler.current_observation
+
+        self._set_clock(time)
+        self.scheduler.get_observation(time=time)
+
+        observation = self.scheduler.current_observation
+
+        if observation is None:
+            idle_end = min(time + self.idle_time, end_time)
+            self._add_block(TimelineBlock(None, time, idle_end, 0, 0.))
+            return idle_end
+
+        start = time
+        if observation is not previous_observation:
+            time = time + self.slew_time
+
+        num_exposures = 0
+        while True:
+            exposure_end = time + observation.exp_time + self.readout_time
+            if exposure_end > end_time:
+                time = end_time
+                break
+
+            time = exposure_end
+            self._set_clock(time)
+
+            observation.exposure_list['{}_{:03d}'.format(observation.seq_time, observation.current_exp)] = None
+            observation.current_exp += 1
+            num_exposures += 1
+
+            # Same check as the `analyzing` state
+            if observation.current_exp >= observation.min_nexp and \
+                    observation.current_exp % observation.exp_set_size == 0:
+                break
+
+        self._add_block(TimelineBlock(observation.name, start, time, num_exposures, observation.merit))
+
+        return time
+
+    def _add_block(self, block):
+        """ Add to the `timeline`, extending the last block if it continues it """
+        if len(self.timeline) > 0:
+            last = self.timeline[-1]
+            if last.name == block.name and last.end == block.start:
+                self.timeline[-1] = last._replace(end=block.end,
+                                                  num_exposures=last.num_exposures + block.num_exposures)
+                return
+
+        self.timeline.append(block)
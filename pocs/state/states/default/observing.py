@@ -1,5 +1,6 @@
+import time
+
 from ....utils import error
-from time import sleep
 
 wait_interval = 15.
 
@@ -14,18 +15,19 @@ def on_enter(event_data):
         # Start the observing
         camera_events = pocs.observatory.observe()
 
-        wait_time = 0.
+        start_time = time.monotonic()
         while not all([event.is_set() for event in camera_events.values()]):
             pocs.check_messages()
             if pocs.interrupted:
                 pocs.say("Observation interrupted!")
                 break
 
-            pocs.logger.debug('Waiting for images: {} seconds'.format(wait_time))
+            wait_time = time.monotonic() - start_time
+            pocs.logger.debug('Waiting for images: {:.0f} seconds'.format(wait_time))
             pocs.status()
 
-            sleep(wait_interval)
-            wait_time += wait_interval
+            # Returns early if a command interrupts
+            pocs.sleep(delay=wait_interval, with_status=False)
 
     except error.Timeout as e:
         pocs.logger.warning("Timeout while waiting for images. Something wrong with camera, going to park.")
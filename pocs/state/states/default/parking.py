@@ -5,6 +5,9 @@ def on_enter(event_data):
     # Clear any current observation
     pocs.observatory.current_observation = None
 
+    # Whatever sent us to park invalidates the plan for the night
+    pocs.observatory.scheduler.clear_plan()
+
     pocs.next_state = 'parked'
 
     pocs.say("I'm takin' it on home and then parking.")
@@ -9,4 +9,9 @@ def on_enter(event_data):
 
     pocs.observatory.mount.unpark()
 
+    # Plan the night now rather than before the first slew
+    if pocs.observatory.scheduler.needs_plan():
+        pocs.say("Planning the night")
+        pocs.observatory.scheduler.create_plan()
+
     pocs.next_state = 'scheduling'
@@ -1,6 +1,7 @@
 import os
 import pytest
 
+from pocs import _config
 from pocs.utils.config import load_config
 from pocs.utils.data import download_all_files
 
@@ -17,9 +18,21 @@ def pytest_addoption(parser):
     parser.addoption("--solve", action="store_true", default=False, help="If tests that require solving should be run")
 
 
+@pytest.fixture(scope='session', autouse=True)
+def cache_dir(tmpdir_factory):
+    """ Keep caches written by the tests (e.g. the field catalog cache) out of $PANDIR """
+    cache_dir = str(tmpdir_factory.mktemp('cache'))
+    _config['directories']['cache'] = cache_dir
+
+    return cache_dir
+
+
 @pytest.fixture
-def config():
-    return load_config(ignore_local=True, simulator=['all'])
+def config(cache_dir):
+    config = load_config(ignore_local=True, simulator=['all'])
+    config['directories']['cache'] = cache_dir
+
+    return config
 
 
 @pytest.fixture
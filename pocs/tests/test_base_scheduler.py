@@ -206,3 +206,22 @@ def test_remove_field(scheduler):
 
     scheduler.remove_observation('HD 189733')
     assert orig_keys != list(scheduler.observations.keys())
+
+
+def test_fields_file_cache(observer, tmpdir, simple_fields_file):
+    fields_file = str(tmpdir.join('fields.yaml'))
+    with open(simple_fields_file, 'r') as f_in, open(fields_file, 'w') as f_out:
+        f_out.write(f_in.read())
+
+    scheduler = Scheduler(observer, fields_file=fields_file, constraints=constraints)
+    assert scheduler.fields_list is not None
+    assert scheduler._catalog_cache.load(fields_file) is not None
+
+    cached_scheduler = Scheduler(observer, fields_file=fields_file, constraints=constraints)
+    assert cached_scheduler._fields_list is None
+    assert list(cached_scheduler.observations.keys()) == list(scheduler.observations.keys())
+
+    # Read when needed
+    assert cached_scheduler.fields_list == scheduler.fields_list
+
+    scheduler._catalog_cache.clear(fields_file)
@@ -1,4 +1,5 @@
 import pytest
+import threading
 
 from pocs.camera.simulator import Camera
 from pocs.focuser.simulator import Focuser
@@ -53,3 +54,26 @@ def test_camera_readout_time():
     assert sim_camera.readout_time == 5.0
     sim_camera = Camera(readout_time=2.0)
     assert sim_camera.readout_time == 2.0
+
+
+def test_camera_readout_in_pipeline():
+    sim_camera = Camera()
+
+    readout = threading.Event()
+    release = threading.Event()
+    signal_event = threading.Event()
+
+    info = {'image_id': 'foo', 'is_primary': False}
+    sim_camera._process_in_pipeline(info, signal_event, [('index', lambda info: release.wait(timeout=10))],
+                                    readout=readout)
+
+    # Queued straight away, but not done until the image is read out
+    assert signal_event.wait(timeout=0.5) is False
+
+    # Other cameras don't wait for the rest of the stages
+    readout.set()
+    assert signal_event.wait(timeout=10)
+    assert sim_camera.pipeline.is_idle is False
+
+    release.set()
+    assert sim_camera.pipeline.join(timeout=10)
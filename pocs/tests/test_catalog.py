@@ -0,0 +1,76 @@
+import os
+import pytest
+import yaml
+
+from pocs.scheduler.catalog import FieldCatalogCache
+from pocs.scheduler.observation_table import ObservationTable
+
+
+@pytest.fixture
+def fields_file(tmpdir):
+    fields_file = str(tmpdir.join('fields.yaml'))
+    with open(fields_file, 'w') as f:
+        f.write(yaml.dump([
+            {'name': 'HD 189733', 'position': '20h00m43.7135s +22d42m39.0645s', 'priority': 100},
+            {'name': 'Wasp 33', 'position': '02h26m51.0582s +37d33m01.733s', 'exp_time': 60,
+             'min_nexp': 30, 'exp_set_size': 15},
+        ]))
+
+    return fields_file
+
+
+@pytest.fixture
+def catalog_cache(tmpdir):
+    return FieldCatalogCache(cache_dir=str(tmpdir.join('cache')))
+
+
+@pytest.fixture
+def table(fields_file):
+    table = ObservationTable()
+    with open(fields_file, 'r') as f:
+        table.extend(yaml.load(f.read()))
+
+    return table
+
+
+def test_no_cache(catalog_cache, fields_file):
+    assert catalog_cache.load(fields_file) is None
+
+
+def test_save_and_load(catalog_cache, fields_file, table):
+    catalog_cache.save(fields_file, table.to_arrays())
+    assert os.path.exists(catalog_cache.cache_path(fields_file))
+
+    cached_table = ObservationTable()
+    cached_table.extend_arrays(catalog_cache.load(fields_file))
+
+    assert cached_table.names == table.names
+    for column in ['ra', 'dec', 'priority', 'exp_time', 'min_nexp', 'exp_set_size']:
+        assert list(cached_table.column(column)) == list(table.column(column))
+
+    assert cached_table['Wasp 33'].min_nexp == 30
+
+
+def test_touched_file(catalog_cache, fields_file, table):
+    catalog_cache.save(fields_file, table.to_arrays())
+
+    stat = os.stat(fields_file)
+    os.utime(fields_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert catalog_cache.load(fields_file) is not None
+
+
+def test_changed_file(catalog_cache, fields_file, table):
+    catalog_cache.save(fields_file, table.to_arrays())
+
+    with open(fields_file, 'a') as f:
+        f.write(yaml.dump([{'name': 'M42', 'position': '05h35m17.2992s -05d23m27.996s'}]))
+
+    assert catalog_cache.load(fields_file) is None
+
+
+def test_clear(catalog_cache, fields_file, table):
+    catalog_cache.save(fields_file, table.to_arrays())
+    catalog_cache.clear(fields_file)
+
+    assert catalog_cache.load(fields_file) is None
@@ -1,13 +1,17 @@
+import numpy as np
+import pickle
 import pytest
 import yaml
 
 from astroplan import Observer
 from astropy import units as u
 from astropy.coordinates import EarthLocation
+from astropy.coordinates import SkyCoord
 from astropy.coordinates import get_moon
 from astropy.time import Time
 
 from pocs.scheduler.field import Field
+from pocs.scheduler.field_index import FieldIndex
 from pocs.scheduler.observation import Observation
 
 from pocs.scheduler.constraint import Altitude
@@ -197,3 +201,139 @@ def test_moon_avoidance(observer):
 
     assert veto1 is False and veto2 is False
     assert score2 > score1
+
+
+@pytest.fixture
+def observations():
+    observations = list()
+    for config in field_list:
+        config = dict(config)
+        if 'exp_time' in config:
+            config['exp_time'] = config['exp_time'] * u.second
+
+        observations.append(Observation(Field(config['name'], config['position']), **config))
+
+    return observations
+
+
+@pytest.mark.parametrize('constraint', [
+    Altitude(30 * u.degree),
+    Duration(30 * u.degree),
+    MoonAvoidance(),
+])
+def test_get_scores_matches_get_score(constraint, observations, observer):
+    time = Time('2016-08-13 10:00:00')
+
+    common_properties = {
+        'end_of_night': observer.tonight(time=time, horizon=-18 * u.degree)[-1],
+        'moon': get_moon(time, observer.location)
+    }
+
+    vetoes, scores = constraint.get_scores(time, observer, observations, **common_properties)
+
+    assert len(vetoes) == len(observations)
+    assert len(scores) == len(observations)
+
+    for observation, veto, score in zip(observations, vetoes, scores):
+        veto1, score1 = constraint.get_score(time, observer, observation, **common_properties)
+
+        assert veto == veto1
+        assert score == pytest.approx(score1, abs=1e-3)
+
+
+@pytest.fixture
+def random_observations():
+    rng = np.random.RandomState(42)
+
+    ra = rng.uniform(0, 360, 200)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, 200)))
+
+    return [Observation(Field('Field {}'.format(i), SkyCoord(ra[i] * u.degree, dec[i] * u.degree)),
+                        min_nexp=10 * rng.randint(1, 10))
+            for i in range(200)]
+
+
+@pytest.mark.parametrize('constraint', [
+    Altitude(30 * u.degree),
+    Duration(30 * u.degree),
+    MoonAvoidance(),
+])
+def test_stable_until(constraint, random_observations, observer):
+    time = Time('2016-08-13 10:00:00')
+    tolerance = 0.01
+
+    def scores(t):
+        common_properties = {
+            'end_of_night': observer.tonight(time=time, horizon=-18 * u.degree)[-1],
+            'moon': get_moon(t, observer.location)
+        }
+        return constraint.get_scores(t, observer, random_observations, **common_properties), common_properties
+
+    (veto, score), common_properties = scores(time)
+    until = constraint.stable_until(time, observer, random_observations, veto, score,
+                                    tolerance=tolerance, **common_properties)
+
+    assert all(until >= time.jd)
+
+    for minutes in [1, 5, 20]:
+        later = time + minutes * u.minute
+        (later_veto, later_score), _ = scores(later)
+
+        reusable = until >= later.jd
+        assert list(later_veto[reusable]) == list(veto[reusable])
+        assert np.all(np.abs(later_score[reusable] - score[reusable]) <= tolerance + 1e-9)
+
+
+def test_stable_until_default(observations, observer):
+    time = Time('2016-08-13 10:00:00')
+
+    until = BaseConstraint().stable_until(time, observer, observations, None, None)
+    assert all(until == time.jd)
+
+
+def test_moon_avoidance_field_index(observations, observer):
+    time = Time('2016-08-13 10:00:00')
+    moon = get_moon(time, observer.location)
+
+    # Put a field right next to the moon
+    near_moon = moon.transform_to('icrs')
+    observations[0].field = Field('Near Moon', SkyCoord(near_moon.ra + 1 * u.degree, near_moon.dec))
+
+    field_index = FieldIndex([obs.field.name for obs in observations],
+                             SkyCoord([obs.field.coord for obs in observations]))
+
+    m = MoonAvoidance()
+    vetoes, scores = m.get_scores(time, observer, observations, moon=moon)
+    index_vetoes, index_scores = m.get_scores(time, observer, observations, moon=moon, field_index=field_index)
+
+    assert index_vetoes[0]
+    assert list(index_vetoes) == list(vetoes)
+    assert np.allclose(index_scores, scores)
+
+
+def test_get_scores_fallback(observations, observer):
+    class OddConstraint(BaseConstraint):
+
+        def get_score(self, time, observer, observation, **kwargs):
+            return observation.priority < 100, 0.5 * self.weight
+
+    c = OddConstraint(weight=2.0)
+
+    vetoes, scores = c.get_scores(Time('2016-08-13 10:00:00'), observer, observations)
+
+    assert list(vetoes) == [obs.priority < 100 for obs in observations]
+    assert all(scores == 1.0)
+
+
+def test_pickle_constraint(observer, observation):
+    time = Time('2016-08-13 10:00:00')
+
+    duration = Duration(30 * u.degree)
+    duration.get_scores(time, observer, [observation])
+    assert duration._ephemeris is not None
+
+    copy = pickle.loads(pickle.dumps(duration))
+
+    assert copy.logger is duration.logger
+    assert copy.horizon == duration.horizon
+    assert copy._ephemeris is None
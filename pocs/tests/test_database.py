@@ -1,11 +1,26 @@
+import gzip
+import json
+import os
+import pymongo
 import pytest
+import queue
+import threading
+import time
 
+from bson import json_util
+from datetime import datetime
+from datetime import timedelta
+
+from pocs.scheduler.field import Field
+from pocs.utils import database
+from pocs.utils import storage
 from pocs.utils.database import PanMongo
+from pocs.utils.database import WriteBehindQueue
 
 
-@pytest.fixture
-def db():
-    return PanMongo()
+@pytest.fixture(params=['mongo', 'memory', 'sqlite'])
+def db(request, tmpdir):
+    return PanMongo(backend=request.param, db_file=str(tmpdir.join('panoptes.sqlite')))
 
 
 def test_insert_and_get_current(db):
@@ -44,3 +59,376 @@ def test_insert_and_no_collection(db):
 def test_bad_collection():
     with pytest.raises(AttributeError):
         db.insert_current('foobar', {'test': 'insert'})
+
+
+def test_shared_client():
+    db0 = PanMongo()
+    db1 = PanMongo()
+
+    assert db0._client is db1._client
+    assert db0._client is database.get_client()
+    assert db0.current.database.client is db0._client
+
+    assert PanMongo(port=27018)._client is not db0._client
+
+
+def test_no_client_on_create(monkeypatch):
+    monkeypatch.setattr(database, '_clients', dict())
+    monkeypatch.setattr(database, '_clients_pid', os.getpid())
+
+    PanMongo()
+    assert len(database._clients) == 0
+
+    PanMongo().current
+    assert len(database._clients) == 1
+
+
+def test_new_client_after_fork(monkeypatch):
+    db = PanMongo()
+    client = db._client
+
+    # As if this process had been forked from another
+    monkeypatch.setattr(database, '_clients_pid', -1)
+
+    assert db._client is not client
+    assert db._client is database.get_client()
+
+
+def test_shared_by_panbase():
+    fields = [Field('Field {}'.format(i), '20h00m43.7135s +22d42m39.0645s') for i in range(2)]
+
+    assert fields[0].db is fields[1].db
+    assert fields[0].db is database.get_shared_db()
+    assert 'db' not in fields[0].__dict__
+
+    db = PanMongo()
+    fields[0].db = db
+    assert fields[0].db is db
+    assert fields[1].db is database.get_shared_db()
+
+
+class RecordingCollection(object):
+    """ Records the writes made to a collection, optionally waiting on `gate` first """
+
+    def __init__(self, name, writes, gate=None):
+        self.name = name
+        self.writes = writes
+        self.gate = gate
+
+    def bulk_write(self, requests):
+        self._wait()
+        self.writes.append((self.name, 'bulk_write', list(requests)))
+
+    def insert_many(self, records):
+        self._wait()
+        self.writes.append((self.name, 'insert_many', list(records)))
+
+    def _wait(self):
+        if self.gate is not None:
+            assert self.gate.wait(timeout=10)
+
+
+@pytest.fixture
+def write_behind_db(monkeypatch):
+    writes = list()
+    gate = threading.Event()
+
+    db = PanMongo(write_behind=True, batch_size=10)
+    monkeypatch.setattr(db, '_collection', lambda name: RecordingCollection(name, writes, gate))
+
+    db.writes = writes
+    db.gate = gate
+    yield db
+
+    gate.set()
+    db.close()
+
+
+def test_write_behind_queue_batches():
+    batches = list()
+    writer = WriteBehindQueue(batches.append, max_size=100, batch_size=4)
+
+    for i in range(10):
+        writer.put(i)
+    writer.flush()
+
+    assert [write for batch in batches for write in batch] == list(range(10))
+    assert max(len(batch) for batch in batches) <= 4
+
+    writer.close()
+    assert writer.is_running is False
+
+
+def test_write_behind_queue_backpressure():
+    gate = threading.Event()
+    writer = WriteBehindQueue(lambda batch: gate.wait(timeout=10), max_size=2, batch_size=1)
+
+    # One being written and two waiting
+    for i in range(3):
+        writer.put(i, timeout=1)
+
+    with pytest.raises(queue.Full):
+        writer.put(3, timeout=0.1)
+
+    gate.set()
+    writer.put(3, timeout=1)
+    writer.close()
+
+
+def test_write_behind_read_after_write(write_behind_db):
+    db = write_behind_db
+
+    _id = db.insert_current('weather', {'safe': True})
+    assert _id is not None
+
+    # Still queued but visible
+    assert len(db.writes) == 0
+    assert db.get_current('weather')['data'] == {'safe': True}
+
+    db.insert_current('weather', {'safe': False}, include_collection=False)
+    assert db.get_current('weather')['data'] == {'safe': False}
+
+    db.gate.set()
+    db.flush()
+
+    assert db._pending == dict()
+
+    currents = [request for name, op, requests in db.writes if name == 'current' for request in requests]
+    assert len(currents) == 2
+
+    records = [record for name, op, records in db.writes if name == 'weather' for record in records]
+    assert len(records) == 1
+    assert records[0]['_id'] == _id
+    assert records[0]['data'] == {'safe': True}
+
+
+def test_write_behind_insert(write_behind_db):
+    db = write_behind_db
+    db.gate.set()
+
+    ids = [db.insert('observations', {'image_id': i}) for i in range(25)]
+    assert len(set(ids)) == 25
+
+    db.insert('foobar', {'test': 'insert'})
+
+    db.close()
+
+    records = [record for name, op, records in db.writes for record in records]
+    assert [record['image_id'] for record in records] == list(range(25))
+    assert [record['_id'] for record in records] == ids
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_backend_queries(backend, tmpdir):
+    db = PanMongo(backend=backend, db_file=str(tmpdir.join('panoptes.sqlite')))
+
+    start = datetime(2017, 1, 1)
+    for i in range(5):
+        db.insert_current('environment', {'i': i, 'nested': {'even': i % 2 == 0}})
+        db.environment.update_one({'data.i': i}, {'$set': {'date': start + timedelta(hours=i)}})
+
+    records = db.environment.find({'date': {'$gt': start, '$lt': start + timedelta(hours=4)}}) \
+        .sort([('date', pymongo.DESCENDING)])
+    assert [record['data']['i'] for record in records] == [3, 2, 1]
+
+    assert db.environment.find({'data.nested.even': True}).count() == 3
+    assert db.environment.find({'data.i': {'$in': [1, 4, 7]}}).count() == 2
+    assert db.environment.find_one({'data.missing': {'$exists': True}}) is None
+    assert isinstance(db.environment.find_one()['date'], datetime)
+
+    assert db.get_current('environment')['data']['i'] == 4
+    assert db.current.find({'type': 'environment'}).count() == 1
+
+    db.environment.update({'data.i': 0}, {'$set': {'offset_info': {'delta_ra': 1.}}})
+    assert db.environment.find_one({'data.i': 0})['offset_info']['delta_ra'] == 1.
+
+    db.environment.remove({'data.i': {'$gte': 3}})
+    assert db.environment.find().count() == 3
+
+
+def test_sqlite_backend_persists(tmpdir, monkeypatch):
+    db_file = str(tmpdir.join('panoptes.sqlite'))
+
+    _id = PanMongo(backend='sqlite', db_file=db_file).insert_current('weather', {'safe': True})
+
+    # A new process would start with a new store on the same file
+    monkeypatch.setattr(storage, '_stores', dict())
+
+    db = PanMongo(backend='sqlite', db_file=db_file)
+    assert db.get_current('weather')['data']['safe'] is True
+    assert db.weather.find_one()['_id'] == _id
+
+
+def test_sqlite_backend_indexed_queries(tmpdir):
+    store = storage.SQLiteStore(str(tmpdir.join('panoptes.sqlite')))
+    collection = store.collection('environment')
+
+    start = datetime(2017, 1, 1)
+    collection.insert_many([{'type': 'weather' if i % 2 else 'environment', 'date': start + timedelta(hours=i), 'i': i}
+                            for i in range(10)])
+    # Values that can't be indexed are still found
+    collection.insert_one({'type': ['weather', 'other'], 'date': 'yesterday', 'i': 10})
+    collection.insert_one({'i': 11})
+
+    assert [record['i'] for record in collection.find({'type': 'weather'})] == [1, 3, 5, 7, 9, 10]
+    assert [record['i'] for record in collection.find({'type': {'$in': ['other']}})] == [10]
+    assert collection.find({'type': None}).count() == 1
+    assert collection.find({'date': 'yesterday'}).count() == 1
+
+    # Read in pages, sorted by the date column
+    cursor = collection.find({'date': {'$gte': start + timedelta(hours=2), '$lt': start + timedelta(hours=9)}},
+                             batch_size=2)
+    assert [record['i'] for record in cursor.sort('date', pymongo.DESCENDING)] == [8, 7, 6, 5, 4, 3, 2]
+
+    cursor = collection.find({'$and': [{'type': 'environment'}, {'date': {'$lte': start + timedelta(hours=4)}}]},
+                             batch_size=1)
+    assert [record['i'] for record in cursor.sort([('date', pymongo.ASCENDING)])] == [0, 2, 4]
+
+    _id = collection.find_one({'i': 5})['_id']
+    assert collection.find_one({'_id': _id})['i'] == 5
+    assert collection.find({'_id': {'$in': [_id, str(_id)]}}).count() == 1
+
+    collection.replace_one({'type': 'environment'}, {'type': 'moved', 'i': 0})
+    assert collection.find_one({'type': 'moved'})['i'] == 0
+    assert collection.find({'type': 'environment'}).count() == 4
+
+    assert [record['i'] for record in collection.find({'type': 'weather'}).limit(2)] == [1, 3]
+    assert len(collection.find({'i': {'$gt': 8}})) == 3
+
+
+def test_memory_backend_shared():
+    db0 = PanMongo(backend='memory')
+    db1 = PanMongo(backend='memory')
+
+    db0.insert_current('state', {'state': 'ready'}, include_collection=False)
+    assert db1.get_current('state')['data']['state'] == 'ready'
+
+    db1.current.remove({'type': 'state'})
+    assert db0.get_current('state') is None
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_export(tmpdir, compress):
+    db = PanMongo(backend='memory')
+    db.environment.remove()
+    db.weather.remove()
+
+    start = datetime(2017, 1, 1)
+    for i in range(48):
+        db.insert('environment', {'data': {'i': i}, 'date': start + timedelta(hours=i), 'type': 'environment'})
+    db.insert('weather', {'data': {'safe': True}, 'date': start + timedelta(days=3), 'type': 'weather'})
+
+    out_files = db.export(yesterday=False, start_date='2017-01-01', collections=['environment', 'weather'],
+                          backup_dir=str(tmpdir), compress=compress, num_workers=2, batch_size=10)
+
+    assert len(out_files) == 1
+    assert os.listdir(str(tmpdir)) == [os.path.basename(out_files[0])]
+
+    if compress:
+        with gzip.open(out_files[0], 'rt') as f:
+            content = f.read()
+    else:
+        with open(out_files[0]) as f:
+            content = f.read()
+
+    # Same as dumping them all at once
+    entries = list(db.environment.find({'date': {'$gt': start, '$lt': datetime(2017, 1, 1, 23, 59, 59)}}))
+    assert len(entries) == 23
+    assert content == json.dumps(entries, default=json_util.default)
+
+
+def test_ensure_indexes():
+    db = PanMongo(backend='memory')
+    db.ensure_indexes()
+
+    assert set(db.collections) <= db._indexed
+
+
+def test_partitioned_collections(tmpdir):
+    db = PanMongo(backend='memory', partition_by='month')
+    for name in db.partitions('weather'):
+        db.get_collection(name).remove()
+    db.weather.remove()
+
+    start = datetime(2017, 1, 20)
+    for day in range(0, 60, 5):
+        db.insert('weather', {'data': {'day': day}, 'date': start + timedelta(days=day), 'type': 'weather'})
+
+    db.insert_current('weather', {'safe': True})
+    assert db.get_current('weather')['data'] == {'safe': True}
+
+    assert db.partitions('weather', start=datetime(2017, 1, 1), end=datetime(2017, 2, 28)) == \
+        ['weather_2017_01', 'weather_2017_02']
+    assert db.get_collection('weather_2017_01').find().count() == 3
+    assert 'weather_2017_02' in db._indexed
+
+    # Nothing in the collection itself
+    assert db.weather.find().count() == 0
+
+    with pytest.raises(AttributeError):
+        db.get_collection('weather_latest')
+
+    out_files = db.export(yesterday=False, start_date='2017-01-25', end_date='2017-03-05',
+                          collections=['weather'], backup_dir=str(tmpdir))
+
+    with gzip.open(out_files[0], 'rt') as f:
+        days = [record['data']['day'] for record in json.loads(f.read())]
+
+    # Export excludes the start time itself, as before
+    assert days == list(range(10, 45, 5))
+
+
+def test_get_current_cache():
+    db = PanMongo(backend='memory', cache_ttl=0.5)
+    other = PanMongo(backend='memory')
+
+    other.insert_current('weather', {'safe': True}, include_collection=False)
+    assert db.get_current('weather')['data'] == {'safe': True}
+
+    # Written elsewhere so cached until the ttl runs out
+    other.insert_current('weather', {'safe': False}, include_collection=False)
+    assert db.get_current('weather')['data'] == {'safe': True}
+
+    time.sleep(0.6)
+    assert db.get_current('weather')['data'] == {'safe': False}
+
+    # Changing the cached record doesn't change the cache
+    db.get_current('weather')['data']['safe'] = True
+    assert db.get_current('weather')['data'] == {'safe': False}
+
+    # Local writes are seen straight away
+    db.insert_current('weather', {'safe': True}, include_collection=False)
+    assert db.get_current('weather')['data'] == {'safe': True}
+
+    db.current.remove({'type': 'weather'})
+    assert db.get_current('weather') is None
+
+
+def test_get_current_cache_reads_and_races():
+    db = PanMongo(backend='memory', cache_ttl=10)
+    db.insert_current('weather', {'safe': True}, include_collection=False)
+    assert db.get_current('weather')['data'] == {'safe': True}
+
+    # Reading `current` directly keeps the cache
+    assert db.current.find_one({'type': 'weather'}) is not None
+    assert 'weather' in db._cache
+
+    # A read that raced a write is not cached
+    current = db.current
+
+    class RacingCollection(object):
+        def find_one(self, *args, **kwargs):
+            record = current.find_one(*args, **kwargs)
+            current.replace_one({'type': 'weather'}, dict(record, data={'safe': False}))
+            return record
+
+    db.clear_cache()
+    original = db._collection
+    db._collection = lambda name: RacingCollection() if name == 'current' else original(name)
+    try:
+        assert db.get_current('weather')['data'] == {'safe': True}
+    finally:
+        db._collection = original
+
+    assert 'weather' not in db._cache
+    assert db.get_current('weather')['data'] == {'safe': False}
@@ -1,3 +1,5 @@
+import numpy as np
+import os
 import pytest
 import yaml
 
@@ -8,7 +10,10 @@ from astropy.time import Time
 from astroplan import Observer
 
 from pocs.scheduler.dispatch import Scheduler
+from pocs.scheduler.dispatch import _score_rows
 
+from pocs.scheduler.constraint import Altitude
+from pocs.scheduler.constraint import BaseConstraint
 from pocs.scheduler.constraint import Duration
 from pocs.scheduler.constraint import MoonAvoidance
 
@@ -112,6 +117,9 @@ def test_continue_observation(scheduler):
 
 def test_set_observation_then_reset(scheduler):
     time = Time('2016-08-13 05:00:00')
+
+    # `seq_time` comes from the clock so make sure each selection gets a new one
+    os.environ['POCSTIME'] = '2016-08-13 05:00:00'
     scheduler.get_observation(time=time)
 
     obs1 = scheduler.current_observation
@@ -120,6 +128,7 @@ def test_set_observation_then_reset(scheduler):
     # Reset priority
     scheduler.observations[obs1.name].priority = 1.0
 
+    os.environ['POCSTIME'] = '2016-08-13 05:00:01'
     scheduler.get_observation(time=time)
     obs2 = scheduler.current_observation
 
@@ -127,6 +136,7 @@ def test_set_observation_then_reset(scheduler):
 
     scheduler.observations[obs1.name].priority = 500.0
 
+    os.environ['POCSTIME'] = '2016-08-13 05:00:02'
     scheduler.get_observation(time=time)
     obs3 = scheduler.current_observation
     obs3_seq_time = obs3.seq_time
@@ -134,10 +144,13 @@ def test_set_observation_then_reset(scheduler):
     assert original_seq_time != obs3_seq_time
 
     # Now reselect same target and test that seq_time does not change
+    os.environ['POCSTIME'] = '2016-08-13 05:00:03'
     scheduler.get_observation(time=time)
     obs4 = scheduler.current_observation
     assert obs4.seq_time == obs3_seq_time
 
+    del os.environ['POCSTIME']
+
 
 def test_reset_observation(scheduler):
     time = Time('2016-08-13 05:00:00')
@@ -172,22 +185,291 @@ def test_observed_list(scheduler):
     assert len(scheduler.observed_list) == 0
 
     time = Time('2016-09-11 07:08:00')
+    os.environ['POCSTIME'] = time.isot
     scheduler.get_observation(time=time)
 
     assert len(scheduler.observed_list) == 1
 
     # A few hours later should now be different
     time = Time('2016-09-11 10:30:00')
+    os.environ['POCSTIME'] = time.isot
     scheduler.get_observation(time=time)
 
     assert len(scheduler.observed_list) == 2
 
     # A few hours later should be the same
     time = Time('2016-09-11 14:30:00')
+    os.environ['POCSTIME'] = time.isot
     scheduler.get_observation(time=time)
 
     assert len(scheduler.observed_list) == 2
 
+    del os.environ['POCSTIME']
+
     scheduler.reset_observed_list()
 
     assert len(scheduler.observed_list) == 0
+
+
+def test_create_plan(scheduler):
+    time = Time('2016-08-13 10:00:00')
+
+    plan = scheduler.create_plan(time=time)
+
+    assert len(plan) > 0
+    assert plan[0].name == scheduler.rank_observations(time)[0][0]
+    assert plan[0].start == time
+
+    end_of_night = scheduler.ephemeris.end_of_night(time)
+    for block, next_block in zip(plan[:-1], plan[1:]):
+        assert block.start < block.end <= next_block.start
+        assert block.start < end_of_night
+
+
+def test_get_observation_from_plan(scheduler):
+    scheduler.use_plan = True
+
+    time = Time('2016-08-13 10:00:00')
+    assert scheduler.needs_plan(time)
+    scheduler.create_plan(time=time)
+    assert not scheduler.needs_plan(time)
+
+    best = scheduler.get_observation(time=time)
+
+    assert best[0] == scheduler.plan[0].name
+    assert scheduler.current_observation.name == best[0]
+
+    # Later in the night the earlier blocks are dropped
+    later = scheduler.plan[-1].start
+    best = scheduler.get_observation(time=later)
+
+    assert len(scheduler.plan) == 1
+    assert best[0] == scheduler.plan[0].name
+
+    scheduler.clear_plan()
+    assert scheduler.plan is None
+
+
+def test_get_observation_does_not_plan(scheduler):
+    scheduler.use_plan = True
+
+    time = Time('2016-08-13 10:00:00')
+    best = scheduler.get_observation(time=time)
+
+    assert scheduler.plan is None
+    assert best[0] == scheduler.rank_observations(time)[0][0]
+
+
+def test_needs_plan(scheduler):
+    time = Time('2016-08-13 10:00:00')
+    assert not scheduler.needs_plan(time)
+
+    scheduler.use_plan = True
+    scheduler.create_plan(time=time)
+
+    # Used up
+    later = scheduler.plan[-1].end
+    scheduler.get_planned_observation(later)
+    assert scheduler.plan == []
+    assert scheduler.needs_plan(later)
+
+    # Plan for a different night
+    scheduler.create_plan(time=time)
+    assert scheduler.needs_plan(Time('2016-08-14 10:00:00'))
+
+
+def test_create_plan_leaves_cache_and_stats(scheduler):
+    time = Time('2016-08-13 10:00:00')
+    scheduler.rank_observations(time)
+
+    cache = scheduler._score_cache
+    stats = {constraint: dict(stats) for constraint, stats in scheduler._constraint_stats.items()}
+
+    scheduler.create_plan(time=time)
+
+    assert scheduler._score_cache is cache
+    assert cache['time'] == time
+    assert scheduler._constraint_stats == stats
+
+
+def test_get_observation_from_plan_show_all(scheduler):
+    scheduler.use_plan = True
+
+    time = Time('2016-08-13 10:00:00')
+    scheduler.create_plan(time=time)
+    best = scheduler.get_observation(time=time, show_all=True)
+
+    assert best[0][0] == scheduler.plan[0].name
+    assert sorted([name for name, merit in best]) == \
+        sorted([name for name, merit in scheduler.rank_observations(time)])
+
+    merits = [merit for name, merit in best[1:]]
+    assert merits == sorted(merits, reverse=True)
+
+
+def test_plan_cleared_with_new_fields(scheduler):
+    scheduler.create_plan(time=Time('2016-08-13 10:00:00'))
+    assert scheduler.plan is not None
+
+    scheduler.remove_observation('HD 189733')
+    assert scheduler.plan is None
+
+
+def test_field_index(scheduler):
+    assert scheduler.field_index.names == list(scheduler.observations.keys())
+
+    scheduler.remove_observation('HD 189733')
+    assert 'HD 189733' not in scheduler.field_index.names
+
+
+def test_observations_near(scheduler):
+    position = scheduler.observations['HD 189733'].field.coord
+
+    # KIC 8462852 is ~22 degrees away
+    assert scheduler.observations_near(position, 1 * u.degree) == ['HD 189733']
+    assert 'KIC 8462852' in scheduler.observations_near(position, 25 * u.degree)
+
+
+def test_constraint_order(scheduler):
+    moon_avoidance, duration = scheduler.constraints
+
+    # Unmeasured constraints keep the given order
+    assert scheduler.constraint_order == [moon_avoidance, duration]
+
+    # Cheap with many vetoes beats expensive with few
+    scheduler.update_constraint_stats(moon_avoidance, 1.0, 100, 10)
+    scheduler.update_constraint_stats(duration, 0.1, 100, 50)
+    assert scheduler.constraint_order == [duration, moon_avoidance]
+
+    status = scheduler.status()
+    assert [c['constraint'] for c in status['constraint_order']] == [str(duration), str(moon_avoidance)]
+    assert status['constraint_order'][0]['veto_rate'] == pytest.approx(0.5)
+
+
+def test_constraint_order_measured(scheduler):
+    time = Time('2016-08-13 10:00:00')
+
+    best = scheduler.get_observation(time=time, show_all=True)
+
+    for c in scheduler.status()['constraint_order']:
+        assert c['cost'] is not None
+
+    # Reordering doesn't change the result
+    ranked = scheduler.rank_observations(time)
+    assert [name for name, merit in ranked] == [name for name, merit in best]
+    assert [merit for name, merit in ranked] == pytest.approx([merit for name, merit in best])
+
+
+class ScalarAltitude(BaseConstraint):
+    """ Only implements `get_score`, like a custom constraint would """
+
+    def get_score(self, time, observer, observation, **kwargs):
+        return Altitude(30 * u.degree).get_score(time, observer, observation)
+
+
+def test_worker_pool(observer, field_list):
+    time = Time('2016-08-13 10:00:00')
+
+    constraints = [ScalarAltitude(), MoonAvoidance()]
+
+    scheduler = Scheduler(observer, fields_list=field_list, constraints=constraints)
+    expected = scheduler.rank_observations(time)
+
+    pool_scheduler = Scheduler(observer, fields_list=field_list, constraints=constraints, num_workers=2)
+    pool_scheduler.parallel_threshold = 1
+
+    try:
+        assert pool_scheduler.rank_observations(time) == expected
+
+        pool = pool_scheduler._pool
+        assert pool is not None
+
+        # Pool is restarted when the observations change
+        pool_scheduler.remove_observation('HD 189733')
+        assert pool_scheduler.rank_observations(time) == [obs for obs in expected if obs[0] != 'HD 189733']
+        assert pool_scheduler._pool is not pool
+    finally:
+        pool_scheduler.close_pool()
+
+
+class ScalarExposures(BaseConstraint):
+    """ Vetoes observations that have taken exposures """
+
+    def get_score(self, time, observer, observation, **kwargs):
+        return observation.current_exp > 0, self._score
+
+
+def test_worker_pool_exposures(observer, field_list):
+    time = Time('2016-08-13 10:00:00')
+
+    scheduler = Scheduler(observer, fields_list=field_list, constraints=[ScalarExposures()], num_workers=2)
+    scheduler.parallel_threshold = 1
+
+    try:
+        assert 'HD 189733' in [name for name, merit in scheduler.rank_observations(time)]
+
+        scheduler.observations['HD 189733'].current_exp = 1
+        assert 'HD 189733' not in [name for name, merit in scheduler.rank_observations(time)]
+    finally:
+        scheduler.close_pool()
+
+
+def test_score_rows_setup(observer, field_list):
+    time = Time('2016-08-13 10:00:00')
+
+    scheduler = Scheduler(observer, fields_list=field_list)
+    setup = ('token', observer, scheduler.observations.to_arrays())
+    idx = np.arange(len(scheduler.observations))
+
+    # A worker that hasn't been set up asks for the setup
+    assert _score_rows('other', None, ScalarAltitude(), time, idx, {}, {}) is None
+
+    veto, score = _score_rows('token', setup, ScalarAltitude(), time, idx, {}, {})
+    assert len(veto) == len(idx)
+
+    # After which the token is enough
+    veto, score = _score_rows('token', None, ScalarAltitude(), time, idx, {}, {})
+    assert len(veto) == len(idx)
+
+
+def test_incremental_rescoring(observer, field_list):
+    time = Time('2016-08-13 10:00:00')
+
+    scheduler = Scheduler(observer, fields_list=field_list, constraints=constraints)
+    fresh_scheduler = Scheduler(observer, fields_list=field_list, constraints=constraints, rescore_tolerance=None)
+
+    scheduler.rank_observations(time)
+    cache = scheduler._score_cache
+
+    for minutes in [1, 5, 10]:
+        later = time + minutes * u.minute
+
+        ranked = dict(scheduler.rank_observations(later))
+        expected = dict(fresh_scheduler.rank_observations(later))
+
+        # Same vetoes and each constraint score within the tolerance
+        assert ranked.keys() == expected.keys()
+        for name, merit in expected.items():
+            assert abs(ranked[name] - merit) <= len(constraints) * scheduler.rescore_tolerance
+
+    assert scheduler._score_cache is cache
+    assert fresh_scheduler._score_cache is None
+
+    # Going back in time starts again
+    scheduler.rank_observations(time)
+    assert scheduler._score_cache is not cache
+
+
+def test_incremental_rescoring_new_exposures(observer, field_list):
+    time = Time('2016-08-13 10:00:00')
+
+    scheduler = Scheduler(observer, fields_list=field_list, constraints=constraints)
+
+    scheduler.get_observation(time=time)
+    scheduler._get_score_cache(time, scheduler.ephemeris.end_of_night(time))
+
+    scheduler.current_observation.current_exp += 1
+    cache = scheduler._get_score_cache(time, scheduler.ephemeris.end_of_night(time))
+
+    changed = scheduler.field_index.index_of([scheduler.current_observation.name])
+    assert list(np.flatnonzero(cache['changed'])) == list(changed)
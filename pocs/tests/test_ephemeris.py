@@ -0,0 +1,80 @@
+import pytest
+
+from astroplan import Observer
+from astropy import units as u
+from astropy.coordinates import EarthLocation
+from astropy.coordinates import SkyCoord
+from astropy.coordinates import get_moon
+from astropy.time import Time
+
+from pocs.scheduler.ephemeris import NightlyEphemeris
+
+
+@pytest.fixture
+def observer(config):
+    loc = config['location']
+    location = EarthLocation(lon=loc['longitude'], lat=loc['latitude'], height=loc['elevation'])
+    return Observer(location=location, name="Test Observer", timezone=loc['timezone'])
+
+
+@pytest.fixture
+def ephemeris(observer):
+    return NightlyEphemeris(observer)
+
+
+@pytest.fixture
+def coords():
+    return SkyCoord(['20h00m43.7135s +22d42m39.0645s', '02h26m51.0582s +37d33m01.733s'])
+
+
+def test_end_of_night(ephemeris, observer):
+    for t in ['2016-08-13 05:00:00', '2016-08-13 10:00:00', '2016-08-13 20:00:00']:
+        time = Time(t)
+        end_of_night = observer.tonight(time=time, horizon=-18 * u.degree)[-1]
+
+        assert abs((ephemeris.end_of_night(time) - end_of_night).sec) < 1
+
+
+def test_night_is_cached(ephemeris):
+    night = ephemeris.get_night(Time('2016-08-13 08:00:00'))
+
+    assert ephemeris.get_night(Time('2016-08-13 12:00:00')) is night
+    assert ephemeris.get_night(Time('2016-08-13 20:00:00')) is not night
+
+
+def test_moon(ephemeris, observer):
+    time = Time('2016-08-13 10:02:00')
+
+    moon = get_moon(time, observer.location)
+    cached_moon = ephemeris.moon(time)
+
+    assert abs(cached_moon.ra - moon.ra) < 0.1 * u.degree
+    assert abs(cached_moon.dec - moon.dec) < 0.1 * u.degree
+
+
+def test_field_times(ephemeris, observer, coords):
+    names = ['HD 189733', 'Wasp 33']
+
+    for t in ['2016-08-13 10:00:00', '2016-08-13 13:30:00']:
+        time = Time(t)
+        rise, set_time, transit = ephemeris.get_field_times(time, names, coords, horizon=30 * u.degree)
+
+        expected_set = observer.target_set_time(time, coords, which='next', horizon=30 * u.degree)
+        expected_transit = observer.target_meridian_transit_time(time, coords, which='next')
+
+        assert all(abs(set_time - expected_set.jd) * 86400 < 180)
+        assert all(abs(transit - expected_transit.jd) * 86400 < 180)
+        assert all(rise > time.jd)
+
+
+def test_field_times_cached(ephemeris, coords):
+    names = ['HD 189733', 'Wasp 33']
+    time = Time('2016-08-13 10:00:00')
+
+    ephemeris.get_field_times(time, names, coords)
+    night = ephemeris.get_night(time)
+
+    assert len(ephemeris._field_times[(night['key'], 0.0)]) == 2
+
+    ephemeris.get_field_times(time + 1 * u.hour, names, coords)
+    assert len(ephemeris._field_times[(night['key'], 0.0)]) == 2
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+from pocs.scheduler.field_index import FieldIndex
+
+
+@pytest.fixture
+def coords():
+    rng = np.random.RandomState(42)
+    ra = rng.uniform(0, 360, 500) * u.degree
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, 500))) * u.degree
+
+    return SkyCoord(ra=ra, dec=dec, frame='icrs')
+
+
+@pytest.fixture
+def field_index(coords):
+    return FieldIndex(['Field {}'.format(i) for i in range(len(coords))], coords)
+
+
+def test_bad_names(coords):
+    with pytest.raises(AssertionError):
+        FieldIndex(['Field 1'], coords)
+
+
+def test_len(field_index, coords):
+    assert len(field_index) == len(coords)
+
+
+def test_index_of(field_index):
+    assert list(field_index.index_of(['Field 10', 'Field 3'])) == [10, 3]
+
+
+def test_separation(field_index, coords):
+    center = SkyCoord('20h00m43.7135s +22d42m39.0645s')
+
+    assert np.allclose(field_index.separation(center), coords.separation(center).degree)
+    assert np.allclose(field_index.separation(center, [5, 1]), coords[[5, 1]].separation(center).degree)
+
+
+@pytest.mark.parametrize('radius', [1 * u.degree, 15 * u.degree, 90 * u.degree, 180 * u.degree])
+def test_query_cone(field_index, coords, radius):
+    center = SkyCoord('02h26m51.0582s +37d33m01.733s')
+
+    expected = np.flatnonzero(coords.separation(center) <= radius)
+
+    assert list(field_index.query_cone(center, radius)) == list(expected)
+
+
+def test_query_cone_names(field_index):
+    center = field_index.coords[7]
+
+    assert 'Field 7' in field_index.query_cone_names(center, 0.1 * u.degree)
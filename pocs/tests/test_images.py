@@ -1,8 +1,15 @@
 import os
 import pytest
+import shutil
+import threading
 
 from pocs.images import Image
+from pocs.images import ImagePipeline
+from pocs.images import OffsetEngine
+from pocs.images import compute_offset_rotation
+from pocs.images import get_image_pipeline
 from pocs.images import PointingError
+from pocs.utils import images as img_utils
 from pocs.utils.error import SolveError
 from pocs.utils.error import Timeout
 
@@ -44,6 +51,24 @@ def test_fits_noheader(noheader_fits_file):
         Image(noheader_fits_file)
 
 
+def test_fits_compressed(solved_fits_file, tmpdir):
+    fits_file = str(tmpdir.join('solved.fits'))
+    shutil.copy(solved_fits_file, fits_file)
+
+    fz_file = img_utils.fpack(fits_file)
+    im0 = Image(fz_file)
+
+    # Read without uncompressing to disk
+    assert im0.fits_file == fz_file
+    assert os.path.exists(fits_file) is False
+
+    im1 = Image(solved_fits_file)
+    assert (im0.data == im1.data).all()
+    assert im0.header['DATE-OBS'] == im1.header['DATE-OBS']
+    assert im0.wcs is not None
+    assert im0.pointing == im1.pointing
+
+
 def test_solve_timeout(tiny_fits_file):
     im0 = Image(tiny_fits_file)
 
@@ -163,3 +188,129 @@ def test_compute_offset_string(solved_fits_file, unsolved_fits_file):
 
     assert offset_info['offsetX'] - 3.9686712667745043 < 1e-5
     assert offset_info['offsetY'] - 17.585827075244445 < 1e-5
+
+
+def test_offset_engine(solved_fits_file, unsolved_fits_file):
+    img0 = Image(solved_fits_file)
+    img1 = Image(unsolved_fits_file)
+
+    engine = OffsetEngine(img0)
+    assert engine.fits_file == solved_fits_file
+
+    expected = compute_offset_rotation(img0.luminance, img1.luminance)
+
+    # Reference transforms are reused, so repeat to check they aren't modified
+    for _ in range(2):
+        offset = engine.compute_offset_rotation(img1.luminance)
+        for key in ['X', 'Y', 'angle']:
+            assert offset[key] == expected[key]
+
+
+def test_offset_engine_filename(solved_fits_file, unsolved_fits_file):
+    engine = OffsetEngine(unsolved_fits_file, corners=False)
+    assert list(engine.regions.keys()) == ['center']
+
+    offset = engine.compute_offset_rotation(Image(unsolved_fits_file).luminance)
+    assert offset['X'].value == 0
+    assert offset['Y'].value == 0
+
+    with pytest.raises(AssertionError):
+        engine.compute_offset_rotation(engine.image.luminance[1:])
+
+
+def test_pipeline_stages():
+    pipeline = ImagePipeline(num_workers=1)
+
+    def convert(info):
+        info['file_path'] = info['file_path'].replace('.cr2', '.fits')
+
+    def index(info):
+        info['indexed'] = info['file_path']
+
+    info = {'image_id': 'foo', 'file_path': '/tmp/foo.cr2'}
+    assert pipeline.submit(info, [('convert', convert), ('index', index)]).wait(timeout=10)
+
+    assert info['indexed'] == '/tmp/foo.fits'
+    assert pipeline.is_idle
+
+    status = pipeline.status()
+    assert status['done'] == 1
+    assert status['stages']['convert']['count'] == 1
+    assert status['stages']['index']['errors'] == 0
+
+    pipeline.shutdown()
+
+
+def test_pipeline_stage_error():
+    pipeline = ImagePipeline(num_workers=1)
+
+    def convert(info):
+        raise ValueError('Bad image')
+
+    def index(info):
+        info['indexed'] = True
+
+    info = {'image_id': 'foo'}
+    assert pipeline.submit(info, [('convert', convert), ('index', index)]).wait(timeout=10)
+
+    assert 'indexed' not in info
+    assert pipeline.status()['stages']['convert']['errors'] == 1
+
+    pipeline.shutdown()
+
+
+def test_pipeline_backpressure():
+    pipeline = ImagePipeline(num_workers=1, max_queue_size=1)
+
+    release = threading.Event()
+    stages = [('convert', lambda info: release.wait(timeout=10))]
+
+    running = pipeline.submit({'image_id': 'running'}, stages)
+    assert pipeline.join(timeout=0.1) is False
+
+    queued = pipeline.submit({'image_id': 'queued'}, stages)
+    assert pipeline.queue_depth == 1
+
+    # No room for a third until the first is done
+    with pytest.raises(Timeout):
+        pipeline.submit({'image_id': 'blocked'}, stages, timeout=0.5)
+
+    release.set()
+    assert running.wait(timeout=10)
+    assert queued.wait(timeout=10)
+    assert pipeline.join(timeout=10)
+    assert pipeline.status()['done'] == 2
+
+    pipeline.shutdown()
+
+
+def test_pipeline_done_event():
+    pipeline = ImagePipeline(num_workers=1)
+
+    done = threading.Event()
+    assert pipeline.submit({'image_id': 'foo'}, [('index', lambda info: None)], done=done) is done
+    assert done.wait(timeout=10)
+
+    pipeline.shutdown()
+
+    # Nothing is left queued if the job can't be submitted
+    with pytest.raises(RuntimeError):
+        pipeline.submit({'image_id': 'bar'}, [('index', lambda info: None)])
+    assert pipeline.queue_depth == 0
+
+
+def test_shared_pipeline():
+    assert get_image_pipeline() is get_image_pipeline()
+
+
+def test_shared_pipeline_shutdown():
+    pipeline = get_image_pipeline()
+    assert get_image_pipeline(create=False) is pipeline
+
+    pipeline.shutdown()
+    assert pipeline.is_shutdown
+    assert get_image_pipeline(create=False) is None
+
+    new_pipeline = get_image_pipeline()
+    assert new_pipeline is not pipeline
+    assert new_pipeline.is_shutdown is False
@@ -1,10 +1,16 @@
+import numpy as np
 import pytest
 import time
+import zmq
 
+from astropy import units as u
+from astropy.time import Time
+from bson import ObjectId
 from datetime import datetime
 from multiprocessing import Process
 from pocs.utils.database import PanMongo
 from pocs.utils.messaging import PanMessaging
+from pocs.utils.messaging import get_codec
 
 
 @pytest.fixture(scope='function')
@@ -78,3 +84,98 @@ def test_mongo_objectid(forwarder, sub, pub, config):
     assert isinstance(msg_obj['_id'], str)
 
     db.current.remove({'type': 'config'})
+
+
+@pytest.mark.parametrize('codec', ['json', 'msgpack'])
+def test_codec_arrays(codec):
+    if codec == 'msgpack':
+        pytest.importorskip('msgpack')
+
+    codec = get_codec(codec)
+
+    stars = np.zeros(3, dtype=[('x', '<f8'), ('y', '<f8'), ('flux', '<i4')])
+    stars['flux'] = [1, 2, 3]
+
+    payload, buffers = codec.encode({
+        'thumbnail': np.arange(12, dtype=np.uint16).reshape(3, 4),
+        'stars': stars,
+        'nested': {'value': np.float32(1.5), 'date': datetime(2017, 1, 1)},
+    })
+
+    # Arrays go in their own buffers, not the payload
+    assert len(buffers) == 2
+    assert len(payload) < 300
+
+    message = codec.decode(payload, [memoryview(buf) for buf in buffers])
+
+    assert message['thumbnail'].dtype == np.uint16
+    assert np.array_equal(message['thumbnail'], np.arange(12).reshape(3, 4))
+    assert np.array_equal(message['stars']['flux'], [1, 2, 3])
+    assert message['nested']['value'] == 1.5
+    assert message['nested']['date'] == '2017-01-01T00:00:00'
+
+
+def test_codecs_match():
+    pytest.importorskip('msgpack')
+
+    def status():
+        return {
+            'state': 'observing',
+            'observatory': {
+                'mount': {'current_ha': 1.23456 * u.hourangle, 'tracking': True},
+                'observer': {
+                    'local_sun_set_time': Time('2017-01-01 04:55:00.987'),
+                    'utctime': Time('2017-01-01 13:00:00.123'),
+                    'siderealtime': '0h39m24.15s',
+                },
+                'observation': {'exp_time': 120 * u.second, 'merit': 1.23456, 'current_exp': 3,
+                                'seq_time': datetime(2017, 1, 1, 13, 0, 0)},
+            },
+            'image_id': ObjectId('5a0a0a0a0a0a0a0a0a0a0a0a'),
+            'thumbnail': np.arange(4, dtype=np.uint16),
+        }
+
+    messages = list()
+    for name in ['json', 'msgpack']:
+        codec = get_codec(name)
+        payload, buffers = codec.encode(status())
+        messages.append(codec.decode(payload, [memoryview(buf) for buf in buffers]))
+
+    json_message, msgpack_message = messages
+
+    assert np.array_equal(json_message.pop('thumbnail'), msgpack_message.pop('thumbnail'))
+    assert json_message == msgpack_message
+    assert json_message['observatory']['observation']['merit'] == 1.235
+
+
+def test_send_array(forwarder, sub, pub):
+    thumbnail = np.random.randint(0, 2 ** 16, size=(64, 64)).astype(np.uint16)
+
+    pub.send_message('TEST-CHANNEL', {'thumbnail': thumbnail})
+    msg_type, msg_obj = sub.receive_message()
+
+    assert msg_type == 'TEST-CHANNEL'
+    assert np.array_equal(msg_obj['thumbnail'], thumbnail)
+
+
+def test_send_msgpack(forwarder, sub):
+    pytest.importorskip('msgpack')
+
+    pub = PanMessaging('publisher', 12345, codec='msgpack')
+    time.sleep(2)  # Wait for publisher to start up
+
+    pub.send_message('TEST-CHANNEL', {'date': datetime(2017, 1, 1), 'value': 1.23456})
+    msg_type, msg_obj = sub.receive_message()
+    pub.publisher.close()
+
+    assert msg_type == 'TEST-CHANNEL'
+    assert msg_obj == {'date': '2017-01-01T00:00:00', 'value': 1.235}
+
+
+def test_receive_single_frame(forwarder, sub, pub):
+    # As sent before messages were split into frames
+    pub.publisher.send_string('TEST-CHANNEL {"message": "Hello"}', flags=zmq.NOBLOCK)
+    msg_type, msg_obj = sub.receive_message()
+
+    assert msg_type == 'TEST-CHANNEL'
+    assert msg_obj == {'message': 'Hello'}
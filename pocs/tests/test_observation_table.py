@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from astropy import units as u
+
+from pocs.scheduler.observation import Observation
+from pocs.scheduler.observation_table import ObservationTable
+
+
+@pytest.fixture
+def field_list():
+    return [
+        {'name': 'HD 189733', 'position': '20h00m43.7135s +22d42m39.0645s', 'priority': 100},
+        {'name': 'Tres 3', 'position': '17h52m07.02s +37d32m46.2012s', 'exp_set_size': 15, 'min_nexp': 240},
+        {'name': 'KIC 8462852', 'position': '20h06m15.4536s +44d27m24.75s', 'exp_time': 60,
+         'exp_set_size': 15, 'min_nexp': 45, 'priority': 50},
+    ]
+
+
+@pytest.fixture
+def table(field_list):
+    table = ObservationTable()
+    table.extend(field_list)
+    return table
+
+
+def test_extend(table, field_list):
+    assert len(table) == len(field_list)
+    assert table.names == [f['name'] for f in field_list]
+    assert list(table.keys()) == table.names
+    assert 'Tres 3' in table
+
+
+def test_extend_skips_invalid(table):
+    added = table.extend([
+        {'name': 'Bad Exp Time', 'position': '12h30m01s +08d08m08s', 'exp_time': -10},
+        {'name': 'Bad Set Size', 'position': '12h30m01s +08d08m08s', 'min_nexp': 7},
+        {'name': 'Bad Position', 'position': 'foobar'},
+        {'name': 'Good Field', 'position': '12h30m01s +08d08m08s'},
+    ])
+
+    assert added == 1
+    assert table.names[-1] == 'Good Field'
+    assert table.coords[-1].separation(table['Good Field'].field.coord) < 1 * u.arcsec
+
+
+def test_extend_duplicate(table):
+    with pytest.raises(AssertionError):
+        table.extend([{'name': 'Tres 3', 'position': '17h52m07.02s +37d32m46.2012s'}])
+
+
+def test_observation(table):
+    obs = table['KIC 8462852']
+
+    assert isinstance(obs, Observation)
+    assert obs is table['KIC 8462852']
+    assert obs.exp_time == 60 * u.second
+    assert obs.min_nexp == 45
+    assert obs.exp_set_size == 15
+    assert obs.priority == 50
+
+    with pytest.raises(KeyError):
+        table['Not A Field']
+
+
+def test_columns(table):
+    assert list(table.column('priority')) == [100, 100, 50]
+    assert list(table.minimum_duration()) == [120 * 60, 120 * 240, 60 * 45]
+
+    # Changes to created observations show up in the columns
+    table['Tres 3'].priority = 500
+    assert list(table.column('priority', [1, 2])) == [500, 50]
+
+
+def test_remove(table):
+    obs = table['KIC 8462852']
+    table.remove('Tres 3')
+
+    assert table.names == ['HD 189733', 'KIC 8462852']
+    assert table['KIC 8462852'] is obs
+    assert list(table.column('priority')) == [100, 50]
+
+    with pytest.raises(KeyError):
+        table.remove('Tres 3')
+
+
+def test_rows(table):
+    rows = table.rows(np.array([2, 0]))
+
+    assert len(rows) == 2
+    assert rows.names == ['KIC 8462852', 'HD 189733']
+    assert list(rows.priority) == [50, 100]
+    assert rows[0] is table['KIC 8462852']
+    assert rows.coords[1] == table.coords[0]
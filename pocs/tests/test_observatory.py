@@ -4,6 +4,7 @@ import pytest
 from astropy import units as u
 from astropy.time import Time
 
+from pocs.images import get_image_pipeline
 from pocs.observatory import Observatory
 from pocs.scheduler.dispatch import Scheduler
 from pocs.scheduler.observation import Observation
@@ -226,3 +227,41 @@ def test_observe(observatory):
 
     observatory.cleanup_observations()
     assert len(observatory.scheduler.observed_list) == 0
+
+
+def test_power_down_closes_scheduler_pool(observatory):
+    observatory.scheduler.num_workers = 2
+    assert observatory.scheduler._get_pool() is not None
+
+    observatory.power_down()
+    assert observatory.scheduler._pool is None
+
+
+def test_offset_engine_reset(observatory):
+    observatory._offset_engine = object()
+    observatory.current_observation = None
+    assert observatory._offset_engine is None
+
+    os.environ['POCSTIME'] = '2016-08-13 10:00:00'
+    observatory.get_observation()
+    observatory._offset_engine = object()
+    observatory.get_observation()
+    assert observatory._offset_engine is not None
+
+    observatory.current_observation = None
+    observatory._offset_engine = object()
+    observatory.get_observation()
+    assert observatory._offset_engine is None
+
+    observatory._offset_engine = object()
+    observatory.power_down()
+    assert observatory._offset_engine is None
+
+
+def test_power_down_shuts_down_pipeline(observatory):
+    pipeline = get_image_pipeline()
+    assert 'image_pipeline' in observatory.status()
+
+    observatory.power_down()
+    assert pipeline.is_shutdown
+    assert 'image_pipeline' not in observatory.status()
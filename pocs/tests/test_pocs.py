@@ -3,6 +3,8 @@ import pytest
 import time
 
 from multiprocessing import Process
+from multiprocessing import Queue
+from threading import Timer
 
 from astropy import units as u
 
@@ -231,6 +233,48 @@ def test_unsafe_park(pocs):
     assert pocs.state == 'sleeping'
 
 
+def test_sleep_interrupted_by_command(pocs):
+    pocs.has_messaging = True
+    pocs._cmd_queue = Queue()
+    pocs._sched_queue = Queue()
+
+    Timer(1.0, pocs._cmd_queue.put, args=({'message': 'park'},)).start()
+
+    t0 = time.time()
+    pocs.sleep(delay=30, with_status=False)
+    assert time.time() - t0 < 10
+    assert pocs.interrupted is True
+
+
+def test_sleep_after_interrupt(pocs):
+    pocs.has_messaging = True
+    pocs._cmd_queue = Queue()
+    pocs._sched_queue = Queue()
+
+    pocs._cmd_queue.put({'message': 'park'})
+    pocs.sleep(delay=30, with_status=False)
+    assert pocs.interrupted is True
+
+    # Later sleeps still wait
+    for _ in range(2):
+        t0 = time.time()
+        pocs.sleep(delay=1, with_status=False)
+        assert time.time() - t0 >= 1
+
+
+def test_sleep_ignores_unknown_command(pocs):
+    pocs.has_messaging = True
+    pocs._cmd_queue = Queue()
+    pocs._sched_queue = Queue()
+
+    pocs._cmd_queue.put({'message': 'foobar'})
+
+    t0 = time.time()
+    pocs.sleep(delay=2, with_status=False)
+    assert time.time() - t0 >= 2
+    assert pocs.interrupted is False
+
+
 def test_power_down_while_running(pocs):
     assert pocs.connected is True
     pocs.initialize()
@@ -0,0 +1,80 @@
+import os
+import pytest
+
+from astroplan import Observer
+from astropy import units as u
+from astropy.coordinates import EarthLocation
+from astropy.time import Time
+
+from pocs.scheduler.constraint import Duration
+from pocs.scheduler.constraint import MoonAvoidance
+from pocs.scheduler.dispatch import Scheduler
+from pocs.scheduler.simulator import SchedulerSimulator
+from pocs.utils import flatten_time
+
+
+@pytest.fixture
+def observer(config):
+    loc = config['location']
+    location = EarthLocation(lon=loc['longitude'], lat=loc['latitude'], height=loc['elevation'])
+    return Observer(location=location, name="Test Observer", timezone=loc['timezone'])
+
+
+@pytest.fixture
+def simulator(observer, config):
+    fields_file = config['directories']['targets'] + '/simple.yaml'
+    scheduler = Scheduler(observer, fields_file=fields_file, constraints=[MoonAvoidance(), Duration(30 * u.deg)])
+
+    return SchedulerSimulator(scheduler)
+
+
+def test_run(simulator):
+    start_time = Time('2016-08-13 10:00:00')
+    end_time = Time('2016-08-13 13:00:00')
+
+    timeline = simulator.run(start_time=start_time, end_time=end_time)
+
+    assert timeline[0].start == start_time
+    assert timeline[-1].end == end_time
+
+    for block, next_block in zip(timeline[:-1], timeline[1:]):
+        assert block.end == next_block.start
+        assert block.name != next_block.name
+
+    observed = [block for block in timeline if block.name is not None]
+    assert len(observed) > 0
+    assert all(block.num_exposures > 0 for block in observed)
+
+
+def test_run_restores_clock(simulator):
+    os.environ['POCSTIME'] = '2016-08-13 10:00:00'
+    simulator.run(end_time=Time('2016-08-13 11:00:00'))
+
+    assert os.environ['POCSTIME'] == '2016-08-13 10:00:00'
+    del os.environ['POCSTIME']
+
+
+def test_run_empty(simulator):
+    time = Time('2016-08-13 10:00:00')
+
+    assert simulator.run(start_time=time, end_time=time) == []
+    assert 'POCSTIME' not in os.environ
+
+
+def test_seq_time_follows_clock(simulator):
+    timeline = simulator.run(start_time=Time('2016-08-13 10:00:00'), end_time=Time('2016-08-13 13:00:00'))
+
+    first_observed = [block for block in timeline if block.name is not None][0]
+
+    seq_time = list(simulator.scheduler.observed_list.keys())[0]
+    assert seq_time == flatten_time(first_observed.start)
+
+
+def test_summary(simulator):
+    timeline = simulator.run(start_time=Time('2016-08-13 10:00:00'), end_time=Time('2016-08-13 13:00:00'))
+    summary = simulator.summary()
+
+    assert 'idle' in summary
+
+    num_exposures = sum(block.num_exposures for block in timeline)
+    assert sum(info['exposures'] for name, info in summary.items() if name != 'idle') == num_exposures
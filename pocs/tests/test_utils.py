@@ -1,7 +1,9 @@
 import numpy as np
 import os
 import pytest
+import shutil
 
+from astropy.io import fits
 from datetime import datetime as dt
 
 from pocs.utils import current_time
@@ -42,6 +44,79 @@ def test_crop_data():
     assert cropped02.sum() == 100.
 
 
+def test_parse_pgm():
+    data = (np.arange(12).reshape(3, 4) * 1000).astype('>u2')
+    buffer = b'P5\n4 3\n65535\n' + data.tobytes()
+
+    pgm = images.parse_pgm(buffer)
+    assert pgm.shape == (3, 4)
+    assert (pgm == np.flipud(data)).all()
+
+
+def test_read_pgm(tmpdir):
+    data = (np.arange(12).reshape(3, 4) * 1000).astype('>u2')
+    pgm_fname = str(tmpdir.join('test.pgm'))
+    with open(pgm_fname, 'wb') as f:
+        f.write(b'P5\n4 3\n65535\n' + data.tobytes())
+
+    pgm = images.read_pgm(pgm_fname, remove_after=True)
+    assert (pgm == np.flipud(data)).all()
+    assert os.path.exists(pgm_fname) is False
+
+
+def test_parse_not_pgm():
+    with pytest.raises(AssertionError):
+        images.parse_pgm(b'P6\n4 3\n65535\n' + bytes(72))
+
+
+has_exiftool = pytest.mark.skipif(shutil.which('exiftool') is None, reason="exiftool not installed")
+
+
+@has_exiftool
+def test_exif_reader(solved_fits_file):
+    with images.ExifReader() as reader:
+        exif = reader.read(solved_fits_file)
+        assert exif['SourceFile'] == solved_fits_file
+
+        # Same process for later requests
+        pid = reader._process.pid
+        assert reader.read(solved_fits_file) == exif
+        assert reader._process.pid == pid
+
+    assert reader.is_running is False
+
+
+@has_exiftool
+def test_exif_reader_many(solved_fits_file, tmpdir):
+    bad_file = str(tmpdir.join('not_an_image.txt'))
+    with open(bad_file, 'w') as f:
+        f.write('Hello')
+
+    fnames = [solved_fits_file, bad_file] * 3
+    with images.ExifReader(batch_size=4) as reader:
+        exif = reader.read_many(fnames)
+
+    assert len(exif) == len(fnames)
+    assert [e.get('SourceFile') for e in exif[::2]] == [solved_fits_file] * 3
+
+
+@has_exiftool
+def test_exif_reader_discard(solved_fits_file):
+    with images.ExifReader() as reader:
+        first_id = reader.submit(solved_fits_file)
+        second_id = reader.submit(solved_fits_file)
+        reader.discard(first_id)
+
+        assert reader.collect(second_id)[0]['SourceFile'] == solved_fits_file
+        assert len(reader._results) == 0
+        assert len(reader._discarded) == 0
+
+        # Already read
+        reader.discard(reader.submit(solved_fits_file))
+        reader.collect(reader.submit(solved_fits_file))
+        assert len(reader._results) == 0
+
+
 def test_wcsinfo(solved_fits_file):
     wcsinfo = images.get_wcsinfo(solved_fits_file)
 
@@ -49,11 +124,14 @@ def test_wcsinfo(solved_fits_file):
     assert wcsinfo['ra_center'].value == 303.206422334
 
 
-def test_fpack(solved_fits_file):
-    info = os.stat(solved_fits_file)
+def test_fpack(solved_fits_file, tmpdir):
+    fits_file = str(tmpdir.join('solved.fits'))
+    shutil.copy(solved_fits_file, fits_file)
+
+    info = os.stat(fits_file)
     assert info.st_size > 0.
 
-    compressed = images.fpack(solved_fits_file, verbose=True)
+    compressed = images.fpack(fits_file, verbose=True)
 
     assert os.stat(compressed).st_size < info.st_size
 
@@ -61,6 +139,20 @@ def test_fpack(solved_fits_file):
     assert os.stat(uncompressed).st_size == info.st_size
 
 
+def test_write_fits_compressed(tmpdir):
+    data = (np.arange(10000).reshape(100, 100) % 4096).astype(np.uint16)
+
+    fits_fname = images.write_fits(data, {'EXPTIME': 120}, str(tmpdir.join('test.fits')))
+    fz_fname = images.write_fits(data, {'EXPTIME': 120}, str(tmpdir.join('test.fits.fz')))
+    assert os.stat(fz_fname).st_size < os.stat(fits_fname).st_size
+
+    with fits.open(fz_fname) as hdu_list:
+        hdu = images.get_image_hdu(hdu_list)
+        assert isinstance(hdu, fits.CompImageHDU)
+        assert (hdu.data == data).all()
+        assert hdu.header['EXPTIME'] == 120
+
+
 def test_pretty_time():
     t0 = '2016-08-13 10:00:00'
     os.environ['POCSTIME'] = t0
@@ -1,50 +1,337 @@
+import atexit
+import copy
 import os
 import pymongo
+import queue
+import threading
+import time
 
 import gzip
 import json
 
+from astropy import units as u
+from astropy.utils import console
+from bson import ObjectId
 from bson import json_util
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from datetime import datetime
 from warnings import warn
 
 from pocs.utils import current_time
+from pocs.utils.storage import get_store
+
+# Clients shared by everything in this process, see `get_client`
+_clients = dict()
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+_shared_db = None
+
+
+def get_client(host='localhost', port=27017, connect=False):
+    """Get the `pymongo.MongoClient` shared by this process for `host` and `port`
+
+    A `MongoClient` is thread-safe and keeps its own connection pool (and
+    monitor threads), so one is created per server on first use and then
+    shared. Clients are not fork-safe, so a process that finds it has been
+    forked from the one that created the clients starts again with new ones.
+
+    Args:
+        host (str, optional): hostname running MongoDB
+        port (int, optional): port running MongoDb
+        connect (bool, optional): Connect to mongo on create rather than on
+            first use, defaults to False
+
+    Returns:
+        pymongo.MongoClient: The shared client
+    """
+    global _clients, _clients_pid, _clients_lock
+
+    if _clients_pid != os.getpid():
+        # Forked, so don't touch the parent's clients (or a lock it may hold)
+        _clients = dict()
+        _clients_lock = threading.Lock()
+        _clients_pid = os.getpid()
+
+    key = (host, port)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = pymongo.MongoClient(host, port, connect=connect)
+
+        return _clients[key]
+
+
+def get_shared_db(**kwargs):
+    """Get the `PanMongo` shared by this process, e.g. by every `PanBase`
+
+    Args:
+        **kwargs: Keyword args for the `PanMongo`, only used when it is first
+            created (e.g. the `db` section of the config)
+
+    Returns:
+        PanMongo: The shared database
+    """
+    global _shared_db
+
+    if _shared_db is None:
+        _shared_db = PanMongo(**kwargs)
+
+    return _shared_db
+
+
+class WriteBehindQueue(object):
+
+    def __init__(self, write_batch, max_size=1000, batch_size=100):
+        """Queue of writes carried out in batches on a background thread
+
+        Callers `put` a write and carry on; a daemon thread takes whatever
+        writes are waiting (up to `batch_size`) and hands them to `write_batch`
+        in the order they were queued. The queue holds at most `max_size`
+        writes, after which `put` blocks until there is room, so a slow
+        database holds up the writers rather than growing without limit.
+
+        Anything still queued is written when the process exits.
+
+        Args:
+            write_batch (callable): Called with a list of writes
+            max_size (int, optional): Most writes to hold, defaults to 1000
+            batch_size (int, optional): Most writes in a batch, defaults to 100
+        """
+        assert max_size > 0 and batch_size > 0, "Queue and batch size must be positive"
+
+        self._write_batch = write_batch
+        self.batch_size = batch_size
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._pid = os.getpid()
+
+        self._thread = threading.Thread(target=self._run, name='WriteBehindQueue', daemon=True)
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    @property
+    def is_running(self):
+        """True if writes are being carried out by this process"""
+        return self._pid == os.getpid() and self._thread.is_alive()
+
+    def put(self, write, timeout=None):
+        """Queue a write, waiting for room if the queue is full
+
+        Args:
+            write: Anything understood by `write_batch`
+            timeout (float, optional): Seconds to wait for room, defaults to
+                waiting for as long as it takes
+
+        Raises:
+            queue.Full: If there is no room after `timeout`
+        """
+        self._queue.put(write, timeout=timeout)
+
+    def flush(self):
+        """Wait until every write queued so far has been carried out"""
+        if self.is_running:
+            self._queue.join()
+
+    def close(self):
+        """Carry out the queued writes and stop the thread"""
+        if self.is_running:
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            try:
+                self._write_batch([write for write in batch if write is not None])
+            except Exception as e:
+                warn("Problem writing batch: {}".format(e))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+class CurrentCollection(object):
+
+    # Methods that change the collection
+    write_methods = {
+        'insert', 'insert_one', 'insert_many', 'save', 'replace_one', 'update', 'update_one', 'update_many',
+        'remove', 'delete_one', 'delete_many', 'bulk_write', 'drop', 'find_and_modify',
+        'find_one_and_delete', 'find_one_and_replace', 'find_one_and_update',
+    }
+
+    def __init__(self, db, collection):
+        """The `current` collection of a `PanMongo`, as returned by `db.current`
+
+        Behaves as the collection itself, except that writes through it make
+        `db` forget the `get_current` records it has cached (see
+        `PanMongo.clear_cache`) once the write is done. Reads leave the cache
+        alone.
+
+        Args:
+            db (PanMongo): The `PanMongo` holding the cache
+            collection (pymongo.collection.Collection): The `current` collection
+        """
+        self._db = db
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+
+        if name in self.write_methods:
+            def write(*args, **kwargs):
+                try:
+                    return attr(*args, **kwargs)
+                finally:
+                    self._db.clear_cache()
+
+            return write
+
+        return attr
 
 
 class PanMongo(object):
 
-    def __init__(self, host='localhost', port=27017, connect=False):
+    collections = [
+        'config',
+        'current',
+        'drift_align',
+        'environment',
+        'mount',
+        'observations',
+        'state',
+        'weather',
+    ]
+
+    # Indexes for the lookups POCS makes, besides the `date` index every
+    # collection has for range queries (e.g. `export`)
+    indexes = {
+        'current': [{'keys': [('type', pymongo.ASCENDING)], 'unique': True}],
+        'observations': [{'keys': [('image_id', pymongo.ASCENDING)]}],
+    }
+
+    # High volume collections that can be split up by time, see `partition_by`
+    partitioned_collections = ['environment', 'weather']
+
+    _partition_formats = {
+        'month': '%Y_%m',
+        'year': '%Y',
+    }
+
+    def __init__(self, host='localhost', port=27017, connect=False,
+                 write_behind=False, max_queue_size=1000, batch_size=100,
+                 backend='mongo', db_file=None, partition_by=None, cache_ttl=0):
         """Connection to the running MongoDB instance
 
         This is a collection of parameters that are initialized when the unit
         starts and can be read and updated as the project is running. The server
         is a wrapper around a mongodb collection.
 
+        Creating a `PanMongo` does not allocate anything: the client for
+        `host` and `port` is shared by the whole process and only created when
+        a collection is first used (see `get_client`). Each collection is
+        available as an attribute.
+
+        With `write_behind`, `insert_current` and `insert` queue their writes
+        and return straight away, see `WriteBehindQueue`. `get_current` still
+        returns the last record inserted, even if it is still queued, and
+        using a collection attribute directly first waits for the queued
+        writes so the collection is up to date.
+
+        The `backend` holding the collections is MongoDB by default. For
+        machines without a database service, `memory` keeps them in this
+        process and `sqlite` keeps them in the file `db_file`, with the same
+        API (see `~pocs.utils.storage`).
+
+        With `partition_by`, records inserted into the `partitioned_collections`
+        go to a collection for each month (or year), e.g. `weather_2017_01`,
+        so indexes and scans stay the size of one period however many years
+        of data a unit holds. The collection attributes (e.g. `db.weather`)
+        are still the unpartitioned collection; see `partitions` and
+        `get_collection` for the rest. `export` includes all of them.
+
+        With a `cache_ttl`, records read by `get_current` are kept for that
+        many seconds, so e.g. checking the weather every loop doesn't cost a
+        round trip each time. Records written by this `PanMongo` (or direct use
+        of `current`) replace the cached ones straight away; records written
+        elsewhere are seen within `cache_ttl` seconds.
+
         Args:
             host (str, optional): hostname running MongoDB
             port (int, optional): port running MongoDb
-            connect (bool, optional): Connect to mongo on create, defaults to True
+            connect (bool, optional): Connect to mongo on create, defaults to False
+            write_behind (bool, optional): Queue inserts, defaults to False
+            max_queue_size (int, optional): Most inserts to queue before
+                inserting blocks, defaults to 1000
+            batch_size (int, optional): Most inserts written at once, defaults to 100
+            backend (str, optional): `mongo`, `memory` or `sqlite`, defaults to `mongo`
+            db_file (str, optional): Database file for the `sqlite` backend,
+                defaults to `$PANDIR/panoptes.sqlite`
+            partition_by (str, optional): `month` or `year` to partition the
+                `partitioned_collections`, defaults to None (no partitions)
+            cache_ttl (float, optional): Seconds to cache `get_current`
+                records for, defaults to 0 (no caching)
 
         """
-        # Get the mongo client
-        self._client = pymongo.MongoClient(host, port, connect=connect)
-
-        self.collections = [
-            'config',
-            'current',
-            'drift_align',
-            'environment',
-            'mount',
-            'observations',
-            'state',
-            'weather',
-        ]
-
-        # Setup static connections to the collections we want
-        for collection in self.collections:
-            # Add the collection as an attribute
-            setattr(self, collection, getattr(self._client.panoptes, 'panoptes.{}'.format(collection)))
+        assert backend in ('mongo', 'memory', 'sqlite'), "Unknown database backend: {}".format(backend)
+        assert partition_by in (None, 'month', 'year'), "Unknown partition: {}".format(partition_by)
+
+        self._host = host
+        self._port = port
+
+        self.backend = backend
+        self._db_file = db_file
+
+        self.partition_by = partition_by
+
+        # Collections whose indexes have been ensured
+        self._indexed = set()
+
+        self.write_behind = write_behind
+        self._queue_args = {'max_size': max_queue_size, 'batch_size': batch_size}
+        self._writer = None
+
+        # `current` records queued but not written yet, by type
+        self._pending = dict()
+        self._pending_lock = threading.Lock()
+
+        # `current` records read, by type, with the (monotonic) time they expire.
+        # Every write to `current` bumps the generation, so a read that raced
+        # a write isn't cached.
+        self.cache_ttl = cache_ttl
+        self._cache = dict()
+        self._cache_generation = 0
+
+        if connect and backend == 'mongo':
+            get_client(host, port, connect=True)
+
+    @property
+    def _client(self):
+        """The shared client for this process"""
+        return get_client(self._host, self._port)
+
+    def __getattr__(self, name):
+        # Collections are looked up on each use so they always belong to the
+        # client of the current process
+        if name in self.collections:
+            self.flush()
+
+            if name == 'current':
+                # Could be written to directly
+                return CurrentCollection(self, self._collection(name))
+
+            return self._collection(name)
+
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
 
     def insert_current(self, collection, obj, include_collection=True):
         """Insert an object into both the `current` collection and the collection provided
@@ -66,13 +353,60 @@ class PanMongo(object):
                 'date': current_time(datetime=True),
             }
 
-            # Update `current` record
-            self.current.replace_one({'type': collection}, current_obj, True)
+            if self.write_behind:
+                if collection not in self.collections:
+                    raise AttributeError(collection)
+
+                writes = [('current', current_obj)]
+                if include_collection:
+                    _id = ObjectId()
+                    writes.append(('insert', self._target(collection, current_obj), dict(current_obj, _id=_id)))
+
+                writer = self._get_writer()
+
+                with self._pending_lock:
+                    self._pending[collection] = current_obj
+                    self._cache.pop(collection, None)
+                    self._cache_generation += 1
+
+                for write in writes:
+                    writer.put(write)
+            else:
+                # Update `current` record
+                self._collection('current').replace_one({'type': collection}, current_obj, True)
+                self.clear_cache(collection)
+
+                if include_collection:
+                    # Insert record into db
+                    col = self.get_collection(self._target(collection, current_obj))
+                    _id = col.insert_one(current_obj).inserted_id
+        except AttributeError:
+            warn("Collection does not exist in db: {}".format(collection))
+        except Exception as e:
+            warn("Problem inserting object into collection: {}".format(e))
+
+        return _id
+
+    def insert(self, collection, obj):
+        """Insert a record into a collection
+
+        Args:
+            collection (str): Name of valid collection within panoptes db
+            obj (dict): Record to be inserted
+
+        Returns:
+            str: Mongo object ID of the record
+        """
+        _id = None
+        try:
+            if collection not in self.collections:
+                raise AttributeError(collection)
 
-            if include_collection:
-                # Insert record into db
-                col = getattr(self, collection)
-                _id = col.insert_one(current_obj).inserted_id
+            if self.write_behind:
+                _id = ObjectId()
+                self._get_writer().put(('insert', self._target(collection, obj), dict(obj, _id=_id)))
+            else:
+                _id = self.get_collection(self._target(collection, obj)).insert_one(dict(obj)).inserted_id
         except AttributeError:
             warn("Collection does not exist in db: {}".format(collection))
         except Exception as e:
@@ -83,10 +417,251 @@ class PanMongo(object):
     def get_current(self, collection):
         """Returns the most current record for the given collection
 
+        A record that is still queued (see `write_behind`) is returned as it
+        will be written, i.e. without an `_id`. Records may come from the
+        cache, see `cache_ttl`.
+
         Args:
             collection (str): Name of the collection to get most current from
         """
-        return self.current.find_one({'type': collection})
+        with self._pending_lock:
+            pending = self._pending.get(collection)
+            cached = self._cache.get(collection)
+            generation = self._cache_generation
+
+        if pending is not None:
+            return dict(pending)
+
+        if cached is not None and cached[0] > time.monotonic():
+            return copy.deepcopy(cached[1])
+
+        record = self._collection('current').find_one({'type': collection})
+
+        if self.cache_ttl > 0:
+            with self._pending_lock:
+                # Unless written to in the meantime
+                if self._cache_generation == generation and collection not in self._pending:
+                    self._cache[collection] = (time.monotonic() + self.cache_ttl, copy.deepcopy(record))
+
+        return record
+
+    def clear_cache(self, collection=None):
+        """Forget cached `get_current` records
+
+        Args:
+            collection (str, optional): Only forget the record of this
+                collection, defaults to all
+        """
+        with self._pending_lock:
+            if collection is None:
+                self._cache = dict()
+            else:
+                self._cache.pop(collection, None)
+
+            self._cache_generation += 1
+
+    def get_collection(self, name):
+        """Get a collection (or a partition of one, see `partitions`) by name
+
+        Queued writes are written first, as for the collection attributes.
+        """
+        if name not in self.collections and self._partition_base(name) is None:
+            raise AttributeError("Collection does not exist in db: {}".format(name))
+
+        self.flush()
+
+        if name not in self.collections:
+            self._ensure_indexes(name)
+
+        return self._collection(name)
+
+    def partitions(self, collection, start=None, end=None):
+        """Names of the time partitions of `collection`, oldest first
+
+        Args:
+            collection (str): One of the `partitioned_collections`
+            start (datetime.datetime, optional): Only partitions with records
+                from this time on
+            end (datetime.datetime, optional): Only partitions with records
+                up to this time
+
+        Returns:
+            list: Names of the partitions in the db
+        """
+        prefix = '{}_'.format(collection)
+
+        names = list()
+        for name in self._collection_names():
+            if not name.startswith(prefix) or self._partition_base(name) != collection:
+                continue
+
+            period = name[len(prefix):]
+            if start is not None and period < self._period(start)[:len(period)]:
+                continue
+            if end is not None and period > self._period(end)[:len(period)]:
+                continue
+
+            names.append(name)
+
+        return sorted(names)
+
+    def ensure_indexes(self):
+        """Create any missing indexes, see `indexes`
+
+        Indexes are created in the background by the db, and by the write
+        queue if `write_behind` is set, so this doesn't hold up startup.
+        """
+        if self.write_behind:
+            self._get_writer().put(('indexes',))
+        else:
+            self._ensure_indexes()
+
+    def index_stats(self):
+        """How often each index has been used since the db started
+
+        Only MongoDB keeps these statistics.
+
+        Returns:
+            dict: For each collection (and partition), a dict of the number of
+                operations that used each index
+        """
+        stats = dict()
+        if self.backend != 'mongo':
+            return stats
+
+        self.flush()
+        for name in self._collection_names():
+            try:
+                usage = self._collection(name).aggregate([{'$indexStats': {}}])
+                stats[name] = {index['name']: index['accesses']['ops'] for index in usage}
+            except Exception as e:
+                warn("Cannot get index stats for {}: {}".format(name, e))
+
+        return stats
+
+    def flush(self):
+        """Wait until all queued inserts have been written"""
+        writer = self.__dict__.get('_writer')
+        if writer is not None:
+            writer.flush()
+
+    def close(self):
+        """Write all queued inserts and stop the background writer"""
+        writer = self.__dict__.get('_writer')
+        if writer is not None:
+            writer.close()
+            self._writer = None
+
+    def _collection(self, name):
+        if self.backend == 'mongo':
+            return getattr(self._client.panoptes, 'panoptes.{}'.format(name))
+
+        return get_store(self.backend, self._db_file).collection(name)
+
+    def _collection_names(self):
+        """Names of the collections (and partitions) in the db"""
+        if self.backend == 'mongo':
+            names = self._client.panoptes.list_collection_names()
+            names = [name[len('panoptes.'):] for name in names if name.startswith('panoptes.')]
+        else:
+            names = get_store(self.backend, self._db_file).collection_names()
+
+        return [name for name in names if name in self.collections or self._partition_base(name) is not None]
+
+    def _period(self, date):
+        return date.strftime(self._partition_formats['month'])
+
+    def _partition_base(self, name):
+        """The collection that `name` is a partition of, None if it isn't one"""
+        for collection in self.partitioned_collections:
+            period = name[len(collection) + 1:]
+            if name.startswith('{}_'.format(collection)) and \
+                    period.replace('_', '').isdigit() and len(period) in (4, 7):
+                return collection
+
+        return None
+
+    def _target(self, collection, record):
+        """Name of the collection (or partition) that `record` is inserted into"""
+        if self.partition_by is None or collection not in self.partitioned_collections:
+            return collection
+
+        date = record.get('date')
+        if not isinstance(date, datetime):
+            date = current_time(datetime=True)
+
+        return '{}_{}'.format(collection, date.strftime(self._partition_formats[self.partition_by]))
+
+    def _ensure_indexes(self, *names):
+        """Create the indexes of the collections `names`, defaults to all of them"""
+        try:
+            if len(names) == 0:
+                names = self.collections + [name for name in self._collection_names()
+                                            if name not in self.collections]
+
+            for name in names:
+                if name in self._indexed:
+                    continue
+
+                collection = self._collection(name)
+                base = self._partition_base(name) or name
+
+                for index in [{'keys': [('date', pymongo.ASCENDING)]}] + self.indexes.get(base, list()):
+                    try:
+                        collection.create_index(index['keys'], unique=index.get('unique', False), background=True)
+                    except pymongo.errors.OperationFailure as e:
+                        # e.g. duplicates in the way of a unique index
+                        warn("Cannot create index {} for {}: {}".format(index['keys'], name, e))
+
+                self._indexed.add(name)
+        except Exception as e:
+            warn("Cannot create indexes: {}".format(e))
+
+    def _get_writer(self):
+        """The queue for writes from this process, started on first use"""
+        if self._writer is not None and self._writer._pid != os.getpid():
+            # A forked child starts afresh; its parent writes what was queued
+            self._writer = None
+            self._pending = dict()
+            self._pending_lock = threading.Lock()
+
+        if self._writer is None:
+            self._writer = WriteBehindQueue(self._write_batch, **self._queue_args)
+
+        return self._writer
+
+    def _write_batch(self, writes):
+        """Carry out queued writes as one bulk write per collection"""
+        current = list()
+        inserts = dict()
+        for write in writes:
+            if write[0] == 'indexes':
+                self._ensure_indexes()
+            elif write[0] == 'current':
+                current.append(write[1])
+            else:
+                inserts.setdefault(write[1], list()).append(write[2])
+
+        try:
+            if len(current) > 0:
+                self._collection('current').bulk_write(
+                    [pymongo.ReplaceOne({'type': obj['type']}, obj, upsert=True) for obj in current])
+
+            for collection, records in inserts.items():
+                if collection not in self.collections:
+                    self._ensure_indexes(collection)
+
+                self._collection(collection).insert_many(records)
+        finally:
+            # Now in the db (or failed the same way a direct write would have)
+            with self._pending_lock:
+                if len(current) > 0:
+                    self._cache_generation += 1
+
+                for obj in current:
+                    self._cache.pop(obj['type'], None)
+                    if self._pending.get(obj['type']) is obj:
+                        del self._pending[obj['type']]
 
     def export(self,
                yesterday=True,
@@ -94,9 +669,16 @@ class PanMongo(object):
                end_date=None,
                collections=['all'],
                backup_dir=None,
-               compress=True):  # pragma: no cover
+               compress=True,
+               num_workers=1,
+               batch_size=1000):
         """Exports the mongodb to an external file
 
+        Records are streamed from the db a batch at a time and written (and
+        compressed) as they arrive, so memory use doesn't grow with the date
+        range. Each collection is written to a `.part` file that is renamed
+        once complete.
+
         Args:
             yesterday (bool, optional): Export only yesterday, defaults to True
             start_date (str, optional): Start date for export if `yesterday` is False,
@@ -106,6 +688,10 @@ class PanMongo(object):
             collections (list, optional): Which collections to include, defaults to all
             backup_dir (str, optional): Backup directory, defaults to /backups
             compress (bool, optional): Compress output file with gzip, defaults to True
+            num_workers (int, optional): Number of collections to export at
+                once, defaults to 1
+            batch_size (int, optional): Number of records read from the db at
+                a time, defaults to 1000
 
         Returns:
             list: List of saved files
@@ -144,46 +730,98 @@ class PanMongo(object):
         if end_str != date_str:
             date_str = '{}_to_{}'.format(date_str, end_str)
 
-        out_files = list()
-
         console.color_print("Exporting collections: ", 'default', "\t{}".format(date_str.replace('_', ' ')), 'yellow')
+
+        jobs = list()
         for collection in collections:
             if collection not in self.collections:
-                next
-            console.color_print("\t{}".format(collection))
+                continue
 
-            out_file = '{}{}_{}.json'.format(backup_dir, date_str.replace('-', ''), collection)
+            out_file = os.path.join(backup_dir, '{}_{}.json'.format(date_str.replace('-', ''), collection))
+            if compress:
+                out_file = out_file + '.gz'
 
-            col = getattr(self, collection)
-            entries = [x for x in col.find({'date': {'$gt': start, '$lt': end}}).sort([('date', pymongo.ASCENDING)])]
+            jobs.append((collection, out_file))
 
-            if len(entries):
-                console.color_print("\t\t{} records exported".format(len(entries)), 'yellow')
-                content = json.dumps(entries, default=json_util.default)
-                write_type = 'w'
+        # Wait for anything queued so it is included
+        self.flush()
 
-                if compress:
-                    console.color_print("\t\tCompressing...", 'lightblue')
-                    content = gzip.compress(bytes(content, 'utf8'))
-                    out_file = out_file + '.gz'
-                    write_type = 'wb'
+        with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as executor:
+            results = executor.map(lambda job: self._export_collection(*job, start, end, compress, batch_size),
+                                   jobs)
 
-                with open(out_file, write_type)as f:
-                    console.color_print("\t\tWriting file: ", 'lightblue', out_file, 'yellow')
-                    f.write(content)
+            out_files = list()
+            for (collection, out_file), (num_records, elapsed) in zip(jobs, results):
+                console.color_print("\t{}".format(collection))
 
-                out_files.append(out_file)
-            else:
-                console.color_print("\t\tNo records found", 'yellow')
+                if num_records:
+                    console.color_print("\t\t{} records exported in {:.1f}s ({:.0f} records/s)".format(
+                        num_records, elapsed, num_records / max(elapsed, 1e-6)), 'yellow')
+                    console.color_print("\t\tWrote file: ", 'lightblue', out_file, 'yellow')
+
+                    out_files.append(out_file)
+                else:
+                    console.color_print("\t\tNo records found", 'yellow')
 
         console.color_print("Output file: {}".format(out_files))
         return out_files
 
+    def _export_collection(self, collection, out_file, start, end, compress, batch_size):
+        """Stream the records of `collection` between `start` and `end` to `out_file`
 
-if __name__ == '__main__':  # pragma: no cover
-    from astropy.utils import console
-    from astropy import units as u
+        The file holds the same JSON list as `json.dumps` of all the records
+        would give, including those in any partitions of the collection. No
+        file is left if there are no records.
 
+        Returns:
+            tuple: Number of records written and the time taken in seconds
+        """
+        t0 = time.perf_counter()
+
+        names = [collection]
+        if collection in self.partitioned_collections:
+            names.extend(self.partitions(collection, start, end))
+
+        def records():
+            # Partitions are in time order, after anything from before partitioning
+            for name in names:
+                cursor = self._collection(name).find({'date': {'$gt': start, '$lt': end}}, batch_size=batch_size)
+                for record in cursor.sort([('date', pymongo.ASCENDING)]):
+                    yield record
+
+        part_file = out_file + '.part'
+        if compress:
+            f = gzip.open(part_file, 'wt', encoding='utf8')
+        else:
+            f = open(part_file, 'w')
+
+        num_records = 0
+        try:
+            with f:
+                encoder = json.JSONEncoder(default=json_util.default)
+
+                f.write('[')
+                for record in records():
+                    if num_records > 0:
+                        f.write(', ')
+
+                    f.write(encoder.encode(record))
+
+                    num_records += 1
+                f.write(']')
+        except Exception:
+            os.remove(part_file)
+            raise
+
+        if num_records > 0:
+            os.replace(part_file, out_file)
+        else:
+            os.remove(part_file)
+
+        return num_records, time.perf_counter() - t0
+
+
+if __name__ == '__main__':  # pragma: no cover
     import argparse
 
     parser = argparse.ArgumentParser(description="Exporter for mongo collections")
@@ -195,6 +833,10 @@ if __name__ == '__main__':  # pragma: no cover
     parser.add_argument('--backup-dir', help='Directory to store backup files, defaults to $PANDIR/backups')
     parser.add_argument('--compress', action="store_true", default=True,
                         help='If exported files should be compressed, defaults to True')
+    parser.add_argument('--num-workers', type=int, default=1,
+                        help='Number of collections to export at once, defaults to 1')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Number of records to read from the db at a time, defaults to 1000')
 
     args = parser.parse_args()
     if args.start_date is not None:
@@ -1,7 +1,10 @@
 import os
+import re
 import shutil
 import subprocess
+import threading
 
+from collections import deque
 from collections import namedtuple
 from dateutil import parser as date_parser
 from json import loads
@@ -17,9 +20,14 @@ from astropy.io import fits
 
 from pocs.utils import current_time
 from pocs.utils import error
+from pocs.utils import listify
 
 PointingError = namedtuple('PointingError', ['delta_ra', 'delta_dec', 'separation'])
 
+# `ExifReader`s shared by `read_exif`, by path to exiftool
+_exif_readers = dict()
+_exif_readers_lock = threading.Lock()
+
 
 def solve_field(fname, timeout=15, solve_opts=[], **kwargs):
     """ Plate solves an image.
@@ -307,7 +315,10 @@ def get_wcsinfo(fits_fname, verbose=False):
 def fpack(fits_fname, unpack=False, verbose=False):
     """ Compress/Decompress a FITS file
 
-    Uses `fpack` (or `funpack` if `unpack=True`) to compress a FITS file
+    Tile compresses a FITS file with the Rice algorithm, like `fpack` (or
+    uncompresses it, like `funpack`, if `unpack=True`), but in-process through
+    `astropy.io.fits.CompImageHDU` (see `write_fits`). As with `fpack -D` the
+    original file is removed.
 
     Parameters
     ----------
@@ -325,29 +336,78 @@ def fpack(fits_fname, unpack=False, verbose=False):
     assert os.path.exists(fits_fname), warn("No file exists at: {}".format(fits_fname))
 
     if unpack:
-        fpack = shutil.which('funpack')
-        run_cmd = [fpack, '-D', fits_fname]
         out_file = fits_fname.replace('.fz', '')
     else:
-        fpack = shutil.which('fpack')
-        run_cmd = [fpack, '-D', '-Y', fits_fname]
         out_file = fits_fname.replace('.fits', '.fits.fz')
 
-    assert fpack is not None, warn("fpack not found (try installing cfitsio)")
-
     if verbose:
-        print("fpack command: {}".format(run_cmd))
+        print("{} {} to {}".format('Uncompressing' if unpack else 'Compressing', fits_fname, out_file))
 
-    proc = subprocess.Popen(run_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-    try:
-        output, errs = proc.communicate(timeout=5)
-    except subprocess.TimeoutExpired:
-        proc.kill()
-        output, errs = proc.communicate()
+    with fits.open(fits_fname, 'readonly') as hdu_list:
+        hdu = get_image_hdu(hdu_list)
+        write_fits(hdu.data, hdu.header, out_file, compress=not unpack, overwrite=True)
+
+    os.remove(fits_fname)
 
     return out_file
 
 
+def get_image_hdu(hdu_list):
+    """ The image HDU of an open FITS file
+
+    For a tile compressed (`.fz`) file this is the `CompImageHDU` in the first
+    extension, whose `data` and `header` are those of the uncompressed image.
+
+    Args:
+        hdu_list (astropy.io.fits.HDUList): The open file
+
+    Returns:
+        astropy.io.fits.PrimaryHDU or astropy.io.fits.CompImageHDU: The HDU
+    """
+    if len(hdu_list) > 1 and isinstance(hdu_list[1], fits.CompImageHDU):
+        return hdu_list[1]
+
+    return hdu_list[0]
+
+
+def write_fits(data, header, fits_fname, compress=None, overwrite=False):
+    """ Write image data to a FITS file, optionally tile compressed
+
+    Compressing here, straight from the data in memory, saves writing the
+    uncompressed file only to read it back to compress it.
+
+    Args:
+        data (numpy.array): The image
+        header (astropy.io.fits.Header or dict): Header for the image
+        fits_fname (str): Name of the file to write
+        compress (bool, optional): Rice tile compress the image, in the same
+            layout as `fpack`. Defaults to True if `fits_fname` ends with `.fz`
+        overwrite (bool, optional): Overwrite an existing file, default False
+
+    Returns:
+        str: Name of the file written
+    """
+    if compress is None:
+        compress = fits_fname.endswith('.fz')
+
+    header = fits.Header(header)
+
+    if compress:
+        hdu_list = fits.HDUList([fits.PrimaryHDU(),
+                                 fits.CompImageHDU(data, header=header, compression_type='RICE_1')])
+    else:
+        hdu = fits.PrimaryHDU(data, header=header)
+        if 'EXTEND' not in hdu.header:
+            # Not kept by `CompImageHDU`, so put back when uncompressing
+            hdu.header.set('EXTEND', True, after='NAXIS{}'.format(hdu.header['NAXIS']))
+
+        hdu_list = fits.HDUList([hdu])
+
+    hdu_list.writeto(fits_fname, output_verify='silentfix', overwrite=overwrite)
+
+    return fits_fname
+
+
 def make_pretty_image(fname, timeout=15, **kwargs):  # pragma: no cover
     """ Make a pretty image
 
@@ -413,14 +473,17 @@ def cr2_to_fits(
         headers={},
         fits_headers={},
         remove_cr2=False,
+        pipe=True,
         **kwargs):  # pragma: no cover
     """ Convert a CR2 file to FITS
 
-    This is a convenience function that first converts the CR2 to PGM via `cr2_to_pgm`. Also adds keyword headers
-    to the FITS file.
+    This is a convenience function that reads the raw data and EXIF information with `read_cr2`,
+    which pipes the output of `dcraw` straight into memory, and writes them to the FITS file along
+    with keyword headers. If `pipe` is False the CR2 is instead converted to a PGM file via
+    `cr2_to_pgm`, which is then read back with `read_pgm`.
 
     Note:
-        The intermediate PGM file is automatically removed
+        Any intermediate PGM file is automatically removed
 
     Arguments:
         cr2_fname {str} -- Name of CR2 file to be converted
@@ -428,11 +491,12 @@ def cr2_to_fits(
 
     Keyword Arguments:
         fits_fname {str} -- Name of FITS file to output. If None (default), the `cr2_fname` is used
-            as base (default: {None})
+            as base (default: {None}). If it ends with `.fz` the file is tile compressed (see `write_fits`)
         clobber {bool} -- A bool indicating if existing FITS should be clobbered (default: {False})
         headers {dict} -- Header data that is filtered and added to the FITS header.
         fits_headers {dict} -- Header data that is added to the FITS header without filtering.
         remove_cr2 {bool} -- A bool indicating if the CR2 should be removed (default: {False})
+        pipe {bool} -- Read the `dcraw` output from a pipe rather than a PGM file (default: {True})
 
     """
 
@@ -442,14 +506,20 @@ def cr2_to_fits(
         fits_fname = cr2_fname.replace('.cr2', '.fits')
 
     if not os.path.exists(fits_fname) or clobber:
-        if verbose:
-            print("Converting CR2 to PGM: {}".format(cr2_fname))
+        if pipe:
+            if verbose:
+                print("Reading CR2: {}".format(cr2_fname))
 
-        # Convert the CR2 to a PGM file then delete PGM
-        pgm = read_pgm(cr2_to_pgm(cr2_fname), remove_after=True)
+            pgm, exif = read_cr2(cr2_fname)
+        else:
+            if verbose:
+                print("Converting CR2 to PGM: {}".format(cr2_fname))
 
-        # Add the EXIF information from the CR2 file
-        exif = read_exif(cr2_fname)
+            # Convert the CR2 to a PGM file then delete PGM
+            pgm = read_pgm(cr2_to_pgm(cr2_fname), remove_after=True)
+
+            # Add the EXIF information from the CR2 file
+            exif = read_exif(cr2_fname)
 
         # Set the PGM as the primary data for the FITS file
         hdu = fits.PrimaryHDU(pgm)
@@ -509,7 +579,7 @@ def cr2_to_fits(
             if verbose:
                 print("Saving fits file to: {}".format(fits_fname))
 
-            hdu.writeto(fits_fname, output_verify='silentfix', clobber=clobber)
+            write_fits(hdu.data, hdu.header, fits_fname, overwrite=clobber)
         except Exception as e:
             warn("Problem writing FITS file: {}".format(e))
         else:
@@ -578,10 +648,69 @@ def cr2_to_pgm(cr2_fname, pgm_fname=None, dcraw='dcraw', clobber=True, **kwargs)
     return pgm_fname
 
 
+def read_cr2(cr2_fname, dcraw='dcraw', exiftool='exiftool', with_exif=True):  # pragma: no cover
+    """ Read the raw data and EXIF information of a CR2 file
+
+    Runs `dcraw` with the same options as `cr2_to_pgm` but writing the PGM to
+    stdout, which is read straight into the returned array without a temporary
+    file. The EXIF information is read by the shared `ExifReader` (see
+    `get_exif_reader`) at the same time, so it doesn't add to the time taken.
+
+    Note:
+        This is a blocking call. Assumes `dcraw` and `exiftool` are installed
+
+    Arguments:
+        cr2_fname {str} -- Name of CR2 file to read
+
+    Keyword Arguments:
+        dcraw {str} -- Path to installed `dcraw` (default: {'dcraw'})
+        exiftool {str} -- Path to installed `exiftool` (default: {'exiftool'})
+        with_exif {bool} -- Read the EXIF information, otherwise an empty dict
+                            is returned for it (default: {True})
+
+    Returns:
+        tuple(numpy.array, dict) -- The raw data, as from `read_pgm`, and the
+                                    EXIF information, as from `read_exif`
+
+    """
+    assert os.path.exists(cr2_fname), "cr2 file does not exist at {}".format(cr2_fname)
+
+    exif_reader = get_exif_reader(exiftool)
+
+    # Ask for the EXIF first so exiftool reads it while dcraw runs
+    request_id = None
+    if with_exif:
+        request_id = exif_reader.submit(cr2_fname)
+
+    try:
+        dcraw_proc = subprocess.Popen([dcraw, '-t', '0', '-D', '-4', '-c', cr2_fname],
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        pgm, dcraw_err = dcraw_proc.communicate()
+
+        if dcraw_proc.returncode != 0:
+            raise error.InvalidSystemCommand(msg="File: {} \n err: {}".format(cr2_fname, dcraw_err.decode()))
+    except OSError as err:
+        exif_reader.discard(request_id)
+        raise error.InvalidSystemCommand(msg="File: {} \n err: {}".format(cr2_fname, err))
+    except BaseException:
+        exif_reader.discard(request_id)
+        raise
+
+    exif = [{}]
+    if request_id is not None:
+        exif = exif_reader.collect(request_id)
+
+    if with_exif and len(exif[0]) == 0:
+        raise error.InvalidSystemCommand(msg="File: {} \n err: Cannot read EXIF".format(cr2_fname))
+
+    return parse_pgm(pgm), exif[0]
+
+
 def read_exif(fname, exiftool='exiftool'):  # pragma: no cover
     """ Read the EXIF information
 
-    Gets the EXIF information using exiftool
+    Gets the EXIF information using exiftool, through the `ExifReader` shared
+    by the process (see `get_exif_reader`) so exiftool is only started once.
 
     Note:
         Assumes the `exiftool` is installed
@@ -596,20 +725,247 @@ def read_exif(fname, exiftool='exiftool'):  # pragma: no cover
         dict -- Dictonary of EXIF information
 
     """
-    assert os.path.exists(fname), warn("File does not exist: {}".format(fname))
-    exif = {}
+    return get_exif_reader(exiftool).read(fname)
 
-    try:
-        # Build the command for this file
-        command = '{} -j {}'.format(exiftool, fname)
-        cmd_list = command.split()
 
-        # Run the command
-        exif = loads(subprocess.check_output(cmd_list).decode('utf-8'))
-    except subprocess.CalledProcessError as err:
-        raise error.InvalidSystemCommand(msg="File: {} \n err: {}".format(fname, err))
+def get_exif_reader(exiftool='exiftool'):
+    """ The `ExifReader` for `exiftool` shared by the process
+
+    Keyword Args:
+        exiftool {str} -- Location of exiftool (default: {'exiftool'})
+
+    Returns:
+        ExifReader -- The reader, which is started when first used
+    """
+    with _exif_readers_lock:
+        if exiftool not in _exif_readers:
+            _exif_readers[exiftool] = ExifReader(exiftool=exiftool)
+
+        return _exif_readers[exiftool]
+
+
+class ExifReader(object):
+
+    """ Read EXIF information with a persistent exiftool process
+
+    Starting exiftool (a Perl script) takes much longer than reading the EXIF
+    information of a file, so rather than running it for each file a single
+    `exiftool -stay_open` process is kept running and sent each request.
+
+    Requests can be pipelined: `submit` sends a request and returns straight
+    away, and `collect` waits for its result (or `discard` drops it).
+    `read_many` reads a list of files in batches of `batch_size`, sending each
+    batch before collecting the previous one, for e.g. reprocessing the images
+    of a whole night.
+
+    The reader can be shared by threads. A forked process starts its own
+    exiftool the first time it uses the reader.
+
+    Args:
+        exiftool (str, optional): Location of exiftool, defaults to `exiftool`
+        batch_size (int, optional): Number of files in each request made by
+            `read_many`, defaults to 100
+    """
+
+    def __init__(self, exiftool='exiftool', batch_size=100):
+        self.exiftool = exiftool
+        self.batch_size = batch_size
+
+        self._process = None
+        self._pid = None
+        self._lock = threading.RLock()
+
+        self._last_id = 0
+        self._pending = deque()
+        self._results = dict()
+        self._discarded = set()
+
+    @property
+    def is_running(self):
+        """ If this process has an exiftool running """
+        return self._process is not None and self._pid == os.getpid() and self._process.poll() is None
+
+    def start(self):
+        """ Start exiftool, if it isn't already running """
+        with self._lock:
+            if self.is_running:
+                return
+
+            try:
+                self._process = subprocess.Popen([self.exiftool, '-stay_open', 'True', '-@', '-'],
+                                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                 stderr=subprocess.DEVNULL)
+            except OSError as err:
+                raise error.InvalidSystemCommand(msg="Cannot start {}: {}".format(self.exiftool, err))
+
+            self._pid = os.getpid()
+            self._pending.clear()
+            self._results.clear()
+            self._discarded.clear()
+
+    def stop(self):
+        """ Ask exiftool to exit, killing it if it doesn't """
+        with self._lock:
+            if not self.is_running:
+                return
+
+            try:
+                self._process.stdin.write(b'-stay_open\nFalse\n')
+                self._process.stdin.flush()
+                self._process.wait(timeout=5)
+            except Exception:
+                self._process.kill()
+            finally:
+                self._process = None
+
+    def submit(self, fnames):
+        """ Send a request to read the EXIF information of `fnames`
 
-    return exif[0]
+        Args:
+            fnames (str or list): Name(s) of the files to read
+
+        Returns:
+            int: Id of the request, to pass to `collect`
+        """
+        fnames = listify(fnames)
+        for fname in fnames:
+            assert os.path.exists(fname), warn("File does not exist: {}".format(fname))
+
+        with self._lock:
+            self.start()
+
+            self._last_id += 1
+            request_id = self._last_id
+
+            args = ['-j'] + fnames + ['-execute{}'.format(request_id)]
+            try:
+                self._process.stdin.write('\n'.join(args).encode('utf-8') + b'\n')
+                self._process.stdin.flush()
+            except OSError as err:
+                self._process.kill()
+                raise error.InvalidSystemCommand(msg="Files: {} \n err: {}".format(fnames, err))
+
+            self._pending.append((request_id, fnames))
+
+        return request_id
+
+    def collect(self, request_id):
+        """ Wait for the result of a request sent by `submit`
+
+        Args:
+            request_id (int): Id of the request
+
+        Returns:
+            list: A dict of EXIF information for each file of the request, in
+                the same order. The dict is empty for a file that couldn't be read
+        """
+        with self._lock:
+            while request_id not in self._results:
+                assert len(self._pending) > 0, warn("No such request: {}".format(request_id))
+                self._read_result()
+
+            return self._results.pop(request_id)
+
+    def discard(self, request_id):
+        """ Drop the result of a request sent by `submit` that won't be collected
+
+        The result is dropped once it has been read, so it isn't kept forever
+        and doesn't hold up the requests sent after it.
+
+        Args:
+            request_id (int or None): Id of the request, nothing is done if None
+        """
+        if request_id is None:
+            return
+
+        with self._lock:
+            if self._results.pop(request_id, None) is None:
+                self._discarded.add(request_id)
+
+    def read(self, fname):
+        """ Read the EXIF information of `fname`
+
+        Returns:
+            dict: Dictonary of EXIF information
+
+        Raises:
+            error.InvalidSystemCommand: If the file can't be read
+        """
+        exif = self.collect(self.submit(fname))[0]
+        if len(exif) == 0:
+            raise error.InvalidSystemCommand(msg="File: {} \n err: Cannot read EXIF".format(fname))
+
+        return exif
+
+    def read_many(self, fnames):
+        """ Read the EXIF information of a list of files
+
+        Args:
+            fnames (list): Names of the files to read
+
+        Returns:
+            list: A dict of EXIF information for each file, in the same order.
+                The dict is empty for a file that couldn't be read
+        """
+        batches = [fnames[i:i + self.batch_size] for i in range(0, len(fnames), self.batch_size)]
+
+        exif = list()
+        request_id = None
+        for batch in batches:
+            next_id = self.submit(batch)
+            if request_id is not None:
+                exif.extend(self.collect(request_id))
+            request_id = next_id
+
+        if request_id is not None:
+            exif.extend(self.collect(request_id))
+
+        return exif
+
+    def _read_result(self):
+        """ Read the output of the oldest pending request """
+        request_id, fnames = self._pending.popleft()
+        ready = '{{ready{}}}'.format(request_id)
+
+        lines = list()
+        while True:
+            line = self._process.stdout.readline()
+            if not line:
+                self._process = None
+                raise error.InvalidSystemCommand(msg="{} exited reading {}".format(self.exiftool, fnames))
+
+            line = line.decode('utf-8').rstrip()
+            if line == ready:
+                break
+
+            lines.append(line)
+
+        output = '\n'.join(lines).strip()
+        by_fname = {exif.get('SourceFile'): exif for exif in (loads(output) if output else [])}
+
+        exif = list()
+        for fname in fnames:
+            if fname not in by_fname:
+                warn("Cannot read EXIF: {}".format(fname))
+            exif.append(by_fname.get(fname, dict()))
+
+        if request_id in self._discarded:
+            self._discarded.remove(request_id)
+        else:
+            self._results[request_id] = exif
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __del__(self):
+        try:
+            self.stop()
+        except Exception:
+            pass
 
 
 def read_pgm(fname, byteorder='>', remove_after=False):  # pragma: no cover
@@ -638,24 +994,36 @@ def read_pgm(fname, byteorder='>', remove_after=False):  # pragma: no cover
     with open(fname, 'rb') as f:
         buffer = f.read()
 
-    # We know our header info is 19 chars long
-    header_offset = 19
+    data = parse_pgm(buffer, byteorder=byteorder)
 
-    img_type, img_size, img_max_value, _ = buffer[0:header_offset].decode().split('\n')
+    if remove_after:
+        os.remove(fname)
 
-    assert img_type == 'P5', warn("No a PGM file")
+    return data
 
-    # Get the width and height (as strings)
-    width, height = img_size.split(' ')
 
-    data = np.flipud(np.frombuffer(buffer[header_offset:],
-                                   dtype=byteorder + 'u2',
-                                   ).reshape((int(height), int(width))))
+def parse_pgm(buffer, byteorder='>'):
+    """Return image data from the contents of a raw PGM file as numpy array.
 
-    if remove_after:
-        os.remove(fname)
+    The array is a (flipped) view of `buffer`, so the data isn't copied. See
+    `read_pgm` for the format.
 
-    return data
+    Args:
+        buffer(bytes):      Contents of a PGM file
+        byteorder(str):     Big endian
+
+    Returns:
+        numpy.array:        The raw data from the PGM
+
+    """
+    header = re.match(br'(P\d)\s+(\d+)\s+(\d+)\s+(\d+)\s', buffer)
+    assert header is not None and header.group(1) == b'P5', warn("Not a PGM file")
+
+    width, height, max_value = [int(value) for value in header.groups()[1:]]
+    dtype = byteorder + 'u2' if max_value > 255 else 'u1'
+
+    return np.flipud(np.frombuffer(buffer, dtype=dtype, count=width * height,
+                                   offset=header.end()).reshape((height, width)))
 
 
 def create_timelapse(directory, fn_out=None, **kwargs):  # pragma: no cover
@@ -1,5 +1,6 @@
 import datetime
 import logging
+import numpy as np
 import zmq
 
 from astropy import units as u
@@ -11,19 +12,38 @@ from warnings import warn
 
 from pocs.utils import current_time
 
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
 
 class PanMessaging(object):
 
     """Messaging class for PANOPTES project. Creates a new ZMQ
     context that can be shared across parent application.
 
+    Messages are sent as multipart ZMQ messages: a frame with the channel (so
+    subscribers and the forwarder only ever look at that frame), a frame with
+    the name of the codec, the encoded message and then a frame for each
+    NumPy array in the message. Arrays are sent without copying and received
+    as read-only arrays backed by their frame. Subscribers decode each
+    message with the codec it names, so publishers can use any `codec`.
+
+    Args:
+        socket_type (str): `publisher`, `subscriber` or `forwarder`
+        port (int or tuple): Port, or (subscriber, publisher) ports for a forwarder
+        codec (str, optional): Codec used to send messages, `json` or
+            `msgpack` (see `codecs`), defaults to `json`
     """
     logger = logging
 
-    def __init__(self, socket_type, port, **kwargs):
+    def __init__(self, socket_type, port, codec='json', **kwargs):
         assert socket_type is not None
         assert port is not None
 
+        self.codec = get_codec(codec)
+
         # Create a new context
         self.context = zmq.Context()
 
@@ -116,18 +136,15 @@ class PanMessaging(object):
 
         if isinstance(message, str):
             message = {'message': message, 'timestamp': current_time().isot.replace('T', ' ').split('.')[0]}
-        else:
-            message = self.scrub_message(message)
-
-        msg_object = dumps(message, skipkeys=True)
 
-        full_message = '{} {}'.format(channel, msg_object)
+        payload, buffers = self.codec.encode(message)
 
         if channel == 'PANCHAT':
             self.logger.info("{} {}".format(channel, message['message']))
 
         # Send the message
-        self.publisher.send_string(full_message, flags=zmq.NOBLOCK)
+        frames = [channel.encode(), self.codec.name.encode(), payload] + buffers
+        self.publisher.send_multipart(frames, flags=zmq.NOBLOCK, copy=False)
 
     def receive_message(self, flags=0):
         """Receive a message
@@ -145,40 +162,175 @@ class PanMessaging(object):
         msg_type = None
         msg_obj = None
         try:
-            message = self.subscriber.recv_string(flags=flags)
+            frames = self.subscriber.recv_multipart(flags=flags, copy=False)
         except Exception:
             pass
         else:
-            msg_type, msg = message.split(' ', maxsplit=1)
-            msg_obj = loads(msg)
+            if len(frames) == 1:
+                # Single string from an older publisher
+                msg_type, msg = frames[0].bytes.decode().split(' ', maxsplit=1)
+                msg_obj = loads(msg)
+            else:
+                msg_type = frames[0].bytes.decode()
+                codec = get_codec(frames[1].bytes.decode())
+                msg_obj = codec.decode(frames[2].bytes, [frame.buffer for frame in frames[3:]])
 
         return msg_type, msg_obj
 
     def scrub_message(self, message):
+        return _scrub_message(message)
+
+    def close(self):
+        """Close the sockets and the context, dropping any messages not yet sent"""
+        for socket in [self.publisher, self.subscriber]:
+            if socket is not None and not socket.closed:
+                socket.close(linger=0)
+
+        self.context.term()
+
+
+##################################################################################################
+# Codecs
+##################################################################################################
+
+def get_codec(name):
+    """Get a codec by name, see `codecs`"""
+    try:
+        return codecs[name]()
+    except KeyError:
+        raise ValueError("Unknown message codec: {}".format(name))
+
+
+class JSONCodec(object):
+
+    name = 'json'
+
+    def encode(self, message):
+        """Encode a message
+
+        The message is scrubbed (see `PanMessaging.scrub_message`) and sent as
+        JSON, as it always has been.
+
+        Args:
+            message (dict): The message
+
+        Returns:
+            tuple(bytes, list): The encoded message and any array buffers
+        """
+        buffers = list()
+
+        message = _scrub_message(message)
+        payload = dumps(message, skipkeys=True, default=lambda obj: _encode_array(obj, buffers))
+
+        return payload.encode(), buffers
+
+    def decode(self, payload, buffers):
+        """Decode a message from `encode`"""
+        return loads(payload.decode(), object_hook=lambda obj: _decode_array(obj, buffers))
+
+
+class MsgpackCodec(object):
+
+    name = 'msgpack'
+
+    def __init__(self):
+        """Binary messages with msgpack
+
+        Messages are scrubbed (see `PanMessaging.scrub_message`) the same way
+        as for the `JSONCodec`, so subscribers get the same values whichever
+        codec was used, and NumPy arrays are sent in their own frames. Values
+        the scrubbing doesn't reach (e.g. in lists) are converted to types
+        msgpack knows: datetimes and `Time`s to ISO strings, `Quantity`s to
+        their value and `ObjectId`s to strings.
+        """
+        assert msgpack is not None, "The msgpack codec needs the msgpack package"
+
+    def encode(self, message):
+        buffers = list()
+
+        message = _scrub_message(message)
+        payload = msgpack.packb(message, use_bin_type=True, default=lambda obj: _encode_value(obj, buffers))
+
+        return payload, buffers
+
+    def decode(self, payload, buffers):
+        return msgpack.unpackb(payload, raw=False, object_hook=lambda obj: _decode_array(obj, buffers))
+
+
+codecs = {
+    'json': JSONCodec,
+    'msgpack': MsgpackCodec,
+}
+
+
+def _encode_array(obj, buffers):
+    """Send an array (or NumPy scalar) in its own frame, leaving a placeholder in the message"""
+    if isinstance(obj, np.generic):
+        return obj.item()
+
+    if not isinstance(obj, np.ndarray):
+        raise TypeError("Cannot encode {}".format(type(obj)))
+
+    array = np.ascontiguousarray(obj)
+    buffers.append(array)
+
+    dtype = array.dtype.descr if array.dtype.fields else array.dtype.str
+
+    return {'__ndarray__': len(buffers) - 1, 'dtype': dtype, 'shape': list(array.shape)}
+
+
+def _decode_array(obj, buffers):
+    if '__ndarray__' not in obj:
+        return obj
+
+    dtype = obj['dtype']
+    if isinstance(dtype, list):
+        dtype = [tuple(field) for field in dtype]
+
+    return np.frombuffer(buffers[obj['__ndarray__']], dtype=np.dtype(dtype)).reshape(obj['shape'])
+
+
+def _encode_value(obj, buffers):
+    if isinstance(obj, u.Quantity):
+        return _encode_value(obj.value, buffers) if not obj.isscalar else float(obj.value)
+
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+
+    if isinstance(obj, Time):
+        return obj.isot
+
+    if isinstance(obj, ObjectId):
+        return str(obj)
+
+    return _encode_array(obj, buffers)
+
+
+def _scrub_message(message):
 
-        for k, v in message.items():
-            if isinstance(v, dict):
-                v = self.scrub_message(v)
+    for k, v in message.items():
+        if isinstance(v, dict):
+            v = _scrub_message(v)
 
-            if isinstance(v, u.Quantity):
-                v = v.value
+        if isinstance(v, u.Quantity):
+            v = v.value
 
-            if isinstance(v, datetime.datetime):
-                v = v.isoformat()
+        if isinstance(v, datetime.datetime):
+            v = v.isoformat()
 
-            if isinstance(v, ObjectId):
-                v = str(v)
+        if isinstance(v, ObjectId):
+            v = str(v)
 
-            if isinstance(v, Time):
-                v = str(v.isot).split('.')[0].replace('T', ' ')
+        if isinstance(v, Time):
+            v = str(v.isot).split('.')[0].replace('T', ' ')
 
-            # Hmmmm
-            if k.endswith('_time'):
-                v = str(v).split(' ')[-1]
+        # Hmmmm
+        if k.endswith('_time'):
+            v = str(v).split(' ')[-1]
 
-            if isinstance(v, float):
-                v = round(v, 3)
+        if isinstance(v, float):
+            v = round(v, 3)
 
-            message[k] = v
+        message[k] = v
 
-        return message
+    return message
@@ -0,0 +1,854 @@
+import copy
+import os
+import pymongo
+import sqlite3
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from datetime import timezone
+
+from bson import ObjectId
+from bson import json_util
+from pymongo.results import DeleteResult
+from pymongo.results import InsertManyResult
+from pymongo.results import InsertOneResult
+from pymongo.results import UpdateResult
+
+# Stores shared by everything in this process, see `get_store`
+_stores = dict()
+_stores_pid = None
+_stores_lock = threading.Lock()
+
+# Same as a `MongoClient` by default: naive (UTC) datetimes
+_json_options = json_util.JSONOptions(tz_aware=False)
+
+
+def get_store(backend='memory', db_file=None):
+    """Get the document store shared by this process
+
+    Every `PanMongo` using the same `backend` (and `db_file`) in a process sees
+    the same store, the same way they share a `MongoClient` for a server.
+
+    Args:
+        backend (str, optional): `memory` or `sqlite`, defaults to `memory`
+        db_file (str, optional): The SQLite database file, defaults to
+            `$PANDIR/panoptes.sqlite`
+
+    Returns:
+        DocumentStore: The store
+    """
+    global _stores, _stores_pid, _stores_lock
+
+    if _stores_pid != os.getpid():
+        # Forked, so don't share connections (or locks) with the parent
+        _stores = dict()
+        _stores_lock = threading.Lock()
+        _stores_pid = os.getpid()
+
+    if backend == 'sqlite':
+        if db_file is None:
+            db_file = '{}/panoptes.sqlite'.format(os.getenv('PANDIR', default='/var/panoptes'))
+        key = (backend, os.path.realpath(db_file))
+    elif backend == 'memory':
+        key = (backend, None)
+    else:
+        raise ValueError("Unknown database backend: {}".format(backend))
+
+    with _stores_lock:
+        if key not in _stores:
+            if backend == 'sqlite':
+                _stores[key] = SQLiteStore(db_file)
+            else:
+                _stores[key] = MemoryStore()
+
+        return _stores[key]
+
+
+##################################################################################################
+# Stores
+##################################################################################################
+
+class DocumentStore(object):
+
+    def __init__(self):
+        """A set of collections of documents
+
+        Stand-in for a MongoDB database. Documents are kept in insertion order
+        and queried in Python, supporting the parts of the `pymongo` API used
+        by POCS: `find`/`find_one` with equality, `$exists`, `$ne`, `$in`,
+        `$gt(e)`, `$lt(e)`, `$and` and `$or`, inserts, `replace_one`, updates
+        with `$set`, `$unset` and `$inc`, deletes and `bulk_write`.
+        """
+        self._collections = dict()
+        self._lock = threading.RLock()
+
+    def collection(self, name):
+        """Get the collection `name`, created on first use"""
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = Collection(self, name)
+
+            return self._collections[name]
+
+    @contextmanager
+    def transaction(self):
+        """Hold the store so a read and the writes based on it are atomic"""
+        with self._lock:
+            yield
+
+    def collection_names(self):
+        """Names of the collections holding documents"""
+        raise NotImplementedError
+
+    def drop(self):
+        """Remove every document from every collection"""
+        raise NotImplementedError
+
+    def _find(self, name, filter=None, batch_size=None):
+        """Cursor over the documents in the collection that match `filter`"""
+        # Stored documents are replaced rather than changed, so the cursor
+        # can hold on to them and copy each one as it is read
+        return Cursor(self._matching(name, filter))
+
+    def _matching(self, name, filter=None, limit=None):
+        """Documents in the collection that match `filter`, in insertion order"""
+        with self._lock:
+            documents = [document for document in self._load(name).values() if _matches(document, filter)]
+
+        if limit:
+            documents = documents[:limit]
+
+        return documents
+
+    def _load(self, name):
+        """All documents in the collection as an ordered dict-like of _id: document"""
+        raise NotImplementedError
+
+    def _insert(self, name, documents):
+        """Insert new documents, failing if an `_id` is already used"""
+        raise NotImplementedError
+
+    def _put(self, name, documents):
+        """Insert or replace documents, keyed by their `_id`"""
+        raise NotImplementedError
+
+    def _delete(self, name, ids):
+        raise NotImplementedError
+
+
+class MemoryStore(DocumentStore):
+
+    def __init__(self):
+        """Documents kept in memory, lost when the process ends"""
+        super().__init__()
+
+        self._documents = OrderedDict()
+
+    def collection_names(self):
+        with self._lock:
+            return [name for name, documents in self._documents.items() if len(documents) > 0]
+
+    def drop(self):
+        with self._lock:
+            self._documents = OrderedDict()
+
+    def _load(self, name):
+        return self._documents.get(name, OrderedDict())
+
+    def _insert(self, name, documents):
+        with self._lock:
+            collection = self._documents.setdefault(name, OrderedDict())
+            assert not any(document['_id'] in collection for document in documents), "Duplicate _id"
+
+            self._put(name, documents)
+
+    def _put(self, name, documents):
+        collection = self._documents.setdefault(name, OrderedDict())
+        for document in documents:
+            collection[document['_id']] = document
+
+    def _delete(self, name, ids):
+        collection = self._documents.get(name, OrderedDict())
+        for _id in ids:
+            del collection[_id]
+
+
+class SQLiteStore(DocumentStore):
+
+    def __init__(self, db_file):
+        """Documents kept in an SQLite database file
+
+        Each collection is a table of documents stored as Extended JSON, so
+        datetimes and `ObjectId`s survive the round trip. The `_id`, `type` and
+        `date` of each document are also kept in indexed columns, so queries on
+        them (e.g. `get_current` or an `export` of a day) only read the rows
+        that can match, see `_sql_filter`. The file can be shared between
+        processes, so documents are read from it on every query rather than
+        cached.
+
+        Args:
+            db_file (str): The database file, created if needed
+        """
+        super().__init__()
+
+        self.db_file = db_file
+
+        dirname = os.path.dirname(db_file)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+
+        self._tables = set()
+        self._depth = 0
+
+    @contextmanager
+    def transaction(self):
+        # Also lock out other processes using the file
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute('BEGIN IMMEDIATE')
+
+            self._depth += 1
+            try:
+                yield
+            except Exception:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute('ROLLBACK')
+                raise
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute('COMMIT')
+
+    def collection_names(self):
+        with self._lock:
+            tables = self._conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+
+        return [table for table, in tables if not table.startswith('sqlite_')]
+
+    def drop(self):
+        with self._lock:
+            tables = self._conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+            for table, in tables:
+                if not table.startswith('sqlite_'):
+                    self._conn.execute('DROP TABLE "{}"'.format(table))
+
+            self._tables = set()
+
+    def _table(self, name):
+        with self._lock:
+            if name not in self._tables:
+                self._conn.execute('CREATE TABLE IF NOT EXISTS "{}" (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                   'id TEXT UNIQUE, type TEXT, date TEXT, document TEXT)'.format(name))
+
+                for column in _SQL_COLUMNS:
+                    self._conn.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ({1})'.format(name, column))
+
+                self._tables.add(name)
+
+        return name
+
+    def _find(self, name, filter=None, batch_size=None):
+        return SQLiteCursor(self, name, filter, batch_size=batch_size)
+
+    def _matching(self, name, filter=None, limit=None):
+        cursor = SQLiteCursor(self, name, filter)
+        if limit:
+            cursor.limit(limit)
+
+        return list(cursor)
+
+    def _select(self, name, clauses, params, order=None, after=None, limit=None):
+        """Rows of (seq, date, document) selected by the SQL `clauses`
+
+        Rows are in insertion order or, with an `order` (a `pymongo` direction),
+        by `date` and then insertion order. Paging through the rows, `after` is
+        the (seq, date) of the last row of the previous page.
+        """
+        clauses = list(clauses)
+        params = list(params)
+
+        if order is None:
+            order_by = 'seq'
+            if after is not None:
+                clauses.append('seq > ?')
+                params.append(after[0])
+        else:
+            order_by = 'date {}, seq'.format('DESC' if order == pymongo.DESCENDING else 'ASC')
+            if after is not None:
+                clauses.append('(date {} ? OR (date = ? AND seq > ?))'.format(
+                    '<' if order == pymongo.DESCENDING else '>'))
+                params.extend([after[1], after[1], after[0]])
+
+        query = 'SELECT seq, date, document FROM "{}"'.format(self._table(name))
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY ' + order_by
+        if limit:
+            query += ' LIMIT {:d}'.format(limit)
+
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def _insert(self, name, documents):
+        table = self._table(name)
+
+        with self.transaction():
+            try:
+                self._conn.executemany('INSERT INTO "{}" (id, type, date, document) VALUES (?, ?, ?, ?)'.format(table),
+                                       [_sql_row(document) for document in documents])
+            except sqlite3.IntegrityError:
+                raise AssertionError("Duplicate _id")
+
+    def _put(self, name, documents):
+        table = self._table(name)
+
+        with self.transaction():
+            for document in documents:
+                row = _sql_row(document)
+
+                updated = self._conn.execute('UPDATE "{}" SET type = ?, date = ?, document = ? '
+                                             'WHERE id = ?'.format(table), row[1:] + row[:1]).rowcount
+                if updated == 0:
+                    self._conn.execute('INSERT INTO "{}" (id, type, date, document) '
+                                       'VALUES (?, ?, ?, ?)'.format(table), row)
+
+    def _delete(self, name, ids):
+        table = self._table(name)
+
+        with self.transaction():
+            self._conn.executemany('DELETE FROM "{}" WHERE id = ?'.format(table),
+                                   [(json_util.dumps(_id),) for _id in ids])
+
+
+##################################################################################################
+# Collections
+##################################################################################################
+
+class Collection(object):
+
+    def __init__(self, store, name):
+        """A collection in a `DocumentStore`, with the `pymongo.Collection` API used by POCS
+
+        Args:
+            store (DocumentStore): The store holding the documents
+            name (str): Name of the collection
+        """
+        self._store = store
+        self.name = name
+
+    def find(self, filter=None, *args, **kwargs):
+        return self._store._find(self.name, filter, batch_size=kwargs.get('batch_size'))
+
+    def find_one(self, filter=None, *args, **kwargs):
+        for document in self.find(filter).limit(1):
+            return document
+
+        return None
+
+    def count(self, filter=None):
+        return self.find(filter).count()
+
+    def insert_one(self, document):
+        # Like pymongo, the `_id` is added to the document given
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+
+        self._store._insert(self.name, [_copy(document)])
+
+        return InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents):
+        documents = list(documents)
+        for document in documents:
+            if '_id' not in document:
+                document['_id'] = ObjectId()
+
+        self._store._insert(self.name, [_copy(document) for document in documents])
+
+        return InsertManyResult([document['_id'] for document in documents], True)
+
+    def insert(self, doc_or_docs):
+        """Legacy insert of one or more documents"""
+        if isinstance(doc_or_docs, dict):
+            return self.insert_one(doc_or_docs).inserted_id
+
+        return self.insert_many(doc_or_docs).inserted_ids
+
+    def replace_one(self, filter, replacement, upsert=False):
+        return self._update(filter, replacement, upsert=upsert, multi=False, replace=True)
+
+    def update_one(self, filter, update, upsert=False):
+        return self._update(filter, update, upsert=upsert, multi=False)
+
+    def update_many(self, filter, update, upsert=False):
+        return self._update(filter, update, upsert=upsert, multi=True)
+
+    def update(self, spec, document, upsert=False, multi=False, **kwargs):
+        """Legacy update, a replacement if `document` has no operators"""
+        replace = not any(key.startswith('$') for key in document)
+        return self._update(spec, document, upsert=upsert, multi=multi, replace=replace).raw_result
+
+    def delete_one(self, filter):
+        return self._delete(filter, multi=False)
+
+    def delete_many(self, filter):
+        return self._delete(filter, multi=True)
+
+    def remove(self, spec_or_id=None, multi=True, **kwargs):
+        """Legacy delete"""
+        if spec_or_id is not None and not isinstance(spec_or_id, dict):
+            spec_or_id = {'_id': spec_or_id}
+
+        return self._delete(spec_or_id, multi=multi).raw_result
+
+    def bulk_write(self, requests, ordered=True):
+        with self._store.transaction():
+            for request in requests:
+                if isinstance(request, pymongo.InsertOne):
+                    self.insert_one(request._doc)
+                elif isinstance(request, pymongo.ReplaceOne):
+                    self.replace_one(request._filter, request._doc, upsert=request._upsert)
+                elif isinstance(request, (pymongo.UpdateOne, pymongo.UpdateMany)):
+                    self._update(request._filter, request._doc, upsert=request._upsert,
+                                 multi=isinstance(request, pymongo.UpdateMany))
+                elif isinstance(request, (pymongo.DeleteOne, pymongo.DeleteMany)):
+                    self._delete(request._filter, multi=isinstance(request, pymongo.DeleteMany))
+                else:
+                    raise TypeError("Unsupported bulk write: {}".format(request))
+
+    def create_index(self, *args, **kwargs):
+        """Indexes are not needed for documents held in memory"""
+        return None
+
+    def _update(self, filter, update, upsert=False, multi=False, replace=False):
+        with self._store.transaction():
+            matched = self._store._matching(self.name, filter, limit=None if multi else 1)
+
+            updated = [_apply_update(document, update, replace) for document in matched]
+
+            upserted_id = None
+            if len(matched) == 0 and upsert:
+                # New document from the equality parts of the filter
+                base = {key: value for key, value in (filter or dict()).items()
+                        if not key.startswith('$') and not isinstance(value, dict)}
+                document = _apply_update(_expand(base), update, replace)
+                document.setdefault('_id', ObjectId())
+                upserted_id = document['_id']
+                updated = [document]
+
+            self._store._put(self.name, updated)
+
+        raw_result = {'n': len(updated), 'nModified': len(matched), 'ok': 1.0,
+                      'updatedExisting': len(matched) > 0}
+        if upserted_id is not None:
+            raw_result['upserted'] = upserted_id
+
+        return UpdateResult(raw_result, True)
+
+    def _delete(self, filter, multi=True):
+        with self._store.transaction():
+            ids = [document['_id'] for document in
+                   self._store._matching(self.name, filter, limit=None if multi else 1)]
+
+            self._store._delete(self.name, ids)
+
+        return DeleteResult({'n': len(ids), 'ok': 1.0}, True)
+
+
+class Cursor(object):
+
+    def __init__(self, documents):
+        """Results of `Collection.find`"""
+        self._documents = documents
+
+    def sort(self, key_or_list, direction=pymongo.ASCENDING):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction)]
+
+        # Stable sorts, least significant key first
+        for key, key_direction in reversed(list(key_or_list)):
+            self._documents.sort(key=lambda document: _sort_key(_get_path(document, key)),
+                                 reverse=key_direction == pymongo.DESCENDING)
+
+        return self
+
+    def limit(self, limit):
+        if limit:
+            self._documents = self._documents[:limit]
+
+        return self
+
+    def count(self, with_limit_and_skip=False):
+        return len(self._documents)
+
+    def __iter__(self):
+        return (_copy(document) for document in self._documents)
+
+    def __len__(self):
+        return len(self._documents)
+
+
+class SQLiteCursor(Cursor):
+
+    def __init__(self, store, name, filter=None, batch_size=None):
+        """Results of `Collection.find` on an `SQLiteStore`
+
+        Rows are read (and decoded) a page of `batch_size` at a time while
+        iterating, so the results are never all held in memory. Only the rows
+        selected by the SQL form of `filter` (see `_sql_filter`) are read, and
+        `filter` is then applied to each document. A sort on `date` of a query
+        that is restricted by `date` is done in SQL, any other sort (or
+        `count`) reads all of the results.
+
+        Args:
+            store (SQLiteStore): The store holding the documents
+            name (str): Name of the collection
+            filter (dict, optional): The query
+            batch_size (int, optional): Rows read at a time, defaults to 1000
+        """
+        super().__init__(None)
+
+        self._store = store
+        self._name = name
+        self._filter = filter
+        self._clauses, self._params, self._columns = _sql_filter(filter)
+        self._batch_size = batch_size or 1000
+
+        self._order = None
+        self._limit = None
+
+    def sort(self, key_or_list, direction=pymongo.ASCENDING):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction)]
+        key_or_list = list(key_or_list)
+
+        if self._documents is None and self._order is None and self._limit is None and \
+                len(key_or_list) == 1 and key_or_list[0][0] == 'date' and 'date' in self._columns:
+            # Only documents with a date are selected, so SQL and Python sort them the same way
+            self._order = key_or_list[0][1]
+            return self
+
+        self._read_all()
+        return super().sort(key_or_list)
+
+    def limit(self, limit):
+        if self._documents is not None:
+            return super().limit(limit)
+
+        if limit:
+            self._limit = limit
+
+        return self
+
+    def count(self, with_limit_and_skip=False):
+        self._read_all()
+        return super().count(with_limit_and_skip)
+
+    def __iter__(self):
+        if self._documents is not None:
+            return super().__iter__()
+
+        return self._iter_rows()
+
+    def __len__(self):
+        self._read_all()
+        return super().__len__()
+
+    def _read_all(self):
+        if self._documents is None:
+            self._documents = list(self._iter_rows())
+
+    def _iter_rows(self):
+        num_documents = 0
+        after = None
+        while True:
+            rows = self._store._select(self._name, self._clauses, self._params, order=self._order,
+                                       after=after, limit=self._batch_size)
+
+            for seq, date, content in rows:
+                document = json_util.loads(content, json_options=_json_options)
+                if _matches(document, self._filter):
+                    yield document
+
+                    num_documents += 1
+                    if num_documents == self._limit:
+                        return
+
+            if len(rows) < self._batch_size:
+                return
+
+            after = (rows[-1][0], rows[-1][1])
+
+
+##################################################################################################
+# Private Functions
+##################################################################################################
+
+_missing = object()
+
+# Fields `SQLiteStore` keeps in an indexed column (as well as `_id`), and the
+# column value for a field that is present but can't be indexed. Queries
+# select those rows too and leave them to `_matches`.
+_SQL_COLUMNS = ('type', 'date')
+_SQL_OTHER = '\x00'
+_SQL_OPERATORS = {'$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}
+
+
+def _copy(value):
+    """Copy of a document, faster than `copy.deepcopy` for plain dicts and lists"""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [_copy(item) for item in value]
+
+    if isinstance(value, (str, bytes, int, float, bool, type(None), datetime, ObjectId)):
+        return value
+
+    return copy.deepcopy(value)
+
+
+def _get_path(document, path):
+    """Value at a dotted `path`, `_missing` if there is none"""
+    value = document
+    for key in path.split('.'):
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return _missing
+
+    return value
+
+
+def _set_path(document, path, value):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        document = document.setdefault(key, dict())
+
+    document[keys[-1]] = value
+
+
+def _unset_path(document, path):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        document = document.get(key)
+        if not isinstance(document, dict):
+            return
+
+    document.pop(keys[-1], None)
+
+
+def _expand(flat):
+    """Document from a dict of dotted paths"""
+    document = dict()
+    for path, value in flat.items():
+        _set_path(document, path, value)
+
+    return document
+
+
+def _sort_key(value):
+    # Missing and None sort first, as in MongoDB
+    if value is _missing or value is None:
+        return (0, 0)
+
+    return (1, value)
+
+
+def _compare(value, op, operand):
+    if value is _missing or value is None:
+        return False
+
+    try:
+        if op == '$gt':
+            return value > operand
+        if op == '$gte':
+            return value >= operand
+        if op == '$lt':
+            return value < operand
+        return value <= operand
+    except TypeError:
+        return False
+
+
+def _matches_value(value, condition):
+    if isinstance(condition, dict) and any(key.startswith('$') for key in condition):
+        for op, operand in condition.items():
+            if op == '$exists':
+                if (value is not _missing) != bool(operand):
+                    return False
+            elif op == '$ne':
+                if _matches_value(value, operand):
+                    return False
+            elif op == '$in':
+                if not any(_matches_value(value, item) for item in operand):
+                    return False
+            elif op == '$nin':
+                if any(_matches_value(value, item) for item in operand):
+                    return False
+            elif op in ('$gt', '$gte', '$lt', '$lte'):
+                if not _compare(value, op, operand):
+                    return False
+            else:
+                raise ValueError("Unsupported query operator: {}".format(op))
+
+        return True
+
+    if value is _missing:
+        return condition is None
+
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+
+    return value == condition
+
+
+def _matches(document, filter):
+    if not filter:
+        return True
+
+    for key, condition in filter.items():
+        if key == '$and':
+            if not all(_matches(document, sub_filter) for sub_filter in condition):
+                return False
+        elif key == '$or':
+            if not any(_matches(document, sub_filter) for sub_filter in condition):
+                return False
+        elif not _matches_value(_get_path(document, key), condition):
+            return False
+
+    return True
+
+
+def _sql_value(field, value):
+    """Column value of `field` for `value`, None if it has no column value"""
+    if field == '_id':
+        if isinstance(value, (ObjectId, str)):
+            return json_util.dumps(value)
+    elif field == 'type':
+        if isinstance(value, str):
+            return value
+    elif field == 'date':
+        if isinstance(value, datetime):
+            if value.tzinfo is not None:
+                # Stored documents are read back as naive UTC
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+
+            return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+    return None
+
+
+def _sql_columns(document):
+    """Values of the `_SQL_COLUMNS` for `document`"""
+    values = list()
+    for field in _SQL_COLUMNS:
+        value = document.get(field, _missing)
+        if value is _missing:
+            values.append(None)
+        else:
+            column_value = _sql_value(field, value)
+            values.append(_SQL_OTHER if column_value is None else column_value)
+
+    return tuple(values)
+
+
+def _sql_row(document):
+    """Values of the id, type, date and document columns for `document`"""
+    return (json_util.dumps(document['_id']),) + _sql_columns(document) + (json_util.dumps(document),)
+
+
+def _sql_filter(filter):
+    """SQL for the parts of `filter` that can use the indexed columns
+
+    Equality and `$in` on `_id`, `type` and `date` and ranges on `date` are
+    used, anything else is left to `_matches`. The rows selected are always a
+    superset of the documents that match `filter`.
+
+    Returns:
+        tuple: The list of SQL conditions, their parameters and the set of
+            fields restricted by them
+    """
+    clauses = list()
+    params = list()
+    columns = set()
+
+    for key, condition in (filter or dict()).items():
+        if key == '$and':
+            for sub_filter in condition:
+                sub_clauses, sub_params, sub_columns = _sql_filter(sub_filter)
+                clauses.extend(sub_clauses)
+                params.extend(sub_params)
+                columns.update(sub_columns)
+            continue
+
+        if key not in ('_id',) + _SQL_COLUMNS:
+            continue
+
+        column = 'id' if key == '_id' else key
+        # Rows that can't be indexed might match in `_matches`
+        other = [] if key == '_id' else [_SQL_OTHER]
+
+        if isinstance(condition, dict) and any(op.startswith('$') for op in condition):
+            for op, operand in condition.items():
+                if op == '$in':
+                    values = [_sql_value(key, item) for item in operand]
+                    if None in values:
+                        continue
+
+                    values.extend(other)
+                    clauses.append('{} IN ({})'.format(column, ', '.join(['?'] * len(values))))
+                    params.extend(values)
+                    columns.add(key)
+                elif op in _SQL_OPERATORS and key == 'date':
+                    value = _sql_value(key, operand)
+                    if value is None:
+                        continue
+
+                    clauses.append('date {} ?'.format(_SQL_OPERATORS[op]))
+                    params.append(value)
+                    columns.add(key)
+        else:
+            value = _sql_value(key, condition)
+            if value is None:
+                continue
+
+            values = [value] + other
+            clauses.append('{} IN ({})'.format(column, ', '.join(['?'] * len(values))))
+            params.extend(values)
+            columns.add(key)
+
+    return clauses, params, columns
+
+
+def _apply_update(document, update, replace=False):
+    """Updated copy of `document`"""
+    if replace:
+        updated = _copy(update)
+        if '_id' in document:
+            updated['_id'] = document['_id']
+
+        return updated
+
+    updated = _copy(document)
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == '$set':
+                _set_path(updated, path, _copy(value))
+            elif op == '$unset':
+                _unset_path(updated, path)
+            elif op == '$inc':
+                current = _get_path(updated, path)
+                _set_path(updated, path, (0 if current is _missing else current) + value)
+            else:
+                raise ValueError("Unsupported update operator: {}".format(op))
+
+    return updated
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Benchmark converting CR2 files to FITS
+
+Each of the given CR2 files is converted with `~pocs.utils.images.cr2_to_fits`,
+both by reading `dcraw` output from a pipe (`pipe=True`, the default) and by
+going through a PGM file on disk (`pipe=False`). The median time per frame and
+the number of frames per minute for each is reported. The CR2 files are left
+in place and the FITS files are written to a temporary directory.
+
+Assumes `dcraw` and `exiftool` are installed.
+
+Example:
+    python $POCS/scripts/benchmark_cr2.py /var/panoptes/images/fields/*/*/*/*.cr2
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from pocs.utils.images import cr2_to_fits
+
+
+def convert(cr2_files, out_dir, pipe=True):
+    """Convert `cr2_files` to FITS files in `out_dir`, returning the time for each"""
+    times = list()
+    for cr2_fname in cr2_files:
+        # Work on a copy as `cr2_to_pgm` writes the PGM next to the CR2
+        cr2_copy = os.path.join(out_dir, os.path.basename(cr2_fname))
+        shutil.copy(cr2_fname, cr2_copy)
+
+        fits_fname = cr2_copy.replace('.cr2', '.fits')
+
+        t0 = time.perf_counter()
+        cr2_to_fits(cr2_copy, fits_fname=fits_fname, clobber=True, pipe=pipe)
+        times.append(time.perf_counter() - t0)
+
+        assert os.path.exists(fits_fname), "FITS file not written: {}".format(fits_fname)
+        os.remove(fits_fname)
+        os.remove(cr2_copy)
+
+    return times
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark CR2 to FITS conversion")
+    parser.add_argument('cr2_files', nargs='+', help='CR2 files to convert')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of times to convert each file')
+    parser.add_argument('--tmp-dir', default=None, help='Directory for the converted files')
+
+    args = parser.parse_args()
+
+    cr2_files = [fname for fname in args.cr2_files if fname.endswith('.cr2')] * args.repeat
+    assert len(cr2_files) > 0, "No CR2 files given"
+
+    out_dir = tempfile.mkdtemp(dir=args.tmp_dir)
+    try:
+        for name, pipe in [('PGM file', False), ('dcraw pipe', True)]:
+            times = convert(cr2_files, out_dir, pipe=pipe)
+
+            print("{} ({} frames)".format(name, len(times)))
+            print("\t{:<30} {:>10.3f}".format('median time per frame (s)', np.median(times)))
+            print("\t{:<30} {:>10.1f}".format('frames per minute', 60. * len(times) / sum(times)))
+    finally:
+        shutil.rmtree(out_dir)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Benchmark message throughput and latency through the ZMQ forwarder
+
+A forwarder is started the same way as `bin/start_msg_forwarder` (but on the
+`--port` and `--port + 1` ports, so a running POCS is not disturbed), with
+local publisher and subscriber processes either side of it. Each publisher
+sends `--num-messages` messages with `~pocs.utils.messaging.PanMessaging`, so
+with `zmq.NOBLOCK`, and each subscriber records when every message arrives.
+
+Messages look like the output of `POCS.status()` once scrubbed, padded out to
+each of the `--sizes` (in bytes, as JSON). For each size (and each `--rate`)
+the following are reported:
+
+    * send rate: Messages per second handed to the publisher sockets
+    * receive rate: Messages per second delivered to the subscribers
+    * p50 / p99 latency: From sending to receiving, in milliseconds
+    * drop rate: Fraction of messages a subscriber never received. Sends
+      don't block, so when a queue reaches its high water mark (1000
+      messages by default) messages are silently dropped
+
+Example:
+    python $POCS/scripts/benchmark_messaging.py --sizes 512 2048 16384 --rate 0 100 1000
+"""
+import time
+
+import numpy as np
+
+from multiprocessing import Event
+from multiprocessing import Process
+from multiprocessing import Queue
+
+import zmq
+
+from pocs.utils.messaging import PanMessaging
+from pocs.utils.messaging import get_codec
+
+CHANNEL = 'BENCHMARK'
+WARMUP_CHANNEL = 'BENCHMARK-WARMUP'
+END_CHANNEL = 'BENCHMARK-END'
+
+
+def make_status(size):
+    """Create a status message of (about) `size` bytes
+
+    The message has the same layout as a scrubbed `POCS.status()`, with a
+    `padding` entry to bring the JSON up to `size` bytes.
+
+    Args:
+        size (int): Size of the message in bytes
+
+    Returns:
+        dict: The message
+    """
+    status = {
+        'state': 'observing',
+        'observatory': {
+            'mount': {
+                'current_dec': '+37d33m01.73s',
+                'current_ha': '0h12m34.5s',
+                'current_ra': '2h26m51.06s',
+                'guide_rate': 0.9,
+                'movement_speed': '',
+                'state': 'Tracking',
+                'tracking': 'Sidereal',
+                'tracking_rate': '1.0000',
+            },
+            'observation': {
+                'current_exp': 3,
+                'dec_mnt': 37.5505,
+                'exp_set_size': 10,
+                'exp_time': 120.0,
+                'field_name': 'Wasp 33',
+                'merit': 1.234,
+                'min_nexp': 60,
+                'priority': 100.0,
+                'ra_mnt': 36.7127,
+                'seq_time': '20160813T130000',
+                'total_exposure_time': 360.0,
+            },
+            'observer': {
+                'local_evening_astro_time': '2016-08-14 09:14:01.456',
+                'local_moon_alt': -12.345,
+                'local_moon_illumination': 0.78,
+                'local_moon_phase': 0.42,
+                'local_morning_astro_time': '2016-08-13 15:12:34.789',
+                'local_sun_rise_time': '2016-08-13 16:22:11.123',
+                'local_sun_set_time': '2016-08-14 04:55:00.987',
+                'localtime': '2016-08-13 03:00:00',
+                'siderealtime': '0h39m24.15s',
+                'utctime': '2016-08-13 13:00:00.000',
+            },
+        },
+        'seq': 0,
+        'sent': 0,
+    }
+
+    base_size = len(get_codec('json').encode(status)[0])
+    status['padding'] = 'x' * max(size - base_size - len(', "padding": ""'), 0)
+
+    return status
+
+
+def run_forwarder(port):
+    PanMessaging('forwarder', (port, port + 1))
+
+
+def run_publisher(port, publisher_id, num_messages, size, rate, codec, ready_events, results):
+    """Send `num_messages` messages at `rate` per second (0 for as fast as possible)
+
+    Messages are only sent once every subscriber is receiving, as a subscriber
+    misses anything sent before its subscription reaches the publisher.
+    """
+    publisher = PanMessaging('publisher', port, codec=codec)
+
+    while not all([event.is_set() for event in ready_events]):
+        publisher.send_message(WARMUP_CHANNEL, {'publisher': publisher_id})
+        time.sleep(0.01)
+
+    message = make_status(size)
+    message['publisher'] = publisher_id
+
+    interval = 1. / rate if rate > 0 else 0.
+    num_errors = 0
+
+    t0 = time.time()
+    for seq in range(num_messages):
+        if interval:
+            delay = t0 + seq * interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        message['seq'] = seq
+        # Microseconds as an int, as floats are rounded to 3 decimals when scrubbed
+        message['sent'] = int(time.time() * 1e6)
+        try:
+            publisher.send_message(CHANNEL, message)
+        except zmq.ZMQError:
+            num_errors += 1
+
+    elapsed = time.time() - t0
+
+    # Let the queues drain before saying we are done
+    time.sleep(0.5)
+    for _ in range(10):
+        publisher.send_message(END_CHANNEL, {'publisher': publisher_id})
+        time.sleep(0.01)
+
+    results.put({'publisher': publisher_id, 'elapsed': elapsed, 'errors': num_errors})
+
+
+def run_subscriber(port, subscriber_id, num_publishers, ready_event, results, idle_timeout=5.):
+    """Receive messages until every publisher is done (or nothing arrives for `idle_timeout` s)"""
+    subscriber = PanMessaging('subscriber', port + 1)
+
+    poller = zmq.Poller()
+    poller.register(subscriber.subscriber, zmq.POLLIN)
+
+    latencies = list()
+    received = set()
+    finished = set()
+    first = None
+    last = None
+
+    while len(finished) < num_publishers:
+        if not poller.poll(idle_timeout * 1000):
+            break
+
+        msg_type, msg_obj = subscriber.receive_message(flags=zmq.NOBLOCK)
+        now = time.time()
+
+        if msg_type == WARMUP_CHANNEL:
+            ready_event.set()
+        elif msg_type == END_CHANNEL:
+            finished.add(msg_obj['publisher'])
+        elif msg_type == CHANNEL:
+            latencies.append(now - msg_obj['sent'] / 1e6)
+            received.add((msg_obj['publisher'], msg_obj['seq']))
+
+            if first is None:
+                first = now
+            last = now
+
+    results.put({
+        'subscriber': subscriber_id,
+        'received': len(received),
+        'latencies': latencies,
+        'first': first,
+        'last': last,
+    })
+
+
+def benchmark(port, size, rate=0, num_messages=10000, num_publishers=1, num_subscribers=1, codec='json'):
+    """Run publishers and subscribers through a forwarder
+
+    Args:
+        port (int): Port publishers send to, subscribers use `port + 1`
+        size (int): Message size in bytes
+        rate (float, optional): Messages per second from each publisher, 0
+            (the default) sends as fast as possible
+        num_messages (int, optional): Messages sent by each publisher
+        num_publishers (int, optional): Number of publisher processes
+        num_subscribers (int, optional): Number of subscriber processes
+        codec (str, optional): Codec the publishers use
+
+    Returns:
+        dict: Send and receive rates (messages/s), p50 and p99 latency (ms)
+            and drop rate
+    """
+    forwarder = Process(target=run_forwarder, args=(port,), name='BenchmarkForwarder')
+    forwarder.start()
+
+    pub_results = Queue()
+    sub_results = Queue()
+    ready_events = [Event() for _ in range(num_subscribers)]
+
+    subscribers = [Process(target=run_subscriber, args=(port, i, num_publishers, ready_events[i], sub_results))
+                   for i in range(num_subscribers)]
+    publishers = [Process(target=run_publisher,
+                          args=(port, i, num_messages, size, rate, codec, ready_events, pub_results))
+                  for i in range(num_publishers)]
+
+    try:
+        for proc in subscribers + publishers:
+            proc.start()
+
+        sent = [pub_results.get() for _ in publishers]
+        received = [sub_results.get() for _ in subscribers]
+
+        for proc in subscribers + publishers:
+            proc.join()
+    finally:
+        for proc in subscribers + publishers + [forwarder]:
+            if proc.is_alive():
+                proc.terminate()
+
+    total_sent = num_messages * num_publishers
+    latencies = np.concatenate([result['latencies'] for result in received]) * 1000
+    total_received = sum([result['received'] for result in received])
+
+    receive_rates = list()
+    for result in received:
+        if result['received'] > 1:
+            receive_rates.append(result['received'] / (result['last'] - result['first']))
+
+    results = {
+        'send rate (msg/s)': total_sent / max([result['elapsed'] for result in sent]),
+        'receive rate (msg/s)': np.mean(receive_rates) if receive_rates else 0.,
+        'p50 latency (ms)': np.percentile(latencies, 50) if len(latencies) else np.nan,
+        'p99 latency (ms)': np.percentile(latencies, 99) if len(latencies) else np.nan,
+        'drop rate': 1. - total_received / (total_sent * num_subscribers),
+        'send errors': sum([result['errors'] for result in sent]),
+    }
+
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark messaging through the ZMQ forwarder")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 2048, 16384],
+                        help='Message sizes in bytes, defaults to 512 2048 16384 (a status is about 2 KB)')
+    parser.add_argument('--rate', type=float, nargs='+', default=[0],
+                        help='Messages per second from each publisher, 0 (default) for as fast as possible')
+    parser.add_argument('--num-messages', type=int, default=10000, help='Messages sent by each publisher')
+    parser.add_argument('--num-publishers', type=int, default=1, help='Number of publishers')
+    parser.add_argument('--num-subscribers', type=int, default=1, help='Number of subscribers')
+    parser.add_argument('--codec', default='json', help='Codec used by the publishers, json or msgpack')
+    parser.add_argument('--port', type=int, default=6530,
+                        help='Forwarder port for publishers (subscribers use the next port), defaults to 6530')
+
+    args = parser.parse_args()
+
+    print("{} publisher(s), {} subscriber(s), {} messages each, {} codec".format(
+        args.num_publishers, args.num_subscribers, args.num_messages, args.codec))
+    for rate in args.rate:
+        for size in args.sizes:
+            results = benchmark(args.port, size, rate=rate, num_messages=args.num_messages,
+                                num_publishers=args.num_publishers, num_subscribers=args.num_subscribers,
+                                codec=args.codec)
+
+            print("{} bytes at {}".format(size, '{} msg/s'.format(rate) if rate > 0 else 'full speed'))
+            for name, value in results.items():
+                print("\t{:<30} {:>12.3f}".format(name, value))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""Benchmark the dispatch scheduler against synthetic field catalogs
+
+Catalogs of random fields are written in the YAML format expected by
+`~pocs.scheduler.scheduler.BaseScheduler.read_field_list`. For each catalog
+size the time (or, with `--memory`, the peak memory) to load the catalog, to
+run a full `get_observation` on the newly loaded scheduler and to run each
+constraint over all of the observations is reported. The later `get_observation` passes are all at
+the same time, so they are reported both reusing the scores of the first pass
+(cached) and scoring every observation again (uncached). Catalogs are kept in `--catalog-dir` so they
+only need to be generated once.
+
+The benchmark runs offline: `POCSTIME` is set so that `current_time` (and hence
+the scheduler) uses the given time and IERS downloads are disabled.
+
+Example:
+    python $POCS/scripts/benchmark_scheduler.py --num-fields 100 1000 10000 100000
+"""
+import os
+import time
+import tracemalloc
+import yaml
+
+import numpy as np
+
+from astroplan import Observer
+from astropy import units as u
+from astropy.coordinates import Angle
+from astropy.coordinates import EarthLocation
+from astropy.time import Time
+from astropy.utils import iers
+
+from pocs.scheduler.constraint import Duration
+from pocs.scheduler.constraint import MoonAvoidance
+from pocs.scheduler.dispatch import Scheduler
+from pocs.utils import current_time
+from pocs.utils.config import load_config
+
+
+def make_catalog(num_fields, seed=None):
+    """Create a list of random field configurations
+
+    Fields are distributed uniformly over the sphere with random priorities
+    and exposure settings.
+
+    Args:
+        num_fields (int): Number of fields in the catalog
+        seed (int, optional): Seed for the random number generator
+
+    Returns:
+        list: Field configurations
+    """
+    rng = np.random.RandomState(seed)
+
+    ra = Angle(rng.uniform(0, 360, num_fields) * u.degree)
+    dec = Angle(np.degrees(np.arcsin(rng.uniform(-1, 1, num_fields))) * u.degree)
+
+    ra_str = ra.to_string(unit=u.hourangle, sep='hms', precision=2)
+    dec_str = dec.to_string(unit=u.degree, sep='dms', precision=1, alwayssign=True)
+
+    exp_set_size = rng.choice([5, 10, 15], num_fields)
+
+    fields = list()
+    for i in range(num_fields):
+        fields.append({
+            'name': 'Field {:06d}'.format(i),
+            'position': '{} {}'.format(ra_str[i], dec_str[i]),
+            'priority': int(rng.randint(1, 200)),
+            'exp_time': int(rng.choice([60, 90, 120])),
+            'exp_set_size': int(exp_set_size[i]),
+            'min_nexp': int(exp_set_size[i] * rng.randint(1, 6)),
+        })
+
+    return fields
+
+
+def write_catalog(num_fields, catalog_dir, seed=None):
+    """Write a catalog file, reusing an existing one of the same size and seed
+
+    Args:
+        num_fields (int): Number of fields in the catalog
+        catalog_dir (str): Directory for the catalog files
+        seed (int, optional): Seed for the random number generator
+
+    Returns:
+        str: Path to the catalog file
+    """
+    os.makedirs(catalog_dir, exist_ok=True)
+
+    fname = os.path.join(catalog_dir, 'synthetic_{}_{}.yaml'.format(num_fields, seed))
+    if not os.path.exists(fname):
+        with open(fname, 'w') as f:
+            f.write(yaml.dump(make_catalog(num_fields, seed=seed), default_flow_style=False))
+
+    return fname
+
+
+def timed(func, *args, memory=False, **kwargs):
+    """Call `func`, returning its result, the run time and peak memory in MB
+
+    Tracing memory allocations slows everything down, so the peak memory is
+    only measured (and the run time is then not meaningful) if `memory` is True.
+    """
+    if memory:
+        tracemalloc.start()
+
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - t0
+
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    return result, elapsed, peak
+
+
+def benchmark(fields_file, observer, constraints, repeat=3, memory=False, catalog_cache=True):
+    """Benchmark loading a catalog and running the scheduler on it
+
+    Args:
+        fields_file (str): Catalog to load
+        observer (astroplan.Observer): Observer for the scheduler
+        constraints (list): Constraints for the scheduler
+        repeat (int, optional): Number of warm `get_observation` runs
+        memory (bool, optional): Report peak memory instead of run times
+        catalog_cache (bool, optional): Use the compiled catalog cache when loading
+
+    Returns:
+        dict: Run time (seconds) or peak memory (MB) of each step
+    """
+    results = dict()
+    idx = 2 if memory else 1
+
+    load = timed(Scheduler, observer, fields_file=fields_file, constraints=constraints,
+                 catalog_cache=catalog_cache, memory=memory)
+    scheduler = load[0]
+    results['load catalog'] = load[idx]
+
+    # Time the first pass before anything else warms the shared ephemeris
+    results['get_observation (first)'] = timed(scheduler.get_observation, memory=memory)[idx]
+
+    # Later passes are at the same time so reuse the scores of the first pass,
+    # see `Scheduler.rank_observations`. Time them without the score cache too.
+    passes = [timed(scheduler.get_observation, memory=memory)[idx] for _ in range(repeat)]
+    results['get_observation (median of later, cached)'] = np.median(passes)
+
+    rescore_tolerance = scheduler.rescore_tolerance
+    scheduler.rescore_tolerance = None
+    passes = [timed(scheduler.get_observation, memory=memory)[idx] for _ in range(repeat)]
+    results['get_observation (median of later, uncached)'] = np.median(passes)
+    scheduler.rescore_tolerance = rescore_tolerance
+
+    # Each constraint on its own, with a fresh ephemeris so they are cold too
+    scheduler = Scheduler(observer, fields_file=fields_file, constraints=constraints, catalog_cache=catalog_cache)
+
+    now = current_time()
+
+    common_properties = {
+        'end_of_night': scheduler.ephemeris.end_of_night(now),
+        'moon': scheduler.ephemeris.moon(now),
+        'ephemeris': scheduler.ephemeris,
+        'field_index': scheduler.field_index,
+        'coords': scheduler.field_index.coords,
+    }
+
+    observations = scheduler.observations.rows()
+    for constraint in constraints:
+        results[str(constraint)] = timed(constraint.get_scores, now, observer, observations,
+                                         memory=memory, **common_properties)[idx]
+
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the scheduler with synthetic catalogs")
+    parser.add_argument('--num-fields', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Catalog sizes to benchmark, defaults to 100 1000 10000')
+    parser.add_argument('--time', default='2016-08-13 10:00:00',
+                        help='Scheduling time (sets POCSTIME), defaults to 2016-08-13 10:00:00')
+    parser.add_argument('--catalog-dir', default=None,
+                        help='Directory for catalog files, defaults to $PANDIR/benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of warm passes to time')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the catalogs')
+    parser.add_argument('--memory', action='store_true', default=False,
+                        help='Report peak memory (MB) rather than run time (s)')
+    parser.add_argument('--no-catalog-cache', dest='catalog_cache', action='store_false', default=True,
+                        help='Always parse the catalog rather than using the compiled cache')
+
+    args = parser.parse_args()
+
+    iers.conf.auto_download = False
+    os.environ['POCSTIME'] = Time(args.time).isot
+
+    if args.catalog_dir is None:
+        args.catalog_dir = os.path.join(os.getenv('PANDIR', default='/var/panoptes'), 'benchmarks')
+
+    loc = load_config()['location']
+    observer = Observer(location=EarthLocation(lon=loc['longitude'], lat=loc['latitude'], height=loc['elevation']),
+                        name=loc['name'], timezone=loc['timezone'])
+
+    constraints = [MoonAvoidance(), Duration(30 * u.deg)]
+
+    print("Scheduling time: {}".format(current_time().isot))
+    for num_fields in args.num_fields:
+        fields_file = write_catalog(num_fields, args.catalog_dir, seed=args.seed)
+
+        results = benchmark(fields_file, observer, constraints, repeat=args.repeat, memory=args.memory,
+                            catalog_cache=args.catalog_cache)
+
+        print("{} fields ({})".format(num_fields, fields_file))
+        for name, value in results.items():
+            print("\t{:<45} {:>10.3f} {}".format(name, value, 'MB' if args.memory else 's'))
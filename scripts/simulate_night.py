@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Simulate a night of observing with the scheduler
+
+Runs the dispatch scheduler over a whole night with a virtual clock (see
+`~pocs.scheduler.simulator.SchedulerSimulator`) and prints the timeline of
+observations followed by a summary for each field. Useful for checking a new
+target list without running the state machine for a whole night.
+
+Example:
+    python $POCS/scripts/simulate_night.py --fields-file simple.yaml --date 2016-08-13
+"""
+import os
+
+from astroplan import Observer
+from astropy import units as u
+from astropy.coordinates import EarthLocation
+from astropy.time import Time
+from astropy.utils import iers
+
+from pocs.scheduler.constraint import Duration
+from pocs.scheduler.constraint import MoonAvoidance
+from pocs.scheduler.dispatch import Scheduler
+from pocs.scheduler.simulator import SchedulerSimulator
+from pocs.utils.config import load_config
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate a night of observing")
+    parser.add_argument('--fields-file', default=None,
+                        help='Fields file, relative to the targets directory, defaults to the scheduler config')
+    parser.add_argument('--date', default=None,
+                        help='Start of the simulation (UTC), defaults to now. The night following this is simulated')
+    parser.add_argument('--slew-time', type=float, default=120, help='Slew time in seconds')
+    parser.add_argument('--readout-time', type=float, default=10, help='Time between exposures in seconds')
+
+    args = parser.parse_args()
+
+    iers.conf.auto_download = False
+
+    config = load_config()
+
+    fields_file = args.fields_file or config['scheduler'].get('fields_file', 'simple.yaml')
+    if not fields_file.startswith('/'):
+        fields_file = os.path.join(config['directories']['targets'], fields_file)
+
+    loc = config['location']
+    observer = Observer(location=EarthLocation(lon=loc['longitude'], lat=loc['latitude'], height=loc['elevation']),
+                        name=loc['name'], timezone=loc['timezone'])
+
+    scheduler = Scheduler(observer, fields_file=fields_file, constraints=[MoonAvoidance(), Duration(30 * u.deg)])
+
+    simulator = SchedulerSimulator(scheduler, slew_time=args.slew_time * u.second,
+                                   readout_time=args.readout_time * u.second)
+
+    start_time = Time(args.date) if args.date is not None else None
+
+    print("Timeline:")
+    for block in simulator.run(start_time=start_time):
+        print("\t{} - {}  {:<30} {:>4} exposures  merit {:.2f}".format(
+            block.start.isot[:19], block.end.isot[11:19], block.name or '(idle)', block.num_exposures, block.merit))
+
+    print("Summary:")
+    for name, info in simulator.summary().items():
+        if name == 'idle':
+            print("\t{:<30} {:>8.0f} s".format('(idle)', info['time']))
+        else:
+            print("\t{:<30} {:>8.0f} s  {:>4} exposures  {} visits".format(
+                name, info['exposure_time'], info['exposures'], info['visits']))